@@ -1,6 +1,6 @@
 import os
 from flask import Flask, render_template
-from .extensions import db, migrate, login_manager
+from .extensions import db, login_manager, fragment_cache, assets
 from .models import User
 
 def create_app(config_name='default'):
@@ -13,14 +13,19 @@ def create_app(config_name='default'):
     from config import config
     app.config.from_object(config[config_name]())
 
-    # Load environment variables
-    from dotenv import load_dotenv
-    load_dotenv()
-
     # Initialize extensions
     db.init_app(app)
-    migrate.init_app(app, db)
     login_manager.init_app(app)
+    fragment_cache.init_app(app)
+    assets.init_app(app)
+
+    from . import metrics, contadores, audit, autocompletar, trabajos, adjuntos
+    metrics.init_app(app)
+    contadores.init_app(app)
+    audit.init_app(app)
+    autocompletar.init_app(app)
+    trabajos.init_app(app)
+    adjuntos.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
@@ -32,12 +37,16 @@ def create_app(config_name='default'):
     from .routes.supervisores import bp as supervisores_bp
     from .routes.admins import bp as admins_bp
     from .routes.main import bp as main_bp
+    from .routes.api import bp as api_bp
+    from .routes.adjuntos import bp as adjuntos_bp
 
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp)
     app.register_blueprint(usuarios_bp)
     app.register_blueprint(supervisores_bp)
     app.register_blueprint(admins_bp)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(adjuntos_bp)
 
     # Error handlers
     @app.errorhandler(404)
@@ -49,7 +58,11 @@ def create_app(config_name='default'):
         db.session.rollback()
         return render_template('errors/500.html'), 500
 
-    # Create upload folder if it doesn't exist
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # Template filters and CLI commands (schema/seed work lives in the CLI,
+    # so building the app never touches the database or the filesystem)
+    from .utils import register_template_filters
+    from .cli import register_commands
+    register_template_filters(app)
+    register_commands(app)
 
     return app
\ No newline at end of file
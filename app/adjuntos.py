@@ -0,0 +1,375 @@
+"""
+Invoice attachments: streamed uploads into content-addressed storage.
+
+Uploads never sit in memory. ``Solicitud`` (the app's request class) hands
+werkzeug's multipart parser an ``Entrante`` for every file part. As the
+parser writes each chunk, ``Entrante`` appends it to a temporary file,
+feeds it to SHA-256 and counts it. The upload is rejected with 413 as
+soon as the count passes ``UPLOAD_MAX_SIZE``, rather than after the whole
+body has been received. Raw request bodies (the API) go through the same
+class via ``recibir``.
+
+Storage is keyed by content. A file is stored once under
+``BLOBS_DIR/ab/cd/<sha256>``, with one ``Blob`` row, however many invoices
+it is attached to. Each ``Adjunto`` links an invoice to a blob. The blob
+counts its attachments in ``referencias``, kept in step at flush time
+like the invoice counters (app/contadores.py). When the count drops to
+zero the blob gets ``liberado_en``, and ``purgar`` deletes it after
+``UPLOAD_ORPHAN_GRACE`` seconds. The grace covers files left behind by a
+rolled-back upload. An upload of the same content racing the purge
+refreshes ``liberado_en`` in its upsert of the blob row, so purgar's
+conditional DELETE no longer matches it (or, if the DELETE won, the upsert
+inserts the row again), and purgar leaves alone any file an upload touched
+within the grace period.
+"""
+
+import hashlib
+import mimetypes
+import os
+import tempfile
+import time
+import unicodedata
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from flask import current_app, request, send_file
+from flask.wrappers import Request
+from sqlalchemy import case, event
+from werkzeug.exceptions import RequestEntityTooLarge
+from .extensions import db
+from .models import Adjunto, Blob
+
+EXTENSIONES = {"pdf", "doc", "docx", "xls", "xlsx", "jpg", "jpeg", "png"}
+
+# First bytes each type must start with; a renamed executable is not a PDF
+FIRMAS = {
+    "pdf": (b"%PDF-",),
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "jpg": (b"\xff\xd8\xff",),
+    "jpeg": (b"\xff\xd8\xff",),
+    "docx": (b"PK\x03\x04",),
+    "xlsx": (b"PK\x03\x04",),
+    "doc": (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1",),
+    "xls": (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1",),
+}
+_CABECERA = 16
+
+
+class AdjuntoInvalido(ValueError):
+    """The upload cannot be attached; the message is shown to the user"""
+
+
+# =====================
+# Receiving
+# =====================
+class Entrante:
+    """Writable temporary file that hashes and counts what is written to it.
+
+    Readable and seekable too, as werkzeug requires of upload streams. The
+    file is deleted on close unless ``retirar`` moved it into storage first.
+    """
+
+    def __init__(self, limite=None):
+        fd, self.ruta = tempfile.mkstemp(suffix=".part", dir=directorio_temporal())
+        self._archivo = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self.limite = limite
+        self.tamano = 0
+        self.cabecera = b""
+
+    def write(self, datos):
+        self.tamano += len(datos)
+        if self.limite and self.tamano > self.limite:
+            raise RequestEntityTooLarge(f"File larger than {self.limite // (1024 * 1024)}MB")
+        if len(self.cabecera) < _CABECERA:
+            self.cabecera += bytes(datos[:_CABECERA - len(self.cabecera)])
+        self._hash.update(datos)
+        return self._archivo.write(datos)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def retirar(self, destino):
+        """Move the file to ``destino``; it is no longer deleted on close"""
+        self._archivo.close()
+        os.chmod(self.ruta, 0o644)
+        os.replace(self.ruta, destino)
+        self.ruta = None
+
+    def close(self):
+        self._archivo.close()
+        if self.ruta:
+            try:
+                os.unlink(self.ruta)
+            except FileNotFoundError:
+                pass
+            self.ruta = None
+
+    def __getattr__(self, nombre):
+        # read, readline, seek, tell, flush, closed... of the underlying file
+        return getattr(self._archivo, nombre)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Solicitud(Request):
+    """Request whose file uploads are streamed into an ``Entrante``"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        entrante = Entrante(current_app.config["UPLOAD_MAX_SIZE"])
+        # kept here as well: a part cut off at the limit never reaches request.files
+        self.__dict__.setdefault("_entrantes", []).append(entrante)
+        return entrante
+
+    def close(self):
+        super().close()
+        for entrante in self.__dict__.pop("_entrantes", ()):
+            entrante.close()
+
+
+def directorio_temporal():
+    # inside BLOBS_DIR so that moving a finished upload into place is a rename
+    directorio = os.path.join(current_app.config["BLOBS_DIR"], "tmp")
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def recibir(stream, limite=None):
+    """Copy ``stream`` into a new ``Entrante`` chunk by chunk (UPLOAD_CHUNK_SIZE)"""
+    config = current_app.config
+    entrante = Entrante(config["UPLOAD_MAX_SIZE"] if limite is None else limite)
+    try:
+        while True:
+            bloque = stream.read(config["UPLOAD_CHUNK_SIZE"])
+            if not bloque:
+                break
+            entrante.write(bloque)
+    except BaseException:
+        entrante.close()
+        raise
+    entrante.seek(0)
+    return entrante
+
+
+# =====================
+# Storage
+# =====================
+def ruta(sha256):
+    """Path of a blob's file"""
+    return os.path.join(current_app.config["BLOBS_DIR"], sha256[:2], sha256[2:4], sha256)
+
+
+def tipo_de(nombre, cabecera):
+    """MIME type for a file name whose content starts with ``cabecera``"""
+    extension = nombre.rsplit(".", 1)[-1].lower() if "." in nombre else ""
+    if extension not in EXTENSIONES:
+        raise AdjuntoInvalido(f"Tipo de archivo no permitido. Permitidos: {', '.join(sorted(EXTENSIONES))}")
+    if not cabecera.startswith(FIRMAS[extension]):
+        raise AdjuntoInvalido("El contenido del archivo no corresponde a su extensión.")
+    return mimetypes.guess_type(nombre)[0] or "application/octet-stream"
+
+
+def _insertar_blob(sha256, tamano, tipo_mime):
+    """Create the blob row if it does not exist (with no references yet).
+
+    An existing unreferenced row gets a fresh ``liberado_en``: the write
+    (and its row lock) makes a concurrent ``purgar`` skip it.
+    """
+    tabla = Blob.__table__
+    ahora = datetime.utcnow()
+    valores = dict(sha256=sha256, tamano=tamano, tipo_mime=tipo_mime, referencias=0,
+                   creado_en=ahora, liberado_en=ahora)
+    liberado_en = case((tabla.c.referencias <= 0, ahora), else_=tabla.c.liberado_en)
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto in ("sqlite", "postgresql"):
+        if dialecto == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        db.session.execute(insert(tabla).values(**valores).on_conflict_do_update(
+            index_elements=[tabla.c.sha256], set_={"liberado_en": liberado_en}))
+        return
+    if db.session.get(Blob, sha256) is None:
+        db.session.add(Blob(**valores))
+        db.session.flush()
+    else:
+        db.session.execute(tabla.update().where(tabla.c.sha256 == sha256).values(liberado_en=liberado_en))
+
+
+def adjuntar(factura, archivo, nombre, usuario):
+    """Attach an upload (FileStorage or stream) to ``factura``; returns (Adjunto, nuevo).
+
+    Attaching the same content to the same invoice again returns the
+    existing attachment. The caller commits.
+    """
+    stream = getattr(archivo, "stream", archivo)
+    if isinstance(stream, Entrante):
+        return _adjuntar(factura, stream, nombre, usuario)
+    # not parsed by Solicitud (e.g. a stream built in code): receive it first
+    with recibir(stream) as entrante:
+        return _adjuntar(factura, entrante, nombre, usuario)
+
+
+def _adjuntar(factura, entrante, nombre, usuario):
+    nombre = os.path.basename(nombre.replace("\\", "/")).strip()[:255]
+    if entrante.tamano == 0:
+        raise AdjuntoInvalido("El archivo está vacío.")
+    tipo_mime = tipo_de(nombre, entrante.cabecera)
+    sha256 = entrante.sha256
+
+    existente = Adjunto.query.filter_by(factura_id=factura.id, blob_sha256=sha256).first()
+    if existente:
+        return existente, False
+
+    destino = ruta(sha256)
+    if os.path.exists(destino):
+        # already stored; a fresh mtime keeps purgar's sweep off it until this commits
+        os.utime(destino)
+    else:
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        entrante.retirar(destino)
+    _insertar_blob(sha256, entrante.tamano, tipo_mime)
+
+    adjunto = Adjunto(factura_id=factura.id, blob_sha256=sha256, nombre=nombre,
+                      subido_por_id=usuario.id if usuario else None)
+    db.session.add(adjunto)
+    return adjunto, True
+
+
+# =====================
+# Downloads
+# =====================
+# Types a browser may show in the page instead of downloading
+EN_LINEA = ("application/pdf", "image/jpeg", "image/png")
+
+
+def _disposicion(respuesta, nombre, en_linea):
+    # same encoding as send_file: ASCII fallback plus RFC 5987 filename*
+    try:
+        nombre.encode("ascii")
+        nombres = {"filename": nombre}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", nombre).encode("ascii", "ignore").decode("ascii")
+        nombres = {"filename": simple, "filename*": f"UTF-8''{quote(nombre, safe='!#$&+^`|~')}"}
+    respuesta.headers.set("Content-Disposition", "inline" if en_linea else "attachment", **nombres)
+
+
+def servir(adjunto, en_linea=False):
+    """Response with the attachment's bytes; the caller has checked permissions.
+
+    With ATTACHMENTS_SENDFILE set, the response only names the file, and
+    the front server (Apache mod_xsendfile, nginx X-Accel-Redirect) sends
+    it, ranges included, without holding a gunicorn worker for the
+    transfer. Otherwise send_file answers conditional and Range requests
+    itself.
+    """
+    config = current_app.config
+    blob = adjunto.blob
+    en_linea = en_linea and blob.tipo_mime in EN_LINEA
+    modo = config["ATTACHMENTS_SENDFILE"]
+
+    if modo:
+        respuesta = current_app.response_class(mimetype=blob.tipo_mime)
+        respuesta.set_etag(blob.sha256)
+        if request.if_none_match.contains(blob.sha256):
+            respuesta.status_code = 304
+        elif modo == "x-accel-redirect":
+            respuesta.headers["X-Accel-Redirect"] = config["ATTACHMENTS_ACCEL_PREFIX"].rstrip("/") + "/" + \
+                os.path.relpath(ruta(blob.sha256), config["BLOBS_DIR"]).replace(os.sep, "/")
+        elif modo == "x-sendfile":
+            respuesta.headers["X-Sendfile"] = os.path.abspath(ruta(blob.sha256))
+        else:
+            raise ValueError("ATTACHMENTS_SENDFILE must be '', 'x-sendfile' or 'x-accel-redirect'")
+    else:
+        respuesta = send_file(ruta(blob.sha256), mimetype=blob.tipo_mime, etag=blob.sha256,
+                              conditional=True, max_age=0)
+    _disposicion(respuesta, adjunto.nombre, en_linea)
+    # the bytes never change, but access can be revoked: revalidate every time (a 304 is cheap)
+    respuesta.cache_control.private = True
+    respuesta.cache_control.public = False
+    respuesta.cache_control.no_cache = True
+    respuesta.headers["X-Content-Type-Options"] = "nosniff"
+    return respuesta
+
+
+def quitar(adjunto):
+    """Remove an attachment; the blob is purged later if nothing else uses it"""
+    db.session.delete(adjunto)
+
+
+def _contar_referencias(session, flush_context, instances):
+    deltas = {}
+    for obj in session.new:
+        if isinstance(obj, Adjunto):
+            deltas[obj.blob_sha256] = deltas.get(obj.blob_sha256, 0) + 1
+    for obj in session.deleted:
+        if isinstance(obj, Adjunto):
+            deltas[obj.blob_sha256] = deltas.get(obj.blob_sha256, 0) - 1
+
+    ahora = datetime.utcnow()
+    tabla = Blob.__table__
+    # sorted so concurrent transactions lock blob rows in the same order
+    for sha256, delta in sorted(deltas.items()):
+        if delta:
+            session.execute(tabla.update().where(tabla.c.sha256 == sha256).values(
+                referencias=tabla.c.referencias + delta,
+                liberado_en=case((tabla.c.referencias + delta <= 0, ahora), else_=None),
+            ))
+
+
+def purgar(gracia=None):
+    """Delete unreferenced blobs and stray files older than ``gracia`` seconds; returns (blobs, files)"""
+    config = current_app.config
+    gracia = config["UPLOAD_ORPHAN_GRACE"] if gracia is None else gracia
+    limite = datetime.utcnow() - timedelta(seconds=gracia)
+
+    candidatos = [sha256 for (sha256,) in db.session.query(Blob.sha256).filter(
+        Blob.referencias <= 0, Blob.liberado_en < limite)]
+    borrados = []
+    for sha256 in candidatos:
+        # conditional: an upload may have referenced it since it was selected
+        if Blob.query.filter(Blob.sha256 == sha256, Blob.referencias <= 0, Blob.liberado_en < limite)\
+                .delete(synchronize_session=False):
+            borrados.append(sha256)
+    db.session.commit()
+
+    from . import miniaturas
+
+    archivos = 0
+    corte = time.time() - gracia
+    for sha256 in borrados:
+        miniaturas.borrar(sha256)
+        try:
+            # touched by an upload of the same content since: that upload owns the file now
+            # (and if it rolls back, the sweep below removes it once it is old enough)
+            if os.path.getmtime(ruta(sha256)) < corte:
+                os.unlink(ruta(sha256))
+                archivos += 1
+        except FileNotFoundError:
+            pass
+
+    # files without a row (rolled-back uploads) and temporary files of dead processes
+    for raiz, _, nombres in os.walk(config["BLOBS_DIR"]):
+        for nombre in nombres:
+            camino = os.path.join(raiz, nombre)
+            try:
+                if os.path.getmtime(camino) >= corte:
+                    continue
+                if nombre.endswith(".part") or db.session.get(Blob, nombre) is None:
+                    os.unlink(camino)
+                    archivos += 1
+            except FileNotFoundError:
+                pass
+    db.session.rollback()
+    return len(borrados), archivos
+
+
+def init_app(app):
+    """Stream uploads through Entrante and keep blob reference counts in step"""
+    app.request_class = Solicitud
+    if not event.contains(db.session, "before_flush", _contar_referencias):
+        event.listen(db.session, "before_flush", _contar_referencias)
@@ -0,0 +1,172 @@
+"""
+Static asset pipeline.
+
+``flask assets build`` copies every static asset to ``static/dist/`` under a
+content-hashed name (``css/base.css`` -> ``dist/css/base.3f2a9c1e7b4d.css``),
+precompresses it (gzip, and brotli when the ``brotli`` package is
+installed) and writes ``dist/manifest.json``.
+
+At runtime ``url_for('static', filename=...)`` is rewritten to the hashed
+name found in the manifest, hashed files are served with far-future
+immutable cache headers (using the precompressed variant the client
+accepts) and large HTML responses are gzip-compressed on the fly.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+
+DIST_DIR = "dist"
+MANIFEST = "manifest.json"
+ASSET_EXTENSIONS = {".css", ".js", ".svg", ".png", ".jpg", ".jpeg", ".gif", ".ico", ".woff", ".woff2"}
+COMPRESSIBLE = {".css", ".js", ".svg"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def build(static_folder, skip_dirs=("facturas",)):
+    """Fingerprint and precompress static assets; returns the manifest"""
+    dist = os.path.join(static_folder, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    brotli = _brotli()
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_folder):
+        rel_root = os.path.relpath(root, static_folder)
+        if rel_root == ".":
+            dirs[:] = [d for d in dirs if d != DIST_DIR and d not in skip_dirs]
+        for name in files:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in ASSET_EXTENSIONS:
+                continue
+
+            source = os.path.join(root, name)
+            with open(source, "rb") as fh:
+                data = fh.read()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+
+            logical = os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, "/")
+            hashed = os.path.normpath(os.path.join(DIST_DIR, rel_root, f"{stem}.{digest}{ext}")).replace(os.sep, "/")
+            target = os.path.join(static_folder, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as fh:
+                fh.write(data)
+
+            if ext.lower() in COMPRESSIBLE:
+                with open(target + ".gz", "wb") as fh:
+                    fh.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + ".br", "wb") as fh:
+                        fh.write(brotli.compress(data, quality=11))
+
+            manifest[logical] = hashed
+
+    os.makedirs(dist, exist_ok=True)
+    with open(os.path.join(dist, MANIFEST), "w") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    return manifest
+
+
+def _accepts(encoding):
+    # parsed and q-aware: "gzip;q=0" refuses gzip, and "br" does not match inside other tokens
+    return request.accept_encodings[encoding] > 0
+
+
+class Assets:
+    """Flask extension wiring the manifest, static serving and compression"""
+
+    def __init__(self, app=None):
+        self._manifest = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._manifest = None
+        app.extensions["assets"] = self
+        app.url_defaults(self._hashed_static_url)
+        app.view_functions["static"] = self._send_static
+        app.after_request(self._compress_html)
+        app.cli.add_command(assets_cli)
+
+    def manifest(self):
+        """Manifest loaded once per process; empty until `flask assets build` runs"""
+        if self._manifest is None:
+            path = os.path.join(current_app.static_folder, DIST_DIR, MANIFEST)
+            try:
+                with open(path) as fh:
+                    self._manifest = json.load(fh)
+            except FileNotFoundError:
+                self._manifest = {}
+        return self._manifest
+
+    def _hashed_static_url(self, endpoint, values):
+        if endpoint != "static" or not current_app.config.get("ASSETS_FINGERPRINT", True):
+            return
+        filename = values.get("filename")
+        if filename:
+            values["filename"] = self.manifest().get(filename, filename)
+
+    def _send_static(self, filename):
+        if not filename.startswith(DIST_DIR + "/"):
+            return current_app.send_static_file(filename)
+
+        directory = current_app.static_folder
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if _accepts(encoding) and os.path.isfile(os.path.join(directory, filename + suffix)):
+                response = send_from_directory(directory, filename + suffix, max_age=31536000)
+                response.headers["Content-Encoding"] = encoding
+                response.mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                break
+        else:
+            response = send_from_directory(directory, filename, max_age=31536000)
+
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def _compress_html(self, response):
+        min_size = current_app.config.get("COMPRESS_MIN_SIZE", 1024)
+        if (response.mimetype != "text/html"
+                or response.direct_passthrough
+                or response.status_code < 200 or response.status_code >= 300
+                or "Content-Encoding" in response.headers
+                or not _accepts("gzip")):
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        response.set_data(gzip.compress(data, compresslevel=current_app.config.get("COMPRESS_LEVEL", 6)))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        return response
+
+
+@click.group("assets")
+def assets_cli():
+    """Static asset pipeline"""
+
+
+@assets_cli.command("build")
+@with_appcontext
+def build_command():
+    """Fingerprint and precompress static assets"""
+    manifest = build(current_app.static_folder)
+    for logical, hashed in sorted(manifest.items()):
+        print(f"[OK] {logical} -> {hashed}")
+    if _brotli() is None:
+        print("[INFO] brotli not installed; only gzip variants were written")
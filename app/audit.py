@@ -0,0 +1,371 @@
+"""
+Invoice audit log (``HistorialFactura``).
+
+Every workflow action is recorded through ``registrar`` (one entry) or
+``registrar_varios`` (a batch). Entries are collected on the session and
+handled when it commits; a rollback discards them together with the
+change they describe. There are two modes:
+
+- ``sync``: the rows are added to the session and commit in the same
+  transaction as the state change. Calls with ``atomico=True`` always use
+  this mode. The supervisor and admin reviews use it, because the review
+  counters and ``/api/v1/cambios`` must never show a transition without its
+  entry.
+- ``write-behind`` (``AUDIT_MODE``): on commit the entries are appended to a
+  per-process spool file and queued in memory. A background thread inserts
+  them in batches on its own connection, once ``AUDIT_BATCH_SIZE`` entries
+  are waiting or at least every ``AUDIT_FLUSH_INTERVAL`` seconds, and then
+  deletes the spool segment it inserted. The request only pays for a file
+  append.
+
+A spool segment is deleted only after its batch has committed. Segments left
+behind by a dead process are replayed by the next writer that starts, or by
+``flask recuperar-auditoria``. If a crash happened between the insert and the
+delete, the segment's first entry is already in the table, and the segment
+is skipped instead of being inserted twice.
+
+Each writer names its segments ``audit-<pid>-<token>-<n>.jsonl`` with a
+random token of its own, creates every segment exclusively (never appending
+to an existing file), and holds an ``flock`` on ``audit-<pid>-<token>.lock``
+for as long as it lives. Recovery replays the segments of a token only once
+it can take that lock, so a new process that reuses a dead one's pid neither
+hides nor mixes with the dead process's segments. Lock files without
+segments are deleted only once their pid is gone.
+
+Write-behind entries appear on the history pages up to
+``AUDIT_FLUSH_INTERVAL`` seconds late. They reach the spool in the session's
+``after_commit`` hook, so a process killed between the commit and the spool
+write loses those entries while the change they describe stays committed.
+Transitions that must never lack their entry pass ``atomico=True``.
+"""
+
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from .extensions import db
+from .models import HistorialFactura
+from . import metrics
+
+SYNC = "sync"
+WRITE_BEHIND = "write-behind"
+MODOS = (SYNC, WRITE_BEHIND)
+
+# session.info key holding [(modo, entradas)] until the transaction ends
+_PENDIENTES = "auditoria_pendiente"
+_CAMPOS = ("factura_id", "usuario_id", "accion", "comentario", "estado_anterior", "estado_nuevo")
+
+
+def entrada(factura_id, usuario_id, accion, estado_anterior, estado_nuevo, comentario=None):
+    """One audit entry, timestamped now (when the action happened, not when it is written)"""
+    return {
+        "factura_id": factura_id,
+        "usuario_id": usuario_id,
+        "accion": accion,
+        "comentario": comentario,
+        "estado_anterior": estado_anterior,
+        "estado_nuevo": estado_nuevo,
+        "timestamp": datetime.utcnow(),
+    }
+
+
+def registrar(factura_id, usuario_id, accion, estado_anterior, estado_nuevo, comentario=None, atomico=False):
+    """Record one workflow action; written when the current transaction commits"""
+    registrar_varios(
+        [entrada(factura_id, usuario_id, accion, estado_anterior, estado_nuevo, comentario)],
+        atomico=atomico
+    )
+
+
+def registrar_varios(entradas, atomico=False):
+    """Record a batch of entries built with ``entrada``.
+
+    ``atomico=True`` forces the sync mode: the rows are part of the current
+    transaction whatever ``AUDIT_MODE`` says.
+    """
+    if not entradas:
+        return
+    modo = SYNC if atomico else current_app.config["AUDIT_MODE"]
+    if modo == SYNC:
+        db.session.add_all([HistorialFactura(**e) for e in entradas])
+    db.session.info.setdefault(_PENDIENTES, []).append((modo, entradas))
+
+
+def _al_confirmar(session):
+    pendientes = session.info.pop(_PENDIENTES, None)
+    if not pendientes:
+        return
+
+    diferidas = []
+    acciones = Counter()
+    for modo, entradas in pendientes:
+        if modo == WRITE_BEHIND:
+            diferidas.extend(entradas)
+        acciones.update(e["accion"] for e in entradas)
+
+    if diferidas:
+        current_app.extensions["auditoria"].encolar(diferidas)
+    for accion, total in acciones.items():
+        metrics.record_transition(accion, total)
+
+
+def _al_revertir(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(_PENDIENTES, None)
+
+
+# =====================
+# Write-behind
+# =====================
+def _a_linea(e):
+    return json.dumps(dict(e, timestamp=e["timestamp"].isoformat())) + "\n"
+
+
+def _leer_segmento(ruta):
+    """Entries of a spool file; a truncated last line (crash mid-write) is dropped"""
+    entradas = []
+    with open(ruta, encoding="utf-8") as archivo:
+        for linea in archivo:
+            try:
+                e = json.loads(linea)
+            except ValueError:
+                break
+            e["timestamp"] = datetime.fromisoformat(e["timestamp"])
+            entradas.append(e)
+    return entradas
+
+
+def _ya_insertado(e):
+    return db.session.query(HistorialFactura.id).filter_by(
+        factura_id=e["factura_id"], usuario_id=e["usuario_id"],
+        accion=e["accion"], timestamp=e["timestamp"]
+    ).first() is not None
+
+
+def _insertar(entradas):
+    """Insert a batch in one transaction.
+
+    If the batch is refused (e.g. an invoice was deleted before its entry
+    got written), the rows are retried one by one and the refused ones are
+    logged and dropped, so one bad row cannot block the spool forever.
+    """
+    tabla = HistorialFactura.__table__
+    filas = [{campo: e[campo] for campo in _CAMPOS + ("timestamp",)} for e in entradas]
+    try:
+        with db.engine.begin() as conexion:
+            conexion.execute(tabla.insert(), filas)
+        return len(filas)
+    except IntegrityError:
+        pass
+
+    insertadas = 0
+    for fila in filas:
+        try:
+            with db.engine.begin() as conexion:
+                conexion.execute(tabla.insert(), [fila])
+            insertadas += 1
+        except IntegrityError:
+            current_app.logger.error("Audit entry refused and dropped: %s", fila)
+    return insertadas
+
+
+def _bloquear(ruta, esperar=False):
+    """Open ``ruta`` and take its exclusive flock; None if another process holds it.
+
+    Recovery deletes a lock file while holding it, so a process that opened
+    the file just before that would lock an unlinked inode. The lock only
+    counts once the inode we hold is still the one at ``ruta``; otherwise
+    the file is opened again.
+    """
+    while True:
+        archivo = open(ruta, "a")
+        try:
+            fcntl.flock(archivo, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            archivo.close()
+            return None
+        try:
+            if os.stat(ruta).st_ino == os.fstat(archivo.fileno()).st_ino:
+                return archivo
+        except FileNotFoundError:
+            pass
+        archivo.close()
+
+
+def _vivo(ruta_bloqueo):
+    """Whether the process named by a lock file (``audit-<pid>-<token>.lock``) still runs"""
+    try:
+        pid = int(os.path.basename(ruta_bloqueo)[len("audit-"):].split("-")[0].split(".")[0])
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _duenio(ruta):
+    """Writer token of a segment: ``<pid>-<token>`` (or ``<pid>`` for old segments)"""
+    partes = os.path.basename(ruta)[len("audit-"):-len(".jsonl")].split("-")
+    return "-".join(partes[:-1])
+
+
+def recuperar(directorio=None):
+    """Replay spool segments left by dead processes; returns entries inserted"""
+    directorio = directorio or current_app.config["AUDIT_SPOOL_DIR"]
+    segmentos = {}
+    for ruta in sorted(glob.glob(os.path.join(directorio, "audit-*.jsonl"))):
+        segmentos.setdefault(_duenio(ruta), []).append(ruta)
+
+    insertadas = 0
+    for duenio, rutas in segmentos.items():
+        ruta_bloqueo = os.path.join(directorio, f"audit-{duenio}.lock")
+        # a writer creates its lock before its first segment, so segments without one are orphans
+        bloqueo = _bloquear(ruta_bloqueo) if os.path.exists(ruta_bloqueo) else None
+        if os.path.exists(ruta_bloqueo) and bloqueo is None:
+            continue  # the writer is alive (or another process is replaying it)
+        try:
+            for ruta in rutas:
+                entradas = _leer_segmento(ruta)
+                if entradas and not _ya_insertado(entradas[0]):
+                    insertadas += _insertar(entradas)
+                os.remove(ruta)
+            if bloqueo is not None:
+                os.remove(ruta_bloqueo)
+        finally:
+            if bloqueo is not None:
+                bloqueo.close()
+
+    # locks of dead writers that never wrote a segment
+    for ruta_bloqueo in glob.glob(os.path.join(directorio, "audit-*.lock")):
+        if _vivo(ruta_bloqueo):
+            continue
+        bloqueo = _bloquear(ruta_bloqueo)
+        if bloqueo is not None:
+            os.remove(ruta_bloqueo)
+            bloqueo.close()
+    return insertadas
+
+
+class EscritorAuditoria:
+    """Per-process spool + buffer + flusher thread for the write-behind mode.
+
+    Nothing is opened or started until the first entry is queued, so
+    create_app() stays free of side effects, and a forked worker starts
+    with a clean writer of its own.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.directorio = app.config["AUDIT_SPOOL_DIR"]
+        self.tamano_lote = app.config["AUDIT_BATCH_SIZE"]
+        self.intervalo = app.config["AUDIT_FLUSH_INTERVAL"]
+        self.fsync = app.config["AUDIT_FSYNC"]
+        self._reiniciar()
+        os.register_at_fork(after_in_child=self._reiniciar)
+
+    def _reiniciar(self):
+        if getattr(self, "_bloqueo", None) is not None:
+            # forked child: the lock stays with the parent, which keeps writing its own segments
+            self._bloqueo.close()
+        self._token = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self._bloqueo = None
+        self._lock = threading.Lock()
+        self._lock_vaciado = threading.Lock()
+        self._despertar = threading.Event()
+        self._buffer = []
+        self._spool = None
+        self._segmento = 0
+        self._por_insertar = []  # closed [(segment path, entries)], oldest first
+        self._hilo = None
+
+    def _abrir_segmento(self):
+        self._segmento += 1
+        os.makedirs(self.directorio, exist_ok=True)
+        if self._bloqueo is None:
+            # held until the process exits; recovery leaves this writer's segments alone meanwhile
+            self._bloqueo = _bloquear(os.path.join(self.directorio, f"audit-{self._token}.lock"), esperar=True)
+        ruta = os.path.join(self.directorio, f"audit-{self._token}-{self._segmento:06d}.jsonl")
+        self._spool = open(ruta, "x", encoding="utf-8")
+
+    def _arrancar(self):
+        self._hilo = threading.Thread(target=self._bucle, name="auditoria", daemon=True)
+        self._hilo.start()
+        atexit.register(self.vaciar)
+
+    def encolar(self, entradas):
+        """Make entries durable in the spool and queue them for the next batch"""
+        lineas = "".join(_a_linea(e) for e in entradas)
+        with self._lock:
+            if self._hilo is None:
+                self._arrancar()
+            if self._spool is None:
+                self._abrir_segmento()
+            self._spool.write(lineas)
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            self._buffer.extend(entradas)
+            lleno = len(self._buffer) >= self.tamano_lote
+        if lleno:
+            self._despertar.set()
+
+    def vaciar(self):
+        """Insert everything queued so far; returns entries inserted"""
+        with self._lock_vaciado:
+            with self._lock:
+                if self._buffer:
+                    self._spool.close()
+                    self._por_insertar.append((self._spool.name, self._buffer))
+                    self._spool = None
+                    self._buffer = []
+
+            insertadas = 0
+            with self.app.app_context():
+                while self._por_insertar:
+                    ruta, entradas = self._por_insertar[0]
+                    try:
+                        insertadas += _insertar(entradas)
+                    except Exception:
+                        # database unavailable: the segment stays on disk and is retried
+                        self.app.logger.exception("Could not write the audit batch")
+                        break
+                    os.remove(ruta)
+                    self._por_insertar.pop(0)
+            return insertadas
+
+    def pendientes(self):
+        with self._lock:
+            return len(self._buffer) + sum(len(entradas) for _, entradas in self._por_insertar)
+
+    def _bucle(self):
+        with self.app.app_context():
+            try:
+                recuperar(self.directorio)
+            except Exception:
+                self.app.logger.exception("Could not replay the audit spool")
+        while True:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            self.vaciar()
+
+
+def init_app(app):
+    """Check AUDIT_MODE and hook the audit log into the session's transactions"""
+    if app.config["AUDIT_MODE"] not in MODOS:
+        raise ValueError(f"AUDIT_MODE must be one of {', '.join(MODOS)}")
+    app.extensions["auditoria"] = EscritorAuditoria(app)
+    if not event.contains(db.session, "after_commit", _al_confirmar):
+        event.listen(db.session, "after_commit", _al_confirmar)
+        event.listen(db.session, "after_soft_rollback", _al_revertir)
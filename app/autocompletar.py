@@ -0,0 +1,221 @@
+"""
+Autocomplete for the invoice identification fields.
+
+For each field in ``CAMPOS`` there is one prefix trie per requester, and
+one global trie for supervisors and admins. A requester is only offered
+values from their own invoices. Every trie node keeps the ``TOP_K`` most
+used values below it, so a lookup walks the prefix and returns that list:
+O(len(prefix)), with no sorting and no SQL.
+
+Keys are normalised (case- and accent-insensitive, whitespace collapsed).
+The values themselves keep their original spelling, so typing "acme"
+offers the most used way of writing it, e.g. "ACME, S.A. de C.V.".
+Counts only grow, which keeps each node's top-k exact with one pass over
+the path on every insert.
+
+The index is built from one grouped query, at worker start (gunicorn's
+``post_worker_init``) or on the first lookup. It is kept current
+incrementally:
+
+- invoices this worker commits are added from the session's
+  ``after_commit``, with no extra query;
+- invoices other workers created are picked up by a catch-up query on
+  ``id > last seen``, at most every ``AUTOCOMPLETE_SYNC_INTERVAL`` seconds.
+
+On PostgreSQL a lower id can commit after a higher one, so the catch-up
+also re-reads the ``AUTOCOMPLETE_SYNC_OVERLAP`` ids below the watermark.
+The ids already counted in that window are remembered, so nothing is
+counted twice. SQLite commits one transaction at a time and needs no
+overlap.
+
+Edits to existing invoices are not counted until the index is rebuilt
+(worker restart).
+"""
+
+import threading
+import time
+import unicodedata
+from flask import current_app
+from sqlalchemy import event, func
+from .extensions import db
+from .models import Factura
+
+CAMPOS = ("importador", "rfc", "numero_aduana", "patente_aduanal")
+TOP_K = 10
+GLOBAL = 0
+
+# session.info key holding (id, usuario_id, {campo: valor}) of inserted invoices until commit
+_INSERTADAS = "autocompletar_insertadas"
+
+
+def normalizar(texto):
+    """Lookup key: casefolded, without accents, single spaces"""
+    sin_acentos = unicodedata.normalize("NFKD", texto)
+    sin_acentos = "".join(c for c in sin_acentos if not unicodedata.combining(c))
+    return " ".join(sin_acentos.casefold().split())
+
+
+class _Nodo:
+    __slots__ = ("hijos", "mejores")
+
+    def __init__(self):
+        self.hijos = {}
+        self.mejores = ()  # ((usos, valor), ...) most used first
+
+
+class Trie:
+    """Prefix trie whose nodes cache their top-k values by use count"""
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self.raiz = _Nodo()
+        self.usos = {}
+
+    def __len__(self):
+        return len(self.usos)
+
+    def agregar(self, valor, veces=1):
+        usos = self.usos.get(valor, 0) + veces
+        self.usos[valor] = usos
+        nodo = self.raiz
+        self._actualizar(nodo, valor, usos)
+        for caracter in normalizar(valor):
+            nodo = nodo.hijos.setdefault(caracter, _Nodo())
+            self._actualizar(nodo, valor, usos)
+
+    def _actualizar(self, nodo, valor, usos):
+        mejores = [par for par in nodo.mejores if par[1] != valor]
+        if len(mejores) == len(nodo.mejores) and len(mejores) >= self.k and usos <= mejores[-1][0]:
+            return
+        mejores.append((usos, valor))
+        mejores.sort(key=lambda par: (-par[0], par[1]))
+        # a new tuple, so a concurrent reader sees the old list or the new one
+        nodo.mejores = tuple(mejores[:self.k])
+
+    def buscar(self, prefijo, limite=None):
+        nodo = self.raiz
+        for caracter in normalizar(prefijo):
+            nodo = nodo.hijos.get(caracter)
+            if nodo is None:
+                return []
+        return list(nodo.mejores[:limite or self.k])
+
+
+class IndiceAutocompletar:
+    """All the tries of one worker, plus the id watermark for catch-up"""
+
+    def __init__(self, solape=0):
+        self._lock = threading.Lock()
+        self.tries = {}
+        self.ultimo_id = 0
+        self.solape = solape
+        self.aplicadas = set()  # ids above ultimo_id - solape already counted
+        self.sincronizado = 0.0
+
+    def _trie(self, campo, ambito):
+        trie = self.tries.get((campo, ambito))
+        if trie is None:
+            trie = self.tries[(campo, ambito)] = Trie()
+        return trie
+
+    def _agregar(self, usuario_id, campo, valor, veces=1):
+        valor = (valor or "").strip()
+        if valor:
+            self._trie(campo, usuario_id).agregar(valor, veces)
+            self._trie(campo, GLOBAL).agregar(valor, veces)
+
+    def construir(self):
+        """Load every (requester, value, count) with one grouped query per field"""
+        with self._lock:
+            self.ultimo_id = db.session.query(func.max(Factura.id)).scalar() or 0
+            for campo in CAMPOS:
+                columna = getattr(Factura, campo)
+                filas = db.session.query(Factura.usuario_id, columna, func.count())\
+                    .filter(Factura.id <= self.ultimo_id)\
+                    .group_by(Factura.usuario_id, columna).all()
+                for usuario_id, valor, veces in filas:
+                    self._agregar(usuario_id, campo, valor, veces)
+            if self.solape:
+                self.aplicadas = {i for i, in db.session.query(Factura.id).filter(
+                    Factura.id > self.ultimo_id - self.solape, Factura.id <= self.ultimo_id)}
+            self.sincronizado = time.monotonic()
+
+    def aplicar(self, insertadas):
+        """Add invoices committed by this worker"""
+        with self._lock:
+            for factura_id, usuario_id, valores in insertadas:
+                if factura_id <= self.ultimo_id - self.solape or factura_id in self.aplicadas:
+                    continue
+                self.aplicadas.add(factura_id)
+                for campo, valor in valores.items():
+                    self._agregar(usuario_id, campo, valor)
+
+    def sincronizar(self, intervalo):
+        """Add invoices other workers created since the last catch-up"""
+        if time.monotonic() - self.sincronizado < intervalo:
+            return
+        with self._lock:
+            self.sincronizado = time.monotonic()
+            filas = db.session.query(Factura.id, Factura.usuario_id, *[getattr(Factura, c) for c in CAMPOS])\
+                .filter(Factura.id > self.ultimo_id - self.solape).order_by(Factura.id).all()
+            for factura_id, usuario_id, *valores in filas:
+                if factura_id not in self.aplicadas:
+                    for campo, valor in zip(CAMPOS, valores):
+                        self._agregar(usuario_id, campo, valor)
+                    self.aplicadas.add(factura_id)
+            if filas:
+                self.ultimo_id = max(self.ultimo_id, filas[-1][0])
+                self.aplicadas = {i for i in self.aplicadas if i > self.ultimo_id - self.solape}
+
+    def buscar(self, campo, prefijo, ambito, limite=TOP_K):
+        trie = self.tries.get((campo, ambito))
+        return trie.buscar(prefijo, limite) if trie else []
+
+
+def indice():
+    """This worker's index, built on first use"""
+    actual = current_app.extensions.get("autocompletar")
+    if actual is None:
+        # SQLite commits one transaction at a time, so its ids already commit in order
+        solape = current_app.config["AUTOCOMPLETE_SYNC_OVERLAP"] if db.engine.dialect.name != "sqlite" else 0
+        actual = IndiceAutocompletar(solape)
+        actual.construir()
+        current_app.extensions["autocompletar"] = actual
+    return actual
+
+
+def sugerencias(campo, prefijo, usuario, limite=TOP_K):
+    """[(usos, valor)] for a prefix, restricted to the user's own invoices unless staff"""
+    actual = indice()
+    actual.sincronizar(current_app.config["AUTOCOMPLETE_SYNC_INTERVAL"])
+    ambito = usuario.id if usuario.is_usuario() else GLOBAL
+    return actual.buscar(campo, prefijo, ambito, limite)
+
+
+def _al_vaciar(session, flush_context):
+    nuevas = [
+        (obj.id, obj.usuario_id, {campo: getattr(obj, campo) for campo in CAMPOS})
+        for obj in session.new if isinstance(obj, Factura)
+    ]
+    if nuevas:
+        session.info.setdefault(_INSERTADAS, []).extend(nuevas)
+
+
+def _al_confirmar(session):
+    insertadas = session.info.pop(_INSERTADAS, None)
+    actual = current_app.extensions.get("autocompletar") if insertadas else None
+    if actual is not None:
+        actual.aplicar(insertadas)
+
+
+def _al_revertir(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(_INSERTADAS, None)
+
+
+def init_app(app):
+    """Feed committed invoice inserts into the worker's index"""
+    if not event.contains(db.session, "after_flush", _al_vaciar):
+        event.listen(db.session, "after_flush", _al_vaciar)
+        event.listen(db.session, "after_commit", _al_confirmar)
+        event.listen(db.session, "after_soft_rollback", _al_revertir)
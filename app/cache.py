@@ -0,0 +1,210 @@
+"""
+Fragment cache for rendered template blocks.
+
+Templates wrap expensive blocks in ``{% cache key, 'name', ... %}`` /
+``{% endcache %}``. The views build ``key`` with ``factura_fragment_key``,
+which changes whenever the invoice row or its history changes, so entries
+never need explicit invalidation: stale ones simply stop being read and are
+evicted by the backend's size bound.
+
+Backends (``FRAGMENT_CACHE_TYPE``):
+
+- ``lru``: in-process LRU bounded by ``FRAGMENT_CACHE_SIZE`` entries
+- ``filesystem``: files under ``FRAGMENT_CACHE_DIR``, shared by all workers
+- ``null``: caching disabled
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a bound on the number of entries"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileSystemCache:
+    """One file per entry, written atomically so several workers can share it"""
+
+    def __init__(self, directory, max_entries=5000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(value)
+        os.replace(tmp_path, self._path(key))
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def _prune(self):
+        """Drop the least recently written entries above max_entries"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith(".tmp"):
+                entries.append((entry.stat().st_mtime, entry.path))
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                os.remove(entry.path)
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache key, 'part', ... %}...{% endcache %}``; a None key disables caching"""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_cache_support", [nodes.List(parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache_support(self, parts, caller):
+        if parts[0] is None:
+            return caller()
+
+        backend = current_app.extensions["fragment_cache"].backend
+        key = ":".join(str(part) for part in parts)
+        value = backend.get(key)
+        if value is None:
+            value = caller()
+            backend.set(key, str(value))
+        return Markup(value)
+
+
+class FragmentCache:
+    """Flask extension holding the configured fragment cache backend"""
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache_type = app.config.get("FRAGMENT_CACHE_TYPE", "lru")
+        if cache_type == "lru":
+            self.backend = LRUCache(app.config.get("FRAGMENT_CACHE_SIZE", 512))
+        elif cache_type == "filesystem":
+            self.backend = FileSystemCache(
+                app.config["FRAGMENT_CACHE_DIR"],
+                app.config.get("FRAGMENT_CACHE_SIZE", 5000)
+            )
+        else:
+            self.backend = NullCache()
+
+        app.extensions["fragment_cache"] = self
+        app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+class LazyList:
+    """List that runs its loader on first use, so cached blocks skip the query"""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._items = None
+
+    def _load(self):
+        if self._items is None:
+            self._items = self._loader()
+        return self._items
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __bool__(self):
+        return bool(self._load())
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+
+def factura_fragment_key(factura, rol):
+    """Cache key base for an invoice's detail blocks.
+
+    Built from the invoice id, its actualizado_en, its latest history id and
+    the viewer's role; any transition or new history row yields a new key.
+    """
+    from .extensions import db
+    from .models import HistorialFactura
+
+    if current_app.config.get("FRAGMENT_CACHE_TYPE", "lru") == "null":
+        return None
+
+    ultimo_historial = db.session.query(db.func.max(HistorialFactura.id))\
+        .filter(HistorialFactura.factura_id == factura.id).scalar()
+    actualizado = factura.actualizado_en.isoformat() if factura.actualizado_en else ""
+    return f"factura:{factura.id}:{actualizado}:{ultimo_historial or 0}:{rol}"
@@ -0,0 +1,388 @@
+"""
+Load test of the invoice workflow (``flask bench load``).
+
+The app runs in its own process on a scratch database, seeded with the
+requested number of brokers (``usuario``), supervisors and admins. It is
+served by Werkzeug's threaded server, so the numbers measure the app and
+its database, not a particular gunicorn setup. A ``flask worker`` process
+runs next to it by default, so queued notifications compete for the
+database the way they do in production.
+
+Each simulated user is a thread with its own cookie session. It logs in
+through the login form and then loops over its role's workflow, pausing
+for an exponentially distributed think time between requests:
+
+- broker: open ``crear_factura``, submit a new invoice, then poll
+  ``mis_facturas`` a few times;
+- supervisor: list ``facturas_por_revisar``, open ``revisar_factura``
+  and approve it (or reject a share of them);
+- admin: open the dashboard, list ``facturas_pendientes``, open
+  ``aprobar_factura`` and approve it.
+
+Forms are posted the way a browser posts them: the CSRF token and the
+idempotency key come from the hidden inputs of the page. If a page fails
+to render, the session's last CSRF token and a fresh key are used, so
+the rest of the workflow is still exercised. Invoice ids come from the
+list pages. If a list page fails, they come from the invoices this run
+moved into that queue.
+
+The server process records every unhandled exception with its endpoint.
+Lock contention errors are counted separately: SQLite's "database is
+locked", and Postgres serialization failures, deadlocks and lock
+timeouts.
+"""
+
+import html
+import http.cookiejar
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+CLAVE = "carga"
+
+# SQLSTATEs of Postgres lock contention: serialization failure, deadlock, lock not available
+_CODIGOS_BLOQUEO = ("40001", "40P01", "55P03")
+
+
+def es_bloqueo(error):
+    """Whether a database error is lock contention rather than a bug"""
+    original = getattr(error, "orig", error)
+    return ("database is locked" in str(original).lower()
+            or getattr(original, "pgcode", None) in _CODIGOS_BLOQUEO)
+
+
+def correo(rol, numero):
+    return f"{rol}{numero}@carga.example.com"
+
+
+# =====================
+# Server process
+# =====================
+def servidor(config_name, usuarios, errores):
+    """Create and seed the scratch database, then serve the app on a free port.
+
+    Runs in the child process started by ``Prueba``. It prints the port as
+    a JSON line once it accepts connections, and appends one JSON line per
+    unhandled exception to ``errores``.
+    """
+    import logging
+    from flask import got_request_exception, request
+    from werkzeug.serving import make_server
+    from . import create_app
+    from .extensions import db
+    from .models import ConfiguracionTasas, User
+
+    app = create_app(config_name)
+    with app.app_context():
+        db.create_all()
+        for rol, cantidad in usuarios.items():
+            for numero in range(cantidad):
+                user = User(nombre=f"{rol} {numero}", email=correo(rol, numero), rol=rol,
+                            creditos=10 ** 6, activo=True)
+                user.set_password(CLAVE)
+                db.session.add(user)
+        db.session.add(ConfiguracionTasas(ieps=4.59, iva=0.16, pvr=0.20, iva_pvr=0.16))
+        db.session.commit()
+
+    lock = threading.Lock()
+    salida = open(errores, "a", buffering=1, encoding="utf-8")
+
+    def registrar(sender, exception, **extra):
+        linea = json.dumps({"endpoint": request.endpoint, "tipo": type(exception).__name__,
+                            "bloqueo": es_bloqueo(exception), "mensaje": str(exception)[:200]})
+        with lock:
+            salida.write(linea + "\n")
+
+    got_request_exception.connect(registrar, app)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    servidor_http = make_server("127.0.0.1", 0, app, threaded=True)
+    print(json.dumps({"puerto": servidor_http.server_port}), flush=True)
+    servidor_http.serve_forever()
+
+
+# =====================
+# Simulated users
+# =====================
+class _SinRedirecciones(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_INPUT = re.compile(r"<input\b[^>]*>", re.IGNORECASE)
+_ATRIBUTO = re.compile(r'(\w[\w-]*)="([^"]*)"')
+
+
+def ocultos(pagina):
+    """{name: value} of the page's hidden inputs"""
+    campos = {}
+    for etiqueta in _INPUT.findall(pagina):
+        atributos = {k.lower(): html.unescape(v) for k, v in _ATRIBUTO.findall(etiqueta)}
+        if atributos.get("type", "").lower() == "hidden" and "name" in atributos:
+            campos[atributos["name"]] = atributos.get("value", "")
+    return campos
+
+
+class Sesion:
+    """One browser: a cookie jar, the last CSRF token seen, and the timings it recorded"""
+
+    def __init__(self, prueba, rol, numero):
+        self.prueba = prueba
+        self.rol = rol
+        self.email = correo(rol, numero)
+        self.abridor = build_opener(HTTPCookieProcessor(http.cookiejar.CookieJar()), _SinRedirecciones())
+        self.csrf = ""
+
+    def pedir(self, paso, ruta, datos=None):
+        """GET (or POST ``datos``) ``ruta``; returns (status, body, Location path).
+
+        A GET succeeds with any 2xx or 3xx status. A form post succeeds only
+        with a redirect: a 200 is the form coming back with errors.
+        """
+        cuerpo = urlencode(datos).encode("utf-8") if datos is not None else None
+        peticion = Request(self.prueba.base + ruta, data=cuerpo)
+        inicio = time.perf_counter()
+        try:
+            with self.abridor.open(peticion, timeout=self.prueba.timeout) as respuesta:
+                status, pagina, destino = respuesta.status, respuesta.read(), respuesta.headers.get("Location")
+        except HTTPError as e:
+            status, pagina, destino = e.code, e.read(), e.headers.get("Location")
+        except (URLError, OSError):
+            status, pagina, destino = 0, b"", None
+        correcta = 300 <= status < 400 if datos is not None else 200 <= status < 400
+        self.prueba.anotar(self.rol, paso, correcta, (time.perf_counter() - inicio) * 1000)
+
+        pagina = pagina.decode("utf-8", "replace")
+        if status == 200:
+            self.csrf = ocultos(pagina).get("csrf_token", self.csrf)
+        return status, pagina, urlsplit(destino).path if destino else None
+
+    def formulario(self, paso, ruta):
+        """Open a form page; returns (status, body, hidden fields to post back)"""
+        status, pagina, _ = self.pedir(paso, ruta)
+        campos = ocultos(pagina) if status == 200 else {}
+        campos.setdefault("csrf_token", self.csrf)
+        campos.setdefault("idempotency_key", str(uuid.uuid4()))
+        return status, pagina, campos
+
+    def pausa(self):
+        self.prueba.detener.wait(random.expovariate(1 / self.prueba.pausa) if self.prueba.pausa else 0)
+
+    def entrar(self):
+        _, _, campos = self.formulario("login:form", "/auth/login")
+        status, _, _ = self.pedir("login", "/auth/login", dict(campos, email=self.email, password=CLAVE))
+        return status == 302
+
+    def ids(self, pagina, patron):
+        return [int(i) for i in re.findall(patron, pagina)]
+
+
+def corredor(sesion):
+    prueba = sesion.prueba
+    _, _, campos = sesion.formulario("crear_factura:form", "/usuarios/crear_factura")
+    sesion.pausa()
+    datos = dict(campos, importador=f"Importadora {random.randint(1, 50)}", rfc="CAR010101AAA",
+                 numero_pedimento=uuid.uuid4().hex[:15], numero_aduana=str(random.randint(1, 99)),
+                 patente_aduanal=str(random.randint(1000, 9999)), tipo="full",
+                 litros_rem1=str(random.randint(20000, 40000)), precio_molecula_galon="2.5")
+    status, _, destino = sesion.pedir("crear_factura", "/usuarios/crear_factura", datos)
+    creada = re.fullmatch(r"/usuarios/factura/(\d+)", destino or "")
+    if status == 302 and creada:
+        prueba.encolar("supervisor", int(creada.group(1)))
+    for _ in range(prueba.consultas):
+        if prueba.detener.is_set():
+            return
+        sesion.pausa()
+        sesion.pedir("mis_facturas", "/usuarios/facturas")
+
+
+def _revisar(sesion, lista, patron, formulario, cola_siguiente):
+    prueba = sesion.prueba
+    status, pagina, _ = sesion.pedir(*lista)
+    candidatas = sesion.ids(pagina, patron) if status == 200 else []
+    factura_id = random.choice(candidatas) if candidatas else prueba.siguiente(sesion.rol)
+    if factura_id is None:
+        sesion.pausa()
+        return
+    sesion.pausa()
+    ruta = formulario[1].format(factura_id)
+    _, _, campos = sesion.formulario(f"{formulario[0]}:form", ruta)
+    sesion.pausa()
+    if random.random() < prueba.rechazo:
+        campos.update(rechazar="Rechazar", comentario="Prueba de carga")
+    else:
+        campos.update(aprobar="Aprobar")
+    status, _, _ = sesion.pedir(formulario[0], ruta, campos)
+    if status == 302 and "aprobar" in campos and cola_siguiente:
+        prueba.encolar(cola_siguiente, factura_id)
+
+
+def supervisor(sesion):
+    _revisar(sesion, ("facturas_por_revisar", "/supervisores/facturas"), r"/supervisores/revisar/(\d+)",
+             ("revisar_factura", "/supervisores/revisar/{}"), "admin")
+
+
+def admin(sesion):
+    sesion.pedir("admin_dashboard", "/admin/dashboard")
+    sesion.pausa()
+    _revisar(sesion, ("facturas_pendientes", "/admin/facturas/pendientes"), r"/admin/aprobar_factura/(\d+)",
+             ("aprobar_factura", "/admin/aprobar_factura/{}"), None)
+
+
+ESCENARIOS = {"usuario": corredor, "supervisor": supervisor, "admin": admin}
+
+
+# =====================
+# Run
+# =====================
+def percentil(ordenadas, p):
+    """Nearest-rank percentile of a sorted list"""
+    return ordenadas[max(0, math.ceil(len(ordenadas) * p / 100) - 1)] if ordenadas else 0.0
+
+
+class Prueba:
+    """One load test run: server and worker processes, user threads and their samples"""
+
+    def __init__(self, usuarios, duracion, pausa=1.0, consultas=3, rechazo=0.1, trabajador=True,
+                 database_url=None, config_name="development", timeout=30):
+        self.usuarios = usuarios
+        self.duracion = duracion
+        self.pausa = pausa
+        self.consultas = consultas
+        self.rechazo = rechazo
+        self.trabajador = trabajador
+        self.database_url = database_url
+        self.config_name = config_name
+        self.timeout = timeout
+        self.detener = threading.Event()
+        self.base = None
+        self._lock = threading.Lock()
+        self.muestras = defaultdict(list)   # (rol, paso) -> [(correcta, ms)]
+        self.colas = {"supervisor": deque(), "admin": deque()}
+
+    def anotar(self, rol, paso, correcta, ms):
+        with self._lock:
+            self.muestras[(rol, paso)].append((correcta, ms))
+
+    def encolar(self, rol, factura_id):
+        with self._lock:
+            self.colas[rol].append(factura_id)
+
+    def siguiente(self, rol):
+        with self._lock:
+            return self.colas[rol].popleft() if self.colas[rol] else None
+
+    def _usuario(self, rol, numero):
+        sesion = Sesion(self, rol, numero)
+        # logins are spread over the first pause so they do not all land at once
+        self.detener.wait(random.uniform(0, self.pausa))
+        if not sesion.entrar():
+            return
+        while not self.detener.is_set():
+            ESCENARIOS[rol](sesion)
+
+    def ejecutar(self, raiz):
+        """Run the test; returns the report dict (see ``informe``)"""
+        with tempfile.TemporaryDirectory() as scratch:
+            env = dict(
+                os.environ,
+                DATABASE_URL=self.database_url or "sqlite:///" + os.path.join(scratch, "carga.db"),
+                AUDIT_SPOOL_DIR=os.path.join(scratch, "spool"),
+                MAIL_FILE_DIR=os.path.join(scratch, "correo"),
+                BLOBS_DIR=os.path.join(scratch, "blobs"),
+                PREVIEWS_DIR=os.path.join(scratch, "miniaturas"),
+                METRICS_ENABLED="False",
+                JOBS_EAGER="False" if self.trabajador else "True",
+                FLASK_ENV=self.config_name,
+            )
+            errores = os.path.join(scratch, "errores.jsonl")
+            # tracebacks and worker logs go to a file, not over the report
+            registro = open(os.path.join(scratch, "servidor.log"), "w+", encoding="utf-8")
+            codigo = (f"from app import carga; carga.servidor({self.config_name!r}, "
+                      f"{self.usuarios!r}, {errores!r})")
+            procesos = [subprocess.Popen([sys.executable, "-c", codigo], cwd=raiz, env=env,
+                                         stdout=subprocess.PIPE, stderr=registro, text=True)]
+            try:
+                linea = procesos[0].stdout.readline()
+                if not linea:
+                    registro.seek(0)
+                    raise RuntimeError("the app server exited before it was ready:\n" + registro.read()[-2000:])
+                self.base = f"http://127.0.0.1:{json.loads(linea)['puerto']}"
+                if self.trabajador:
+                    procesos.append(subprocess.Popen(
+                        [sys.executable, "-m", "flask", "--app", "app:create_app", "worker"],
+                        cwd=raiz, env=env, stdout=subprocess.DEVNULL, stderr=registro
+                    ))
+
+                hilos = [threading.Thread(target=self._usuario, args=(rol, numero), daemon=True)
+                         for rol, cantidad in self.usuarios.items() for numero in range(cantidad)]
+                inicio = time.perf_counter()
+                for hilo in hilos:
+                    hilo.start()
+                self.detener.wait(self.duracion)
+                self.detener.set()
+                for hilo in hilos:
+                    hilo.join(self.timeout)
+                transcurrido = time.perf_counter() - inicio
+            finally:
+                for proceso in procesos:
+                    proceso.terminate()
+                for proceso in procesos:
+                    try:
+                        proceso.wait(30)
+                    except subprocess.TimeoutExpired:
+                        proceso.kill()
+                registro.close()
+
+            excepciones = []
+            if os.path.exists(errores):
+                with open(errores, encoding="utf-8") as f:
+                    excepciones = [json.loads(linea) for linea in f if linea.strip()]
+        return self.informe(transcurrido, excepciones)
+
+    def informe(self, transcurrido, excepciones):
+        """Per-step and total throughput, latency percentiles and errors.
+
+        A request counts as an error when it got no response, a 4xx/5xx
+        status, or (a form post) no redirect; see ``Sesion.pedir``.
+        """
+        pasos = []
+        total = errores_total = 0
+        for (rol, paso), muestras in sorted(self.muestras.items()):
+            latencias = sorted(ms for _, ms in muestras)
+            errores = sum(1 for correcta, _ in muestras if not correcta)
+            total += len(muestras)
+            errores_total += errores
+            pasos.append({
+                "rol": rol, "paso": paso, "peticiones": len(muestras), "errores": errores,
+                "rps": len(muestras) / transcurrido,
+                "p50": percentil(latencias, 50), "p95": percentil(latencias, 95),
+                "p99": percentil(latencias, 99), "max": latencias[-1],
+            })
+        por_endpoint = defaultdict(lambda: [0, 0])
+        for excepcion in excepciones:
+            por_endpoint[excepcion["endpoint"]][0] += 1
+            por_endpoint[excepcion["endpoint"]][1] += excepcion["bloqueo"]
+        ejemplos = {}
+        for excepcion in excepciones:
+            ejemplos.setdefault((excepcion["endpoint"], excepcion["tipo"]), excepcion["mensaje"])
+        return {
+            "segundos": transcurrido, "peticiones": total, "errores": errores_total,
+            "rps": total / transcurrido if transcurrido else 0.0,
+            "tasa_errores": errores_total / total if total else 0.0,
+            "bloqueos": sum(e["bloqueo"] for e in excepciones),
+            "pasos": pasos,
+            "excepciones": {endpoint: {"total": n, "bloqueos": b} for endpoint, (n, b) in por_endpoint.items()},
+            "ejemplos": [{"endpoint": e, "tipo": t, "mensaje": m} for (e, t), m in ejemplos.items()],
+        }
@@ -0,0 +1,744 @@
+"""
+Flask CLI commands.
+
+Schema creation and seeding live here instead of running at import time,
+so importing the app / create_app() never touches the database.
+
+    flask db upgrade        # apply migrations
+    flask seed              # default admin, supervisor and tax rates
+    flask init-db           # upgrade + seed (fresh development databases)
+    flask worker            # background job worker processes (app/trabajos.py)
+    flask resumenes programar  # start the periodic notification digest emails
+    flask bench startup     # import + create_app timing
+    flask bench imports     # per-module import cost; fails on heavy imports
+    flask bench audit       # request latency with the audit log in sync vs write-behind mode
+    flask bench load        # brokers, supervisors and admins working the invoice flow concurrently
+    flask bench plans       # EXPLAIN every route's queries; fails on scans of the large tables
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import click
+from flask import current_app, g
+from flask.cli import ScriptInfo, with_appcontext
+from .extensions import db
+
+
+def upgrade_schema(app):
+    """Bring the database to the latest migration, creating it if empty.
+
+    A database built by ``create_all`` (init-db before it ran the migrations)
+    already has every table but no ``alembic_version``; it is stamped at head
+    instead, since upgrading would try to create its tables again.
+    """
+    from flask_migrate import Migrate, stamp, upgrade
+    from sqlalchemy import inspect
+
+    if "migrate" not in app.extensions:
+        Migrate(render_as_batch=True).init_app(app, db)
+    directorio = os.path.join(os.path.dirname(app.root_path), "migrations")
+    tablas = set(inspect(db.engine).get_table_names())
+    if "alembic_version" not in tablas and tablas >= set(db.metadata.tables):
+        stamp(directory=directorio, revision="head")
+    else:
+        upgrade(directory=directorio)
+
+
+def seed_defaults():
+    """Create the default admin, supervisor and tax configuration if missing"""
+    from .models import User, ConfiguracionTasas
+
+    admin = User.query.filter_by(email="admin@facturas.com").first()
+    if not admin:
+        admin = User(
+            nombre="Administrador del Sistema",
+            email="admin@facturas.com",
+            rol="admin",
+            creditos=999,
+            activo=True
+        )
+        admin.set_password("admin123")
+        db.session.add(admin)
+
+    supervisor = User.query.filter_by(email="supervisor@facturas.com").first()
+    if not supervisor:
+        supervisor = User(
+            nombre="Supervisor de Facturas",
+            email="supervisor@facturas.com",
+            rol="supervisor",
+            creditos=50,
+            activo=True
+        )
+        supervisor.set_password("super123")
+        db.session.add(supervisor)
+
+    tasas = ConfiguracionTasas.query.first()
+    if not tasas:
+        tasas = ConfiguracionTasas(
+            ieps=4.59,
+            iva=0.16,
+            pvr=0.20,
+            iva_pvr=0.16,
+            factor_conversion=0.264172
+        )
+        db.session.add(tasas)
+
+    try:
+        db.session.commit()
+        print("[OK] Default data created successfully!")
+        print("[INFO] Admin: admin@facturas.com / admin123")
+        print("[INFO] Supervisor: supervisor@facturas.com / super123")
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ERROR] Error creating default data: {e}")
+
+
+def register_commands(app):
+    """Attach the CLI commands to the app"""
+
+    @app.cli.command("init-db")
+    def init_db():
+        """Create or upgrade the database schema (migrations) and default data"""
+        upgrade_schema(current_app._get_current_object())
+        print("[OK] Database schema is up to date!")
+        seed_defaults()
+
+    @app.cli.command("seed")
+    def seed():
+        """Create default users and tax configuration"""
+        seed_defaults()
+
+    @app.cli.command("create-admin")
+    def create_admin():
+        """Create an admin user"""
+        from .models import User
+
+        email = input("Admin email: ")
+        password = input("Admin password: ")
+        name = input("Admin name: ")
+
+        admin = User(
+            nombre=name,
+            email=email,
+            rol="admin",
+            creditos=999,
+            activo=True
+        )
+        admin.set_password(password)
+
+        db.session.add(admin)
+        db.session.commit()
+        print(f"[OK] Admin user {email} created successfully!")
+
+    @app.cli.command("reset-db")
+    def reset_db():
+        """Reset the database (WARNING: This will delete all data!)"""
+        confirm = input("This will delete ALL data. Type 'CONFIRM' to proceed: ")
+        if confirm == 'CONFIRM':
+            db.drop_all()
+            # drop_all only knows the models' tables; without this the upgrade would think it is done
+            db.session.execute(db.text("DROP TABLE IF EXISTS alembic_version"))
+            db.session.commit()
+            upgrade_schema(current_app._get_current_object())
+            print("[OK] Database reset completed!")
+        else:
+            print("[CANCELLED] Database reset cancelled.")
+
+    @app.cli.command("recalcular-totales")
+    @click.option("--incluir-aprobadas", is_flag=True, help="Also recompute approved invoices")
+    @click.option("--tasas-actuales", is_flag=True,
+                  help="Apply today's rates to every invoice instead of the rates in force at its fecha_hora")
+    def recalcular_totales(incluir_aprobadas, tasas_actuales):
+        """Recompute invoice totals in bulk with the fixed-point engine"""
+        from .models import Factura
+        from .utils import recalculate_invoice_totals, get_current_tax_rates
+        from .money import from_minor
+
+        query = Factura.query
+        if not incluir_aprobadas:
+            query = query.filter(Factura.estado != "aprobada")
+
+        actualizadas, suma_total = recalculate_invoice_totals(
+            query, tasas=get_current_tax_rates() if tasas_actuales else None
+        )
+        print(f"[OK] {actualizadas} facturas recalculadas. Total a pagar: {from_minor(suma_total)}")
+
+    @app.cli.command("purgar-idempotencia")
+    def purgar_idempotencia():
+        """Delete expired idempotency keys"""
+        from .idempotency import purge_expired
+
+        print(f"[OK] {purge_expired()} expired idempotency keys deleted")
+
+    @app.cli.command("reconciliar-creditos")
+    @click.option("--corregir", is_flag=True, help="Reset cached balances to the ledger sum")
+    def reconciliar_creditos(corregir):
+        """Compare User.creditos with the credit ledger"""
+        from .creditos import descuadres
+
+        diferencias = descuadres()
+        for user, cached, ledger in diferencias:
+            print(f"[INFO] {user.email}: cached {cached}, ledger {ledger}")
+            if corregir:
+                user.creditos = ledger
+        if corregir and diferencias:
+            db.session.commit()
+            print(f"[OK] {len(diferencias)} balances reset to the ledger")
+        elif not diferencias:
+            print("[OK] All balances match the ledger")
+
+    @app.cli.command("reconstruir-contadores")
+    def reconstruir_contadores():
+        """Rebuild the dashboard invoice counters from the facturas table"""
+        from .contadores import reconstruir
+
+        print(f"[OK] {reconstruir()} counter rows rebuilt")
+
+    @app.cli.command("recuperar-auditoria")
+    def recuperar_auditoria():
+        """Insert audit entries left in the spool by processes that died"""
+        from .audit import recuperar
+
+        print(f"[OK] {recuperar()} audit entries recovered from the spool")
+
+    app.cli.add_command(migrate_cli)
+    app.cli.add_command(api_token_cli)
+    app.cli.add_command(reportes_cli)
+    app.cli.add_command(worker)
+    app.cli.add_command(trabajos_cli)
+    app.cli.add_command(resumenes_cli)
+    app.cli.add_command(adjuntos_cli)
+    app.cli.add_command(bench)
+
+
+class LazyMigrateGroup(click.Group):
+    """Group whose subcommands come from Flask-Migrate, imported on first use"""
+
+    def _load(self, ctx):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as db_group
+
+        app = ctx.ensure_object(ScriptInfo).load_app()
+        if "migrate" not in app.extensions:
+            Migrate(render_as_batch=True).init_app(app, db)
+        return db_group
+
+    def list_commands(self, ctx):
+        return self._load(ctx).list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._load(ctx).get_command(ctx, name)
+
+
+@click.group("db", cls=LazyMigrateGroup)
+@click.option("-d", "--directory", default=None,
+              help='Migration script directory (default is "migrations")')
+@click.option("-x", "--x-arg", multiple=True,
+              help="Additional arguments consumed by custom env.py scripts")
+@with_appcontext
+def migrate_cli(directory, x_arg):
+    """Perform database migrations.
+
+    Same commands as Flask-Migrate's ``flask db``, but alembic is imported
+    only when one of them runs instead of on every web worker start.
+    """
+    g.directory = directory
+    g.x_arg = x_arg  # read by Migrate.get_config()
+
+
+# =====================
+# API tokens
+# =====================
+@click.group("api-token")
+def api_token_cli():
+    """Manage tokens for the JSON API (/api/v1)"""
+
+
+@api_token_cli.command("crear")
+@click.argument("email")
+@click.option("--nombre", required=True, help="Integration using the token, e.g. ERP")
+@with_appcontext
+def api_token_crear(email, nombre):
+    """Create a token for the user with EMAIL; it is printed only once"""
+    from .models import User, ApiToken
+
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        raise click.ClickException(f"No user with email {email}")
+
+    api_token, token = ApiToken.generar(user, nombre)
+    db.session.add(api_token)
+    db.session.commit()
+    print(f"[OK] Token created for {email} ({nombre}). Store it now, it will not be shown again:")
+    print(token)
+
+
+@api_token_cli.command("listar")
+@with_appcontext
+def api_token_listar():
+    """List API tokens"""
+    from .models import ApiToken
+
+    for api_token in ApiToken.query.order_by(ApiToken.id).all():
+        estado = "active" if api_token.activo else "revoked"
+        ultimo_uso = api_token.ultimo_uso.isoformat(timespec="seconds") if api_token.ultimo_uso else "never"
+        print(f"{api_token.prefijo}…  {api_token.usuario.email:<30} {api_token.nombre:<20} {estado:<8} last used {ultimo_uso}")
+
+
+@api_token_cli.command("revocar")
+@click.argument("prefijo")
+@with_appcontext
+def api_token_revocar(prefijo):
+    """Revoke the token(s) starting with PREFIJO"""
+    from .models import ApiToken
+
+    tokens = ApiToken.query.filter_by(prefijo=prefijo[:8], activo=True).all()
+    if not tokens:
+        raise click.ClickException(f"No active token with prefix {prefijo}")
+    for api_token in tokens:
+        api_token.activo = False
+    db.session.commit()
+    print(f"[OK] {len(tokens)} token(s) revoked")
+
+
+# =====================
+# Reports
+# =====================
+@click.group("reportes")
+def reportes_cli():
+    """Offline reports (app/reportes.py)"""
+
+
+@reportes_cli.command("procesar")
+@with_appcontext
+def reportes_procesar():
+    """Compute every queued report now (for a cron job or a dedicated worker)"""
+    from .reportes import procesar_pendientes
+
+    print(f"[OK] {procesar_pendientes()} report(s) computed")
+
+
+@reportes_cli.command("generar")
+@click.argument("reporte")
+@click.option("--desde", type=click.DateTime(formats=["%Y-%m-%d"]), required=True)
+@click.option("--hasta", type=click.DateTime(formats=["%Y-%m-%d"]), required=True)
+@click.option("--estado", default=None, help="Only invoices in this estado")
+@click.option("--forzar", is_flag=True, help="Recompute even if a cached artifact exists")
+@with_appcontext
+def reportes_generar(reporte, desde, hasta, estado, forzar):
+    """Compute one report in the foreground and print its file"""
+    from .models import ReporteArtefacto
+    from . import reportes
+
+    if reporte not in reportes.REPORTES:
+        raise click.ClickException(f"unknown report; choose one of {', '.join(reportes.REPORTES)}")
+    artefacto, nuevo = reportes.solicitar(reporte, desde.date(), hasta.date(), estado=estado, forzar=forzar,
+                                            en_segundo_plano=False)
+    if nuevo and reportes.reclamar(artefacto.id):
+        reportes.procesar(db.session.get(ReporteArtefacto, artefacto.id))
+    db.session.refresh(artefacto)
+
+    if artefacto.estado == reportes.ERROR:
+        raise click.ClickException(artefacto.error)
+    if artefacto.estado != reportes.LISTO:
+        print(f"[INFO] Report {artefacto.id} is being computed by another worker ({artefacto.estado})")
+        return
+    print(f"[OK] {artefacto.filas} rows{'' if nuevo else ' (cached)'}: {reportes.ruta(artefacto)}")
+
+
+# =====================
+# Background jobs
+# =====================
+@click.command("worker")
+@click.option("--procesos", default=1, show_default=True, help="Worker processes to run")
+@click.option("--intervalo", type=float, default=None, help="Seconds between polls when idle (JOBS_POLL_INTERVAL)")
+@click.option("--gracia", type=float, default=30, show_default=True,
+              help="Seconds a process gets to finish its current job on shutdown")
+@with_appcontext
+def worker(procesos, intervalo, gracia):
+    """Run queued background jobs until stopped (SIGTERM or Ctrl-C)"""
+    from . import metrics, trabajos
+
+    app = current_app._get_current_object()
+    print(f"[INFO] {procesos} job worker process(es), tasks: {', '.join(sorted(trabajos.TAREAS))}")
+    if not metrics.multiprocess_enabled():
+        print("[INFO] PROMETHEUS_MULTIPROC_DIR is not set: metrics recorded by jobs stay out of /metrics")
+    if procesos == 1:
+        import signal
+        import threading
+
+        detener = threading.Event()
+        for senal in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(senal, lambda *_: detener.set())
+        trabajos.trabajar(app, detener, intervalo)
+    else:
+        trabajos.supervisar(app, procesos, intervalo, gracia)
+    print("[OK] Job workers stopped")
+
+
+@click.group("trabajos")
+def trabajos_cli():
+    """Background job queue (app/trabajos.py)"""
+
+
+@trabajos_cli.command("procesar")
+@with_appcontext
+def trabajos_procesar():
+    """Run every job that is due now, then exit (for cron or tests)"""
+    from .trabajos import procesar_pendientes
+
+    print(f"[OK] {procesar_pendientes()} job(s) run")
+
+
+@trabajos_cli.command("purgar")
+@click.option("--dias", type=int, default=None, help="Keep jobs finished in the last N days (JOBS_RETENTION_DAYS)")
+@with_appcontext
+def trabajos_purgar(dias):
+    """Delete finished and failed jobs older than the retention period"""
+    from .trabajos import purgar
+
+    print(f"[OK] {purgar(dias)} finished job(s) deleted")
+
+
+# =====================
+# Notification digests
+# =====================
+@click.group("resumenes")
+def resumenes_cli():
+    """Notification digest emails (app/resumenes.py)"""
+
+
+@resumenes_cli.command("enviar")
+@with_appcontext
+def resumenes_enviar():
+    """Send the digests that are due now"""
+    from .resumenes import enviar
+
+    print(f"[OK] {enviar()} digest(s) sent via {current_app.config['MAIL_TRANSPORT']}")
+
+
+@resumenes_cli.command("programar")
+@with_appcontext
+def resumenes_programar():
+    """Queue the digest job; it then re-queues itself every DIGEST_WINDOW seconds"""
+    from .resumenes import programar
+
+    if programar(retraso=0):
+        db.session.commit()
+        if current_app.config["JOBS_EAGER"]:
+            print("[OK] Digests sent (JOBS_EAGER); run this from cron, or use `flask worker` to self-schedule")
+        else:
+            print("[OK] Digest job queued; `flask worker` will run it")
+    else:
+        print("[INFO] A digest job is already queued")
+
+
+# =====================
+# Attachments
+# =====================
+@click.group("adjuntos")
+def adjuntos_cli():
+    """Attachment storage (app/adjuntos.py)"""
+
+
+@adjuntos_cli.command("purgar")
+@click.option("--gracia", type=int, default=None,
+              help="Seconds an unreferenced blob or stray file is kept (UPLOAD_ORPHAN_GRACE)")
+@with_appcontext
+def adjuntos_purgar(gracia):
+    """Delete blobs no attachment uses any more, and files left by failed uploads"""
+    from .adjuntos import purgar
+
+    blobs, archivos = purgar(gracia)
+    print(f"[OK] {blobs} unreferenced blob(s) and {archivos} file(s) deleted")
+
+
+# =====================
+# Benchmarks
+# =====================
+@click.group()
+def bench():
+    """Performance benchmarks"""
+
+
+_STARTUP_PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app({config!r})
+t2 = time.perf_counter()
+with flask_app.app_context():
+    pool = app.extensions.db.engine.pool
+    connections = pool.checkedin() + pool.checkedout() if hasattr(pool, "checkedin") else 0
+print(json.dumps({{"import_ms": (t1 - t0) * 1000, "create_app_ms": (t2 - t1) * 1000,
+                  "db_connections": connections}}))
+"""
+
+
+@bench.command("startup")
+@click.option("--runs", default=5, show_default=True, help="Fresh interpreters to time")
+@click.option("--config", "config_name", default="development", show_default=True)
+@click.option("--budget-ms", type=float, default=None, help="Fail if the median total exceeds this")
+def bench_startup(runs, config_name, budget_ms):
+    """Time `import app` + create_app() in fresh interpreters"""
+    root = os.path.dirname(current_app.root_path)
+    probe = _STARTUP_PROBE.format(config=config_name)
+
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", probe], cwd=root, check=True,
+            capture_output=True, text=True
+        ).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    create_ms = statistics.median(s["create_app_ms"] for s in samples)
+    total_ms = import_ms + create_ms
+    print(f"import app:    {import_ms:8.1f} ms (median of {runs})")
+    print(f"create_app():  {create_ms:8.1f} ms")
+    print(f"total:         {total_ms:8.1f} ms")
+
+    connections = max(s["db_connections"] for s in samples)
+    if connections:
+        raise click.ClickException(f"startup opened {connections} DB connection(s); it must do no DB I/O")
+    if budget_ms is not None and total_ms > budget_ms:
+        raise click.ClickException(f"startup {total_ms:.1f} ms exceeds budget {budget_ms:.1f} ms")
+
+
+_IMPORTS_PROBE = "import app; app.create_app({config!r})"
+
+
+def _parse_importtime(stderr):
+    """Parse `python -X importtime` output.
+
+    Returns ``{module: (self_us, cumulative_us)}`` and the total cumulative
+    time of the top-level imports (nested ones are indented by the
+    interpreter and already counted in their parent).
+    """
+    modules = {}
+    total_us = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative_us)
+    return modules, total_us
+
+
+@bench.command("imports")
+@click.option("--config", "config_name", default="development", show_default=True)
+@click.option("--top", default=15, show_default=True, help="Heaviest modules to list")
+@click.option("--budget-ms", type=float, default=None, help="Defaults to IMPORT_BUDGET_MS")
+def bench_imports(config_name, top, budget_ms):
+    """Import cost of `import app` + create_app(); fails if a heavy module is loaded"""
+    from .lazy import HEAVY_MODULES
+
+    root = os.path.dirname(current_app.root_path)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _IMPORTS_PROBE.format(config=config_name)],
+        cwd=root, check=True, capture_output=True, text=True
+    )
+    modules, total_us = _parse_importtime(result.stderr)
+    total_ms = total_us / 1000
+    print(f"{'self ms':>9} {'cumul ms':>9}  module")
+    heaviest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    for name, (self_us, cumulative_us) in heaviest:
+        print(f"{self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}  {name}")
+    print(f"total:    {total_ms:8.1f} ms over {len(modules)} modules")
+
+    heavy = sorted(name for name in modules if name.split(".")[0] in HEAVY_MODULES)
+    if heavy:
+        raise click.ClickException(
+            f"heavy modules imported at startup: {', '.join(heavy[:10])}; use app.lazy instead"
+        )
+    budget_ms = budget_ms if budget_ms is not None else current_app.config["IMPORT_BUDGET_MS"]
+    if total_ms > budget_ms:
+        raise click.ClickException(f"imports took {total_ms:.1f} ms, budget is {budget_ms:.1f} ms")
+
+
+_AUDIT_PROBE = """
+import json, os, statistics, time
+import app
+from app.extensions import db
+from app.models import User, ConfiguracionTasas, HistorialFactura
+flask_app = app.create_app({config!r})
+flask_app.config["WTF_CSRF_ENABLED"] = False
+with flask_app.app_context():
+    db.create_all()
+    user = User(nombre="bench", email="bench@example.com", rol="usuario", creditos={requests}, activo=True)
+    user.set_password("bench")
+    db.session.add_all([user, ConfiguracionTasas(ieps=4.59, iva=0.16, pvr=0.20, iva_pvr=0.16)])
+    db.session.commit()
+    user_id = user.id
+
+client = flask_app.test_client()
+with client.session_transaction() as sess:
+    sess["_user_id"] = str(user_id)
+    sess["_fresh"] = True
+form = dict(importador="ACME", rfc="ACM010101AAA", numero_pedimento="1", numero_aduana="07",
+            patente_aduanal="3456", tipo="full", litros_rem1="1000", precio_molecula_galon="2.5")
+
+samples = []
+for i in range({requests}):
+    t0 = time.perf_counter()
+    status = client.post("/usuarios/crear_factura", data=dict(form, numero_pedimento=str(i))).status_code
+    samples.append((time.perf_counter() - t0) * 1000)
+    assert status == 302, status
+
+t0 = time.perf_counter()
+with flask_app.app_context():
+    flask_app.extensions["auditoria"].vaciar()
+    drain_ms = (time.perf_counter() - t0) * 1000
+    entries = db.session.query(HistorialFactura).count()
+samples.sort()
+print(json.dumps({{"p50": statistics.median(samples), "p95": samples[int(len(samples) * 0.95) - 1],
+                  "mean": statistics.fmean(samples), "drain_ms": drain_ms, "entries": entries}}))
+"""
+
+
+@bench.command("audit")
+@click.option("--requests", "requests_", default=300, show_default=True, help="Invoices created per mode")
+@click.option("--config", "config_name", default="development", show_default=True)
+@click.option("--fsync/--no-fsync", default=True, show_default=True, help="fsync the spool on every append")
+def bench_audit(requests_, config_name, fsync):
+    """Invoice creation latency with the audit log in sync and write-behind mode"""
+    import tempfile
+    from .audit import MODOS
+
+    root = os.path.dirname(current_app.root_path)
+    probe = _AUDIT_PROBE.format(config=config_name, requests=requests_)
+    print(f"{'mode':<13} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8} {'drain ms':>9}")
+    for modo in MODOS:
+        with tempfile.TemporaryDirectory() as scratch:
+            env = dict(
+                os.environ,
+                DATABASE_URL="sqlite:///" + os.path.join(scratch, "bench.db"),
+                AUDIT_MODE=modo,
+                AUDIT_SPOOL_DIR=os.path.join(scratch, "spool"),
+                AUDIT_FSYNC=str(fsync),
+                METRICS_ENABLED="False",
+            )
+            out = subprocess.run(
+                [sys.executable, "-c", probe], cwd=root, env=env, check=True,
+                capture_output=True, text=True
+            ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{modo:<13} {result['p50']:8.2f} {result['p95']:8.2f} {result['mean']:8.2f} {result['drain_ms']:9.1f}")
+        if result["entries"] != requests_:
+            raise click.ClickException(f"{modo}: {result['entries']} history entries for {requests_} invoices")
+
+
+@bench.command("load")
+@click.option("--brokers", default=10, show_default=True, help="Simulated brokers (role usuario)")
+@click.option("--supervisors", default=2, show_default=True, help="Simulated supervisors")
+@click.option("--admins", default=1, show_default=True, help="Simulated admins")
+@click.option("--duration", type=float, default=60, show_default=True, help="Seconds to run")
+@click.option("--think", type=float, default=1.0, show_default=True,
+              help="Mean seconds a user pauses between requests (0: back to back)")
+@click.option("--polls", default=3, show_default=True, help="mis_facturas polls after each invoice a broker creates")
+@click.option("--reject", type=float, default=0.1, show_default=True, help="Share of reviews that reject the invoice")
+@click.option("--worker/--no-worker", default=True, show_default=True,
+              help="Run `flask worker` on the scratch database too")
+@click.option("--database-url", default=None,
+              help="Empty scratch database to use (default: a temporary SQLite file)")
+@click.option("--config", "config_name", default="development", show_default=True)
+@click.option("--max-error-rate", type=float, default=None, help="Fail if a larger share of requests fails")
+@click.option("--json", "as_json", is_flag=True, help="Print the report as JSON")
+def bench_load(brokers, supervisors, admins, duration, think, polls, reject, worker, database_url,
+               config_name, max_error_rate, as_json):
+    """Throughput, latency and errors of the three roles working the invoice flow (app/carga.py)"""
+    from .carga import Prueba
+
+    root = os.path.dirname(current_app.root_path)
+    usuarios = {"usuario": brokers, "supervisor": supervisors, "admin": admins}
+    prueba = Prueba(usuarios, duration, pausa=think, consultas=polls, rechazo=reject, trabajador=worker,
+                    database_url=database_url, config_name=config_name)
+    if not as_json:
+        print(f"[INFO] {brokers} broker(s), {supervisors} supervisor(s), {admins} admin(s) for {duration:g} s")
+    try:
+        informe = prueba.ejecutar(root)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    if as_json:
+        print(json.dumps(informe, indent=2))
+    else:
+        print(f"{'role':<11} {'step':<24} {'reqs':>6} {'errors':>6} {'req/s':>7} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for paso in informe["pasos"]:
+            print(f"{paso['rol']:<11} {paso['paso']:<24} {paso['peticiones']:6d} {paso['errores']:6d} "
+                  f"{paso['rps']:7.2f} {paso['p50']:8.1f} {paso['p95']:8.1f} {paso['p99']:8.1f} {paso['max']:8.1f}")
+        print(f"total: {informe['peticiones']} requests in {informe['segundos']:.1f} s "
+              f"({informe['rps']:.2f} req/s), {informe['tasa_errores']:.1%} errors, "
+              f"{informe['bloqueos']} lock contention error(s)")
+        for endpoint, conteo in sorted(informe["excepciones"].items(), key=lambda e: str(e[0])):
+            print(f"[ERROR] {endpoint}: {conteo['total']} exception(s), {conteo['bloqueos']} lock contention")
+        for ejemplo in informe["ejemplos"]:
+            print(f"        {ejemplo['endpoint']} {ejemplo['tipo']}: {ejemplo['mensaje']}")
+
+    if max_error_rate is not None and informe["tasa_errores"] > max_error_rate:
+        raise click.ClickException(
+            f"error rate {informe['tasa_errores']:.1%} exceeds {max_error_rate:.1%}"
+        )
+
+
+@bench.command("plans")
+@click.option("--update", is_flag=True, help="Rewrite the snapshot with the current plans")
+@click.option("--config", "config_name", default="development", show_default=True)
+def bench_plans(update, config_name):
+    """Query plans of every route; fails on full scans or temporary sorts of the large tables (app/planes.py)"""
+    import difflib
+    import tempfile
+    from . import planes
+
+    root = os.path.dirname(current_app.root_path)
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(
+            os.environ,
+            DATABASE_URL="sqlite:///" + os.path.join(scratch, "planes.db"),
+            AUDIT_SPOOL_DIR=os.path.join(scratch, "spool"),
+            BLOBS_DIR=os.path.join(scratch, "blobs"),
+            PREVIEWS_DIR=os.path.join(scratch, "miniaturas"),
+            REPORTS_DIR=os.path.join(scratch, "reportes"),
+            METRICS_ENABLED="False",
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", f"from app import planes; planes.capturar({config_name!r})"],
+            cwd=root, env=env, check=True, capture_output=True, text=True
+        ).stdout
+    resultado = json.loads(out.strip().splitlines()[-1])
+    consultas = sum(len(ruta["consultas"]) for ruta in resultado["rutas"])
+    print(f"[INFO] {len(resultado['rutas'])} route(s), {consultas} distinct statement(s) on {resultado['motor']}")
+
+    fallos = []
+    for endpoint in resultado["sin_argumentos"]:
+        fallos.append(f"{endpoint} has URL arguments; add them to planes.ARGUMENTOS")
+    for ruta, sql, problema in planes.violaciones(resultado):
+        print(f"[ERROR] {ruta}: {problema}\n        {sql}")
+        fallos.append(f"{ruta}: {problema}")
+
+    texto = planes.formatear(resultado) + "\n"
+    instantanea = os.path.join(current_app.root_path, planes.INSTANTANEA)
+    if update:
+        with open(instantanea, "w", encoding="utf-8") as f:
+            f.write(texto)
+        print(f"[OK] snapshot written to {os.path.relpath(instantanea, root)}")
+    else:
+        anterior = open(instantanea, encoding="utf-8").read() if os.path.exists(instantanea) else ""
+        if anterior != texto:
+            sys.stdout.writelines(difflib.unified_diff(
+                anterior.splitlines(True), texto.splitlines(True),
+                os.path.relpath(instantanea, root), "current plans"
+            ))
+            fallos.append("plans differ from the snapshot; review the diff and run `flask bench plans --update`")
+
+    if fallos:
+        raise click.ClickException(f"{len(fallos)} problem(s):\n  " + "\n  ".join(fallos))
+    print("[OK] no scans or temporary sorts of the large tables")
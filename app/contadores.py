@@ -0,0 +1,170 @@
+"""
+Maintained invoice counters for the dashboards.
+
+``contadores_facturas`` holds one row per (ambito, sujeto_id, estado):
+
+- ``global``/0: all invoices by state (admin and supervisor queues)
+- ``usuario``/<usuario_id>: a requester's invoices by state
+- ``supervisor``/<supervisor_id>: invoices a supervisor has reviewed, by state
+
+An ``after_flush`` listener turns every Factura insert, delete, or change
+of ``estado``/``usuario_id``/``supervisor_id`` into +1/-1 deltas. It applies
+them with one upsert per affected row, inside the same transaction, so the
+counters commit or roll back together with the invoices. A dashboard then
+reads all its cards with one indexed query, however many invoices the user
+has.
+
+Writes that bypass the ORM unit of work (``Query.update``, raw SQL) are not
+seen by the listener. Run ``flask reconstruir-contadores`` after those.
+"""
+
+from collections import Counter
+from sqlalchemy import event, inspect, or_, and_, func
+from .extensions import db
+from .models import Factura, ContadorFacturas
+
+GLOBAL = "global"
+USUARIO = "usuario"
+SUPERVISOR = "supervisor"
+
+
+def _claves(usuario_id, supervisor_id, estado):
+    """Counter rows an invoice with these values contributes to"""
+    claves = [(GLOBAL, 0, estado)]
+    if usuario_id is not None:
+        claves.append((USUARIO, usuario_id, estado))
+    if supervisor_id is not None:
+        claves.append((SUPERVISOR, supervisor_id, estado))
+    return claves
+
+
+def _anterior_y_actual(estado_instancia, atributo):
+    """(value before this flush, value after it) of a Factura attribute"""
+    historia = estado_instancia.attrs[atributo].history
+    actual = historia.added[0] if historia.added else (historia.unchanged[0] if historia.unchanged else None)
+    anterior = historia.deleted[0] if historia.deleted else actual
+    return anterior, actual
+
+
+def _deltas(session):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Factura):
+            for clave in _claves(obj.usuario_id, obj.supervisor_id, obj.estado):
+                deltas[clave] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, Factura):
+            estado = inspect(obj)
+            valores = [_anterior_y_actual(estado, a)[0] for a in ("usuario_id", "supervisor_id", "estado")]
+            for clave in _claves(*valores):
+                deltas[clave] -= 1
+
+    for obj in session.dirty:
+        if not isinstance(obj, Factura):
+            continue
+        estado = inspect(obj)
+        if not any(estado.attrs[a].history.has_changes() for a in ("usuario_id", "supervisor_id", "estado")):
+            continue
+        cambios = [_anterior_y_actual(estado, a) for a in ("usuario_id", "supervisor_id", "estado")]
+        for clave in _claves(*(anterior for anterior, _ in cambios)):
+            deltas[clave] -= 1
+        for clave in _claves(*(actual for _, actual in cambios)):
+            deltas[clave] += 1
+
+    return {clave: delta for clave, delta in deltas.items() if delta}
+
+
+def _upsert(connection, ambito, sujeto_id, estado, delta):
+    tabla = ContadorFacturas.__table__
+    dialecto = connection.dialect.name
+    if dialecto in ("sqlite", "postgresql"):
+        if dialecto == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(tabla).values(ambito=ambito, sujeto_id=sujeto_id, estado=estado, total=delta)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=[tabla.c.ambito, tabla.c.sujeto_id, tabla.c.estado],
+            set_={"total": tabla.c.total + delta}
+        ))
+        return
+
+    fila = and_(tabla.c.ambito == ambito, tabla.c.sujeto_id == sujeto_id, tabla.c.estado == estado)
+    if connection.execute(tabla.update().where(fila).values(total=tabla.c.total + delta)).rowcount == 0:
+        connection.execute(tabla.insert().values(ambito=ambito, sujeto_id=sujeto_id, estado=estado, total=delta))
+
+
+def _actualizar_contadores(session, flush_context):
+    deltas = _deltas(session)
+    if not deltas:
+        return
+    connection = session.connection()
+    # ordered so concurrent transactions lock counter rows in the same order
+    for (ambito, sujeto_id, estado), delta in sorted(deltas.items()):
+        _upsert(connection, ambito, sujeto_id, estado, delta)
+
+
+def init_app(app):
+    """Keep the counters in step with every flush of the app's session"""
+    if not event.contains(db.session, "after_flush", _actualizar_contadores):
+        event.listen(db.session, "after_flush", _actualizar_contadores)
+
+
+# =====================
+# Reading
+# =====================
+def leer(*ambitos):
+    """Counters for several (ambito, sujeto_id) pairs in one query.
+
+    Returns {(ambito, sujeto_id): Counter(estado -> total)}; missing
+    states read as 0.
+    """
+    resultado = {(ambito, sujeto_id): Counter() for ambito, sujeto_id in ambitos}
+    filas = ContadorFacturas.query.filter(or_(*[
+        and_(ContadorFacturas.ambito == ambito, ContadorFacturas.sujeto_id == sujeto_id)
+        for ambito, sujeto_id in ambitos
+    ])).all()
+    for fila in filas:
+        resultado[(fila.ambito, fila.sujeto_id)][fila.estado] = fila.total
+    return resultado
+
+
+def de_usuario(usuario_id):
+    return leer((USUARIO, usuario_id))[(USUARIO, usuario_id)]
+
+
+def mayores(ambito, limite):
+    """[(sujeto_id, total)] of the subjects with the most invoices in any state"""
+    total = func.sum(ContadorFacturas.total)
+    return db.session.query(ContadorFacturas.sujeto_id, total)\
+        .filter(ContadorFacturas.ambito == ambito)\
+        .group_by(ContadorFacturas.sujeto_id)\
+        .having(total > 0)\
+        .order_by(total.desc()).limit(limite).all()
+
+
+# =====================
+# Rebuild
+# =====================
+def reconstruir():
+    """Recompute every counter from the facturas table; returns rows written"""
+    db.session.query(ContadorFacturas).delete(synchronize_session=False)
+
+    consultas = {
+        GLOBAL: db.session.query(db.literal(0), Factura.estado, func.count()).group_by(Factura.estado),
+        USUARIO: db.session.query(Factura.usuario_id, Factura.estado, func.count())
+            .group_by(Factura.usuario_id, Factura.estado),
+        SUPERVISOR: db.session.query(Factura.supervisor_id, Factura.estado, func.count())
+            .filter(Factura.supervisor_id.isnot(None))
+            .group_by(Factura.supervisor_id, Factura.estado),
+    }
+    filas = [
+        {"ambito": ambito, "sujeto_id": sujeto_id, "estado": estado, "total": total}
+        for ambito, consulta in consultas.items()
+        for sujeto_id, estado, total in consulta.all()
+    ]
+    if filas:
+        db.session.execute(ContadorFacturas.__table__.insert(), filas)
+    db.session.commit()
+    return len(filas)
@@ -0,0 +1,150 @@
+"""
+Outgoing mail through a pluggable transport.
+
+``MAIL_TRANSPORT`` selects the transport: ``smtp``, ``file`` (one .eml file
+per message under ``MAIL_FILE_DIR``, for development and tests),
+``console`` (logged), or ``"package.module:Class"`` for a custom one.
+
+A transport is used per batch:
+
+    with transporte().conexion() as conexion:
+        for mensaje in mensajes:
+            conexion.enviar(mensaje)
+
+so SMTP logs in once and reuses one connection for every message of the
+batch instead of reconnecting per message.
+"""
+
+import importlib
+import os
+import smtplib
+import time
+from contextlib import contextmanager
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+from flask import current_app
+
+
+class ErrorDestinatario(Exception):
+    """The server refused this message's recipient; the rest of the batch can go on"""
+
+
+def mensaje(para, asunto, texto, remitente=None):
+    """Plain-text EmailMessage with the app's sender"""
+    correo = EmailMessage()
+    correo["From"] = remitente or current_app.config["MAIL_FROM"]
+    correo["To"] = para
+    correo["Subject"] = asunto
+    correo["Date"] = formatdate(localtime=True)
+    correo["Message-ID"] = make_msgid(domain=correo["From"].rpartition("@")[2].strip(">") or None)
+    correo.set_content(texto)
+    return correo
+
+
+class TransporteSMTP:
+    """SMTP with STARTTLS or implicit TLS; one login per batch"""
+
+    def __init__(self, config):
+        self.servidor = config["MAIL_SERVER"]
+        self.puerto = config["MAIL_PORT"]
+        self.usuario = config["MAIL_USERNAME"]
+        self.contrasena = config["MAIL_PASSWORD"]
+        self.tls = config["MAIL_USE_TLS"]
+        self.ssl = config["MAIL_USE_SSL"]
+        self.timeout = config["MAIL_TIMEOUT"]
+
+    def _conectar(self):
+        clase = smtplib.SMTP_SSL if self.ssl else smtplib.SMTP
+        smtp = clase(self.servidor, self.puerto, timeout=self.timeout)
+        if self.tls and not self.ssl:
+            smtp.starttls()
+        if self.usuario:
+            smtp.login(self.usuario, self.contrasena)
+        return smtp
+
+    @contextmanager
+    def conexion(self):
+        conexion = _ConexionSMTP(self)
+        try:
+            yield conexion
+        finally:
+            conexion.cerrar()
+
+
+class _ConexionSMTP:
+    def __init__(self, transporte):
+        self.transporte = transporte
+        self.smtp = transporte._conectar()
+
+    def enviar(self, correo):
+        try:
+            self._enviar(correo)
+        except smtplib.SMTPServerDisconnected:
+            # the server closed an idle or long-lived session: reconnect once and retry
+            self.smtp = self.transporte._conectar()
+            self._enviar(correo)
+
+    def _enviar(self, correo):
+        try:
+            self.smtp.send_message(correo)
+        except smtplib.SMTPRecipientsRefused as e:
+            raise ErrorDestinatario(str(e.recipients)) from e
+
+    def cerrar(self):
+        try:
+            self.smtp.quit()
+        except smtplib.SMTPException:
+            self.smtp.close()
+
+
+class TransporteArchivo:
+    """Writes each message as an .eml file (development, tests)"""
+
+    def __init__(self, config):
+        self.directorio = config["MAIL_FILE_DIR"]
+
+    @contextmanager
+    def conexion(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        yield self
+
+    def enviar(self, correo):
+        nombre = f"{time.time_ns()}-{os.getpid()}.eml"
+        temporal = os.path.join(self.directorio, nombre + ".tmp")
+        with open(temporal, "wb") as archivo:
+            archivo.write(correo.as_bytes())
+        os.replace(temporal, os.path.join(self.directorio, nombre))
+
+
+class TransporteConsola:
+    """Logs each message instead of sending it"""
+
+    def __init__(self, config):
+        pass
+
+    @contextmanager
+    def conexion(self):
+        yield self
+
+    def enviar(self, correo):
+        current_app.logger.info("Mail to %s: %s\n%s", correo["To"], correo["Subject"], correo.get_content())
+
+
+TRANSPORTES = {
+    "smtp": TransporteSMTP,
+    "file": TransporteArchivo,
+    "console": TransporteConsola,
+}
+
+
+def transporte():
+    """Transport configured in MAIL_TRANSPORT"""
+    nombre = current_app.config["MAIL_TRANSPORT"]
+    if nombre in TRANSPORTES:
+        clase = TRANSPORTES[nombre]
+    elif ":" in nombre:
+        modulo, _, atributo = nombre.partition(":")
+        clase = getattr(importlib.import_module(modulo), atributo)
+    else:
+        raise ValueError(f"MAIL_TRANSPORT must be one of {', '.join(TRANSPORTES)} or 'module:Class'")
+    return clase(current_app.config)
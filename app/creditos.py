@@ -0,0 +1,156 @@
+"""
+Invoice credits.
+
+``MovimientoCredito`` is the ledger: every grant, consumption, refund and
+manual adjustment is one row, and ``User.creditos`` is the cached balance
+(the sum of that user's rows, checked by ``flask reconciliar-creditos``).
+
+The balance is never changed with read-modify-write in Python. Every change
+is a single atomic UPDATE:
+
+- consuming: ``UPDATE users SET creditos = creditos - n WHERE id = :id AND creditos >= n``.
+  If no row matches, the balance was short and the caller rolls back.
+- granting and refunding: ``UPDATE users SET creditos = creditos + n``.
+- an admin setting the balance: ``UPDATE users SET creditos = :nuevo WHERE
+  id = :id AND creditos = :visto``, where ``visto`` is the balance the form
+  showed. If the user spent credits in between, nothing changes and the
+  admin sees the new balance.
+
+Views call ``consumir`` as the *last* statement before commit, after the
+invoice, its history and its notifications are written. The row lock on
+``users`` is then held only for the commit itself, so concurrent
+submissions from one account do not queue behind each other's work.
+
+The unique (factura_id, tipo) constraint means an invoice is charged and
+refunded at most once, whichever path triggers it.
+"""
+
+from sqlalchemy import update, func
+from .extensions import db
+from .models import User, MovimientoCredito
+
+APERTURA = "apertura"
+ASIGNACION = "asignacion"
+CONSUMO = "consumo"
+REEMBOLSO = "reembolso"
+AJUSTE = "ajuste"
+
+
+def _sumar(usuario_ids, cantidad):
+    """Atomic ``creditos = creditos + cantidad`` for one or many users"""
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(usuario_ids))
+        .values(creditos=User.creditos + cantidad)
+    )
+
+
+def consumir(usuario_id, facturas, realizado_por=None):
+    """Charge one credit per invoice, atomically.
+
+    Returns False (and changes nothing) if the user does not have enough
+    credits; the caller must then roll back the invoices it created.
+    """
+    cantidad = len(facturas)
+    resultado = db.session.execute(
+        update(User)
+        .where(User.id == usuario_id, User.creditos >= cantidad)
+        .values(creditos=User.creditos - cantidad)
+    )
+    if resultado.rowcount != 1:
+        return False
+
+    db.session.add_all([
+        MovimientoCredito(
+            usuario_id=usuario_id,
+            factura_id=factura.id,
+            tipo=CONSUMO,
+            cantidad=-1,
+            realizado_por=realizado_por or usuario_id
+        )
+        for factura in facturas
+    ])
+    return True
+
+
+def reembolsar(factura, realizado_por, comentario=None):
+    """Give back the credit of a rejected invoice; no-op if already refunded"""
+    ya_reembolsada = db.session.query(MovimientoCredito.id)\
+        .filter_by(factura_id=factura.id, tipo=REEMBOLSO).first()
+    if ya_reembolsada:
+        return False
+
+    _sumar([factura.usuario_id], 1)
+    db.session.add(MovimientoCredito(
+        usuario_id=factura.usuario_id,
+        factura_id=factura.id,
+        tipo=REEMBOLSO,
+        cantidad=1,
+        comentario=comentario,
+        realizado_por=realizado_por
+    ))
+    return True
+
+
+def asignar(usuario_ids, cantidad, realizado_por, comentario=None):
+    """Grant ``cantidad`` credits to many users with one UPDATE and one bulk INSERT"""
+    usuario_ids = sorted(set(usuario_ids))
+    if not usuario_ids or cantidad <= 0:
+        return 0
+
+    _sumar(usuario_ids, cantidad)
+    db.session.add_all([
+        MovimientoCredito(
+            usuario_id=usuario_id,
+            tipo=ASIGNACION,
+            cantidad=cantidad,
+            comentario=comentario,
+            realizado_por=realizado_por
+        )
+        for usuario_id in usuario_ids
+    ])
+    return len(usuario_ids)
+
+
+def ajustar(usuario, saldo_nuevo, saldo_visto, realizado_por, comentario=None):
+    """Set a user's balance from the admin form, recording the difference.
+
+    ``saldo_visto`` is the balance the form was rendered with. Returns the
+    difference applied, or None if the balance changed since then.
+    """
+    diferencia = saldo_nuevo - saldo_visto
+    if diferencia == 0:
+        return 0
+
+    resultado = db.session.execute(
+        update(User)
+        .where(User.id == usuario.id, User.creditos == saldo_visto)
+        .values(creditos=saldo_nuevo)
+    )
+    if resultado.rowcount != 1:
+        return None
+    db.session.add(MovimientoCredito(
+        usuario_id=usuario.id,
+        tipo=AJUSTE,
+        cantidad=diferencia,
+        comentario=comentario or "Ajuste manual desde la gestión de usuarios",
+        realizado_por=realizado_por
+    ))
+    return diferencia
+
+
+def saldos_del_libro():
+    """{usuario_id: sum of the ledger} in one grouped query"""
+    filas = db.session.query(MovimientoCredito.usuario_id, func.sum(MovimientoCredito.cantidad))\
+        .group_by(MovimientoCredito.usuario_id).all()
+    return {usuario_id: int(total or 0) for usuario_id, total in filas}
+
+
+def descuadres():
+    """Users whose cached balance differs from the ledger: [(user, cached, ledger)]"""
+    libro = saldos_del_libro()
+    return [
+        (usuario, usuario.creditos or 0, libro.get(usuario.id, 0))
+        for usuario in User.query.order_by(User.id).all()
+        if (usuario.creditos or 0) != libro.get(usuario.id, 0)
+    ]
@@ -0,0 +1,90 @@
+"""
+Duplicate pedimento detection.
+
+A pedimento is identified by its number, customs office (aduana) and broker
+licence (patente). ``Factura.clave_de`` hashes the normalised triple into
+``clave_pedimento``, and the partial unique index
+``uq_facturas_clave_pedimento`` admits one non-cancelled invoice per key.
+
+The checks below are lookups on that index, so they cost the same at any
+table size. They exist to give a readable error before anything is written;
+the index is the actual guarantee. Two concurrent requests can both pass
+``buscar``, and the second flush then fails with IntegrityError, which the
+routes report with the same message.
+
+The index cannot see the same pedimento number filed under a different
+aduana or patente (usually a typo in one of them), nor duplicates saved
+before it existed (their ``clave_pedimento`` is NULL). ``casi_duplicados``
+lists both for review: invoices sharing ``pedimento_normalizado``.
+"""
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import joinedload
+from .extensions import db
+from .models import Factura
+
+# A literal, not a bound parameter: the planner only uses a partial index
+# when the query's WHERE visibly implies the index's WHERE
+NO_CANCELADA = Factura.estado != literal_column("'cancelada'")
+
+_LOTE_IN = 500
+
+EN_OTRA_FACTURA = "Este pedimento (número, aduana y patente) ya está registrado en otra factura."
+
+
+def buscar(numero_pedimento, numero_aduana, patente_aduanal, excluir_id=None):
+    """(id, usuario_id) of the non-cancelled invoice holding this pedimento, or None"""
+    query = db.session.query(Factura.id, Factura.usuario_id).filter(
+        Factura.clave_pedimento == Factura.clave_de(numero_pedimento, numero_aduana, patente_aduanal),
+        NO_CANCELADA
+    )
+    if excluir_id is not None:
+        query = query.filter(Factura.id != excluir_id)
+    return query.first()
+
+
+def existentes(claves):
+    """{clave: (id, usuario_id)} for the keys already held by a non-cancelled invoice"""
+    claves = list(set(claves))
+    encontradas = {}
+    for inicio in range(0, len(claves), _LOTE_IN):
+        filas = db.session.query(Factura.clave_pedimento, Factura.id, Factura.usuario_id).filter(
+            Factura.clave_pedimento.in_(claves[inicio:inicio + _LOTE_IN]),
+            NO_CANCELADA
+        )
+        for clave, factura_id, usuario_id in filas:
+            encontradas[clave] = (factura_id, usuario_id)
+    return encontradas
+
+
+def mensaje(duplicada, usuario):
+    """Error text for a duplicate; requesters are not told the number of someone else's invoice"""
+    factura_id, usuario_id = duplicada
+    if usuario.is_usuario() and usuario_id != usuario.id:
+        return EN_OTRA_FACTURA
+    return f"Este pedimento (número, aduana y patente) ya está registrado en la factura #{factura_id}."
+
+
+def casi_duplicados(page, per_page):
+    """Pagination of pedimento numbers on more than one non-cancelled invoice.
+
+    Each item is (pedimento_normalizado, [Factura, ...]) with the invoices
+    oldest first. The grouping walks the pedimento_normalizado index, so
+    this is a report to open on demand, not a per-request check.
+    """
+    total = func.count(Factura.id)
+    grupos = db.session.query(Factura.pedimento_normalizado, total)\
+        .filter(NO_CANCELADA, Factura.pedimento_normalizado.is_not(None))\
+        .group_by(Factura.pedimento_normalizado)\
+        .having(total > 1)\
+        .order_by(total.desc(), Factura.pedimento_normalizado)\
+        .paginate(page=page, per_page=per_page, error_out=False)
+
+    pedimentos = [pedimento for pedimento, _ in grupos.items]
+    facturas = {pedimento: [] for pedimento in pedimentos}
+    if pedimentos:
+        for factura in Factura.query.filter(Factura.pedimento_normalizado.in_(pedimentos), NO_CANCELADA)\
+                .options(joinedload(Factura.usuario)).order_by(Factura.id):
+            facturas[factura.pedimento_normalizado].append(factura)
+    grupos.items = [(pedimento, facturas[pedimento]) for pedimento in pedimentos]
+    return grupos
@@ -1,10 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
+from .cache import FragmentCache
+from .assets import Assets
 
 db = SQLAlchemy()
-migrate = Migrate()
 login_manager = LoginManager()
+fragment_cache = FragmentCache()
+assets = Assets()
 login_manager.login_view = "auth.login"
 login_manager.login_message = "Por favor inicia sesión para acceder a esta página."
 login_manager.login_message_category = "info"
\ No newline at end of file
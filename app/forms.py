@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed
-from wtforms import StringField, PasswordField, SubmitField, FloatField, IntegerField, SelectField, TextAreaField, HiddenField
-from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional, ValidationError
+from flask_wtf.file import FileField, FileAllowed, FileRequired
+from wtforms import StringField, PasswordField, SubmitField, FloatField, DecimalField, IntegerField, SelectField, TextAreaField, HiddenField, DateTimeLocalField, DateField, BooleanField
+from wtforms.validators import DataRequired, Email, InputRequired, Length, NumberRange, Optional, ValidationError
+from wtforms.widgets import HiddenInput
 from .models import User
 
 # =====================
@@ -36,15 +37,19 @@ class RegisterForm(FlaskForm):
 class FacturaForm(FlaskForm):
     # Datos de identificación
     importador = StringField("Importador", validators=[DataRequired(), Length(max=150)],
-                           render_kw={"class": "form-control", "placeholder": "Nombre del importador"})
+                           render_kw={"class": "form-control", "placeholder": "Nombre del importador",
+                                     "autocomplete": "off", "data-autocompletar": "importador"})
     rfc = StringField("RFC", validators=[DataRequired(), Length(max=50)],
-                     render_kw={"class": "form-control", "placeholder": "RFC del importador"})
+                     render_kw={"class": "form-control", "placeholder": "RFC del importador",
+                                     "autocomplete": "off", "data-autocompletar": "rfc"})
     numero_pedimento = StringField("Número de pedimento", validators=[DataRequired(), Length(max=50)],
                                  render_kw={"class": "form-control", "placeholder": "Número de pedimento"})
     numero_aduana = StringField("Número de aduana", validators=[DataRequired(), Length(max=50)],
-                              render_kw={"class": "form-control", "placeholder": "Número de aduana"})
+                              render_kw={"class": "form-control", "placeholder": "Número de aduana",
+                                     "autocomplete": "off", "data-autocompletar": "numero_aduana"})
     patente_aduanal = StringField("Patente aduanal", validators=[DataRequired(), Length(max=50)],
-                                render_kw={"class": "form-control", "placeholder": "Patente aduanal"})
+                                render_kw={"class": "form-control", "placeholder": "Patente aduanal",
+                                     "autocomplete": "off", "data-autocompletar": "patente_aduanal"})
 
     # Tipo de carga
     tipo = SelectField("Tipo de carga", validators=[DataRequired()],
@@ -52,17 +57,17 @@ class FacturaForm(FlaskForm):
                       render_kw={"class": "form-select"})
 
     # Volúmenes en litros
-    litros_rem1 = FloatField("Litros Remolque 1", validators=[Optional(), NumberRange(min=0)],
+    litros_rem1 = DecimalField("Litros Remolque 1", validators=[Optional(), NumberRange(min=0)],
                            render_kw={"class": "form-control", "placeholder": "0.00", "step": "0.01"})
-    litros_rem2 = FloatField("Litros Remolque 2", validators=[Optional(), NumberRange(min=0)],
+    litros_rem2 = DecimalField("Litros Remolque 2", validators=[Optional(), NumberRange(min=0)],
                            render_kw={"class": "form-control", "placeholder": "0.00", "step": "0.01"})
-    litros_carrotanque = FloatField("Litros Carrotanque", validators=[Optional(), NumberRange(min=0)],
+    litros_carrotanque = DecimalField("Litros Carrotanque", validators=[Optional(), NumberRange(min=0)],
                                   render_kw={"class": "form-control", "placeholder": "0.00", "step": "0.01"})
-    litros_barcaza = FloatField("Litros Barcaza", validators=[Optional(), NumberRange(min=0)],
+    litros_barcaza = DecimalField("Litros Barcaza", validators=[Optional(), NumberRange(min=0)],
                               render_kw={"class": "form-control", "placeholder": "0.00", "step": "0.01"})
 
     # Datos financieros
-    precio_molecula_galon = FloatField("Precio por galón (USD)", validators=[DataRequired(), NumberRange(min=0)],
+    precio_molecula_galon = DecimalField("Precio por galón (USD)", places=3, validators=[DataRequired(), NumberRange(min=0)],
                                      render_kw={"class": "form-control", "placeholder": "0.00", "step": "0.001"})
 
     densidad = FloatField("Densidad", validators=[Optional(), NumberRange(min=0)],
@@ -93,19 +98,41 @@ class FacturaForm(FlaskForm):
 # Configuración de tasas (solo admin)
 # =====================
 class TasasForm(FlaskForm):
-    ieps = FloatField("IEPS por galón (MXN)", validators=[DataRequired(), NumberRange(min=0)],
+    ieps = DecimalField("IEPS por galón (MXN)", places=6, validators=[DataRequired(), NumberRange(min=0)],
                      render_kw={"class": "form-control", "placeholder": "4.59", "step": "0.01"})
-    iva = FloatField("IVA (%)", validators=[DataRequired(), NumberRange(min=0, max=1)],
+    iva = DecimalField("IVA (%)", places=6, validators=[DataRequired(), NumberRange(min=0, max=1)],
                     render_kw={"class": "form-control", "placeholder": "0.16", "step": "0.01"})
-    pvr = FloatField("PVR por galón (MXN)", validators=[DataRequired(), NumberRange(min=0)],
+    pvr = DecimalField("PVR por galón (MXN)", places=6, validators=[DataRequired(), NumberRange(min=0)],
                     render_kw={"class": "form-control", "placeholder": "0.20", "step": "0.01"})
-    iva_pvr = FloatField("IVA sobre PVR (%)", validators=[DataRequired(), NumberRange(min=0, max=1)],
+    iva_pvr = DecimalField("IVA sobre PVR (%)", places=6, validators=[DataRequired(), NumberRange(min=0, max=1)],
                         render_kw={"class": "form-control", "placeholder": "0.16", "step": "0.01"})
-    factor_conversion = FloatField("Factor de conversión (L→Gal)", validators=[DataRequired(), NumberRange(min=0)],
+    factor_conversion = DecimalField("Factor de conversión (L→Gal)", places=6, validators=[DataRequired(), NumberRange(min=0)],
                                  render_kw={"class": "form-control", "placeholder": "0.264172", "step": "0.000001"})
+    vigente_desde = DateTimeLocalField("Vigente desde (UTC)", format="%Y-%m-%dT%H:%M", validators=[Optional()],
+                                       render_kw={"class": "form-control"})
     submit = SubmitField("Guardar configuración", render_kw={"class": "btn btn-success"})
 
 
+# =====================
+# Reportes (admin)
+# =====================
+class ReporteForm(FlaskForm):
+    reporte = SelectField("Reporte", validators=[DataRequired()], render_kw={"class": "form-select"})
+    desde = DateField("Desde", validators=[DataRequired()], render_kw={"class": "form-control"})
+    hasta = DateField("Hasta", validators=[DataRequired()], render_kw={"class": "form-control"})
+    estado = SelectField("Estado de las facturas", validators=[Optional()],
+                        choices=[("", "Todos"), ("aprobada", "Aprobadas"), ("pendiente_admin", "Pendientes de admin"),
+                                 ("pendiente_supervisor", "Pendientes de supervisor"), ("suspendida", "Suspendidas"),
+                                 ("cancelada", "Canceladas")],
+                        render_kw={"class": "form-select"})
+    forzar = BooleanField("Regenerar aunque exista en caché", render_kw={"class": "form-check-input"})
+    submit = SubmitField("Generar reporte", render_kw={"class": "btn btn-primary"})
+
+    def validate_hasta(self, hasta):
+        if self.desde.data and hasta.data and hasta.data < self.desde.data:
+            raise ValidationError("La fecha final debe ser posterior a la inicial.")
+
+
 # =====================
 # Gestión de usuarios (admin)
 # =====================
@@ -119,6 +146,8 @@ class UserManagementForm(FlaskForm):
                      render_kw={"class": "form-select"})
     creditos = IntegerField("Créditos", validators=[DataRequired(), NumberRange(min=0)],
                           render_kw={"class": "form-control"})
+    # Saldo con el que se mostró el formulario: el ajuste solo se aplica si sigue igual
+    creditos_vistos = IntegerField(widget=HiddenInput(), validators=[InputRequired()])
     activo = SelectField("Estado", validators=[DataRequired()],
                         choices=[(True, "Activo"), (False, "Inactivo")],
                         coerce=lambda x: x == 'True',
@@ -126,6 +155,26 @@ class UserManagementForm(FlaskForm):
     submit = SubmitField("Guardar", render_kw={"class": "btn btn-primary"})
 
 
+class AsignarCreditosForm(FlaskForm):
+    cantidad = IntegerField("Créditos por usuario", validators=[DataRequired(), NumberRange(min=1, max=10000)],
+                          render_kw={"class": "form-control", "placeholder": "10"})
+    destino = SelectField("Asignar a", validators=[DataRequired()],
+                         choices=[("usuario", "Todos los usuarios activos"),
+                                  ("supervisor", "Todos los supervisores activos"),
+                                  ("emails", "Solo los emails indicados")],
+                         render_kw={"class": "form-select"})
+    emails = TextAreaField("Emails (uno por línea)", validators=[Optional()],
+                          render_kw={"class": "form-control", "rows": "4",
+                                    "placeholder": "usuario1@empresa.com\nusuario2@empresa.com"})
+    comentario = StringField("Comentario", validators=[Optional(), Length(max=255)],
+                            render_kw={"class": "form-control", "placeholder": "Motivo de la asignación"})
+    submit = SubmitField("Asignar créditos", render_kw={"class": "btn btn-primary"})
+
+    def validate_emails(self, emails):
+        if self.destino.data == "emails" and not (emails.data or "").strip():
+            raise ValidationError("Indica al menos un email.")
+
+
 # =====================
 # Revisión de facturas
 # =====================
@@ -228,4 +277,17 @@ class EditarUsuarioForm(FlaskForm):
                             render_kw={"class": "form-control"})
     confirm_password = PasswordField("Confirmar Contraseña", validators=[Optional()],
                                    render_kw={"class": "form-control"})
-    submit = SubmitField("Guardar Cambios", render_kw={"class": "btn btn-primary"})
\ No newline at end of file
+    submit = SubmitField("Guardar Cambios", render_kw={"class": "btn btn-primary"})
+
+
+class AdjuntoForm(FlaskForm):
+    """Formulario para adjuntar un archivo a una factura"""
+    archivo = FileField("Archivo", validators=[FileRequired("Selecciona un archivo."),
+                                               FileAllowed(["pdf", "doc", "docx", "xls", "xlsx", "jpg", "jpeg", "png"],
+                                                           "Solo PDF, Word, Excel o imágenes JPG/PNG.")],
+                        render_kw={"class": "form-control form-control-sm"})
+    submit = SubmitField("Adjuntar", render_kw={"class": "btn btn-sm btn-outline-primary"})
+
+
+class EliminarAdjuntoForm(FlaskForm):
+    """Solo el token CSRF, para quitar un adjunto"""
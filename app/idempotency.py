@@ -0,0 +1,211 @@
+"""
+Idempotency keys for state-changing POSTs.
+
+Clients send a key with the request, either in the ``Idempotency-Key``
+header (API clients) or as the hidden ``idempotency_key`` form field that
+``idempotency_key_field()`` renders (browser forms). The first request with
+a key runs the view. Any retry with the same key within
+``IDEMPOTENCY_TTL`` gets the stored response back and the view is not run
+again, so no second invoice is created and no second credit is charged.
+
+The key row is inserted and flushed *in the same transaction* as the view's
+own work, before the view runs. The unique (usuario_id, clave) index does
+the locking:
+
+- the row commits together with the invoice, or disappears with it on
+  rollback;
+- a concurrent retry blocks on the index until the first request commits,
+  and then gets an IntegrityError. It re-reads the key and replays the
+  stored response, or answers 409 if the response is still being
+  recorded.
+
+A view that commits its own work must hand its response to
+``record_response()`` *before* that commit, so the stored response goes
+out in the same transaction. Otherwise a crash between the view's commit
+and the decorator's would leave a committed key with no response, and
+every retry would get 409 until the key expires, with no way to learn
+the id of the invoice that was created.
+
+Only outcomes worth replaying are stored: redirects (the POST/redirect/GET
+of the HTML views) and 2xx JSON responses. A form re-rendered with
+validation errors, or an API 4xx, releases the key so the client can fix
+the request and retry.
+"""
+
+import hashlib
+import uuid
+from urllib.parse import urlencode
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, g, current_app, jsonify, redirect, flash, Response
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from .extensions import db
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+FORM_FIELD = "idempotency_key"
+MAX_KEY_LENGTH = 100
+
+
+def idempotency_key_field():
+    """Hidden input with a fresh key, for use inside a POST form"""
+    return Markup(f'<input type="hidden" name="{FORM_FIELD}" value="{uuid.uuid4()}">')
+
+
+def _request_key():
+    return (request.headers.get(HEADER) or request.form.get(FORM_FIELD) or "").strip()
+
+
+def _fingerprint():
+    """Hash of endpoint + payload, to reject a key reused for a different request.
+
+    Form posts are hashed from the parsed fields (the raw stream is already
+    consumed by then); the CSRF token is one of them and a resubmit sends
+    the same one.
+    """
+    if request.form:
+        payload = urlencode(sorted(request.form.items(multi=True))).encode("utf-8")
+    else:
+        payload = request.get_data(cache=True)
+    digest = hashlib.sha256(request.endpoint.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(payload)
+    return digest.hexdigest()
+
+
+def _is_json():
+    return request.is_json or request.headers.get(HEADER) is not None
+
+
+def _find(usuario_id, clave):
+    return IdempotencyKey.query.filter_by(usuario_id=usuario_id, clave=clave).first()
+
+
+def _replay(entry):
+    """Return the stored response of a completed key"""
+    if entry.location:
+        if not _is_json():
+            flash("Esta solicitud ya había sido procesada; no se repitió.", "info")
+        return redirect(entry.location, code=entry.status_code)
+    response = Response(entry.cuerpo or "", status=entry.status_code, content_type=entry.content_type)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _conflict(message, status):
+    if _is_json():
+        response = jsonify(error=message)
+        response.status_code = status
+        if status == 409:
+            response.headers["Retry-After"] = "1"
+        return response
+    flash(message, "warning")
+    return redirect(request.referrer or request.path)
+
+
+def _answer_existing(entry, huella):
+    if entry is None:
+        # the request holding the key rolled back after we collided with it
+        return _conflict("Una petición con esta clave sigue en proceso; reintenta en un momento.", 409)
+    if entry.huella != huella or entry.endpoint != request.endpoint:
+        return _conflict("La clave de idempotencia ya se usó con otra petición.", 422)
+    if entry.status_code is None:
+        return _conflict("Una petición con esta clave sigue en proceso; reintenta en un momento.", 409)
+    return _replay(entry)
+
+
+def _storable(response):
+    if 300 <= response.status_code < 400:
+        return True
+    return 200 <= response.status_code < 300 and response.is_json
+
+
+def _store(entry, response):
+    entry.status_code = response.status_code
+    entry.content_type = response.content_type
+    entry.location = response.location
+    entry.cuerpo = None if response.location else response.get_data(as_text=True)
+
+
+def record_response(rv):
+    """Store the view's response on its idempotency key; call it right before the view commits.
+
+    Takes anything a view may return and gives back the Response to
+    return. Outside an idempotent request, or for a response that is not
+    replayed, it only builds the Response.
+    """
+    response = current_app.make_response(rv)
+    entry = g.get("idempotency_entry")
+    if entry is not None and _storable(response):
+        _store(entry, response)
+    return response
+
+
+def idempotent(f):
+    """Make a POST view replay its stored response for a repeated idempotency key"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        clave = _request_key()
+        if request.method != "POST" or not clave:
+            return f(*args, **kwargs)
+        if len(clave) > MAX_KEY_LENGTH:
+            return _conflict(f"La clave de idempotencia admite como máximo {MAX_KEY_LENGTH} caracteres.", 400)
+
+        usuario = g.get("api_user") or current_user
+        huella = _fingerprint()
+        ahora = datetime.utcnow()
+
+        entry = _find(usuario.id, clave)
+        if entry is not None:
+            if entry.expira_en > ahora:
+                return _answer_existing(entry, huella)
+            # flushed on its own: the unit of work would run the INSERT first
+            db.session.delete(entry)
+            db.session.flush()
+
+        entry = IdempotencyKey(
+            usuario_id=usuario.id,
+            clave=clave,
+            endpoint=request.endpoint,
+            huella=huella,
+            expira_en=ahora + timedelta(seconds=current_app.config["IDEMPOTENCY_TTL"])
+        )
+        db.session.add(entry)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # a concurrent request with the same key committed while we waited
+            db.session.rollback()
+            return _answer_existing(_find(usuario.id, clave), huella)
+
+        g.idempotency_entry = entry
+        try:
+            response = current_app.make_response(f(*args, **kwargs))
+        finally:
+            g.pop("idempotency_entry", None)
+
+        # the view rolled back, taking the key row with it
+        if not inspect(entry).persistent:
+            return response
+        # already committed with the view's work through record_response()
+        if entry.status_code is not None:
+            return response
+
+        if _storable(response):
+            _store(entry, response)
+        else:
+            db.session.delete(entry)
+        db.session.commit()
+        return response
+    return decorated_function
+
+
+def purge_expired(now=None):
+    """Delete expired keys; returns how many were removed"""
+    removed = IdempotencyKey.query.filter(IdempotencyKey.expira_en <= (now or datetime.utcnow()))\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return removed
@@ -0,0 +1,88 @@
+"""
+Lazy loading of heavy optional modules.
+
+pandas, numpy, reportlab, docxtpl and Pillow add hundreds of milliseconds
+and tens of MB to a worker, so the web path must not import them at module
+level. Use the proxies defined here instead:
+
+    from .lazy import pandas as pd
+
+    def exportar(...):
+        frame = pd.DataFrame(...)   # pandas is imported here, on first use
+
+If the package is not installed, the first attribute access raises
+``OptionalDependencyError`` naming the pip package to install.
+
+``flask bench imports`` fails if any module in ``HEAVY_MODULES`` ends up
+imported by ``import app`` + ``create_app()``.
+"""
+
+import importlib
+import importlib.util
+import threading
+
+# module name -> pip package that provides it
+HEAVY_MODULES = {
+    "pandas": "pandas",
+    "numpy": "numpy",
+    "reportlab": "reportlab",
+    "docxtpl": "docxtpl",
+    "PIL": "Pillow",
+}
+
+
+class OptionalDependencyError(ImportError):
+    """An optional package needed by a feature is not installed"""
+
+
+class LazyModule:
+    """Module proxy that imports the real module on first attribute access"""
+
+    def __init__(self, name, package=None):
+        self._name = name
+        self._package = package or HEAVY_MODULES.get(name.split(".")[0], name)
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    try:
+                        self._module = importlib.import_module(self._name)
+                    except ImportError as e:
+                        raise OptionalDependencyError(
+                            f"'{self._name}' is required for this feature; "
+                            f"install it with `pip install {self._package}`"
+                        ) from e
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_import(name, package=None):
+    """Return a proxy for ``name`` that imports it on first use"""
+    return LazyModule(name, package)
+
+
+def is_available(name):
+    """True if the optional module is installed (without importing it)"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ImportError:
+        return False
+
+
+pandas = lazy_import("pandas")
+numpy = lazy_import("numpy")
+PIL_Image = lazy_import("PIL.Image", "Pillow")
+reportlab_canvas = lazy_import("reportlab.pdfgen.canvas", "reportlab")
+docxtpl = lazy_import("docxtpl")
@@ -0,0 +1,176 @@
+"""
+Prometheus metrics for the invoice workflow.
+
+Exposes request latency per endpoint, DB pool utilization and business
+counters at ``/metrics``. When ``PROMETHEUS_MULTIPROC_DIR`` is set (gunicorn
+with several workers, see ``gunicorn.conf.py``) every worker writes its
+samples to that shared directory and any worker can answer the scrape with
+the aggregated values. The job worker (``flask worker``) must run with the
+same directory for the counters its jobs record to be included.
+
+A scrape is allowed with ``Authorization: Bearer <METRICS_TOKEN>``, or from
+an address in ``METRICS_ALLOWED_IPS`` when the request did not come through
+a proxy. Behind the local reverse proxy every request arrives from
+127.0.0.1, so proxied requests (those carrying ``X-Forwarded-For`` or
+``Forwarded``) never pass on the address alone.
+"""
+
+import hmac
+import os
+import time
+from flask import g, request, abort, current_app, Response
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+from .extensions import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram(
+    "facturas_request_duration_seconds",
+    "Request latency by blueprint endpoint",
+    ["endpoint", "method"],
+    buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter(
+    "facturas_requests_total",
+    "Requests by blueprint endpoint and status code",
+    ["endpoint", "method", "status"]
+)
+
+DB_POOL_CHECKED_OUT = Gauge(
+    "facturas_db_pool_checked_out",
+    "DB connections currently checked out of the pool",
+    multiprocess_mode="livesum"
+)
+DB_POOL_SIZE = Gauge(
+    "facturas_db_pool_size",
+    "Configured DB pool size",
+    multiprocess_mode="livesum"
+)
+DB_POOL_OVERFLOW = Gauge(
+    "facturas_db_pool_overflow",
+    "DB connections opened beyond the pool size",
+    multiprocess_mode="livesum"
+)
+
+FACTURAS_CREADAS = Counter(
+    "facturas_creadas_total",
+    "Invoices created"
+)
+TRANSICIONES = Counter(
+    "facturas_transiciones_total",
+    "Invoice workflow actions by accion",
+    ["accion"]
+)
+NOTIFICACIONES_FANOUT = Histogram(
+    "facturas_notificaciones_fanout",
+    "Notifications created per workflow event",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100)
+)
+
+
+class EstadoCollector:
+    """Queue depth per invoice estado, read from the database at scrape time"""
+
+    def collect(self):
+        from .models import Factura
+
+        depth = GaugeMetricFamily(
+            "facturas_por_estado",
+            "Invoices currently in each estado",
+            labels=["estado"]
+        )
+        rows = db.session.query(Factura.estado, db.func.count(Factura.id))\
+            .group_by(Factura.estado).all()
+        for estado, total in rows:
+            depth.add_metric([estado], total)
+        yield depth
+
+
+_estado_registry = CollectorRegistry(auto_describe=False)
+_estado_registry.register(EstadoCollector())
+
+
+def multiprocess_enabled():
+    """True when samples are shared between workers through a directory"""
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def record_invoice_created(count=1):
+    FACTURAS_CREADAS.inc(count)
+
+
+def record_transition(accion, count=1):
+    TRANSICIONES.labels(accion=accion).inc(count)
+
+
+def record_notification_fanout(count):
+    NOTIFICACIONES_FANOUT.observe(count)
+
+
+def _update_pool_gauges():
+    pool = db.engine.pool
+    if hasattr(pool, "checkedout"):
+        DB_POOL_CHECKED_OUT.set(pool.checkedout())
+    if hasattr(pool, "size"):
+        DB_POOL_SIZE.set(pool.size())
+    if hasattr(pool, "overflow"):
+        DB_POOL_OVERFLOW.set(max(pool.overflow(), 0))
+
+
+def _scrape_allowed():
+    token = current_app.config.get("METRICS_TOKEN")
+    if token:
+        sent = request.headers.get("Authorization", "")
+        if hmac.compare_digest(sent.encode(), f"Bearer {token}".encode()):
+            return True
+    allowed = current_app.config.get("METRICS_ALLOWED_IPS")
+    proxied = "X-Forwarded-For" in request.headers or "Forwarded" in request.headers
+    return bool(allowed) and not proxied and request.remote_addr in allowed
+
+
+def metrics_view():
+    """Prometheus text exposition, for METRICS_TOKEN or direct requests from METRICS_ALLOWED_IPS"""
+    if not _scrape_allowed():
+        abort(404)
+
+    if multiprocess_enabled():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    output = generate_latest(registry) + generate_latest(_estado_registry)
+    return Response(output, mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Register request instrumentation and the /metrics endpoint"""
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    # Observed at teardown, which also runs when the view (or an after_request hook) raises
+    @app.teardown_request
+    def _observe_request(exc):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "sin_ruta"
+            status = 500 if exc is not None else g.pop("_metrics_status", 500)
+            REQUEST_LATENCY.labels(endpoint=endpoint, method=request.method)\
+                .observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint=endpoint, method=request.method, status=str(status)).inc()
+        _update_pool_gauges()
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,214 @@
+"""
+Downscaled previews of image and PDF attachments.
+
+Previews are cached on disk by content: ``PREVIEWS_DIR/ab/<sha256>-<size>.jpg``,
+one JPEG per size in ``PREVIEW_SIZES`` (longest side in pixels). The same
+scan attached to many invoices is rendered once. The preview URL carries
+the blob's sha256 (a reused attachment id gets a different URL), so a URL
+always points at the same content. Previews are therefore served with a
+one-year ``immutable`` cache lifetime, and a reviewer's browser fetches
+each thumbnail once.
+
+Rendering is CPU-bound, so it never runs in a web thread. A new upload
+queues the ``miniaturas.generar`` job, and ``flask worker`` renders every
+size before anyone opens the invoice (without a worker, ``JOBS_EAGER``, no
+job is queued). A preview requested before that
+(older attachments, a new size) is rendered in this process's
+``ProcessPoolExecutor``. The request waits at most ``PREVIEW_WAIT``
+seconds and otherwise answers 503 with Retry-After. Concurrent requests
+for the same preview share one render.
+
+Pillow decodes JPEG at reduced scale (``draft``), so a 20-megapixel scan
+never fully decodes. A PDF's first page is rasterised with poppler's
+``pdftoppm`` (``PREVIEW_PDFTOPPM``) when it is installed. Without it,
+PDFs simply have no preview.
+"""
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from flask import current_app
+from . import adjuntos, trabajos
+from .extensions import db
+from .models import Blob
+
+TIPOS_IMAGEN = ("image/jpeg", "image/png")
+PDF = "application/pdf"
+
+
+class NoDisponible(Exception):
+    """The preview is still being rendered (or the pool is restarting); ask again shortly"""
+
+
+_pool = None
+_pool_pid = None
+_en_curso = {}
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _pdftoppm(comando):
+    return shutil.which(comando) if comando else None
+
+
+def soportado(tipo_mime):
+    """Whether previews can be rendered for this type"""
+    if tipo_mime in TIPOS_IMAGEN:
+        return True
+    return tipo_mime == PDF and _pdftoppm(current_app.config["PREVIEW_PDFTOPPM"]) is not None
+
+
+def ruta(sha256, tamano):
+    return os.path.join(current_app.config["PREVIEWS_DIR"], sha256[:2], f"{sha256}-{tamano}.jpg")
+
+
+def _marca_error(destino):
+    return destino + ".error"
+
+
+# =====================
+# Rendering (runs in pool processes and in `flask worker`; no app context)
+# =====================
+def renderizar(origen, destino, lado, tipo_mime, pdftoppm=None):
+    """Write a JPEG of at most ``lado`` x ``lado`` pixels; True on success.
+
+    A source that cannot be decoded leaves a ``.error`` marker so that it is
+    not retried on every request, and returns False. Any other failure (a
+    pdftoppm timeout, a full disk) is raised and leaves no marker, so the
+    next request or job attempt renders it again.
+    """
+    from PIL import Image, ImageOps
+
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    try:
+        with tempfile.TemporaryDirectory() as directorio:
+            if tipo_mime == PDF:
+                pagina = os.path.join(directorio, "pagina")
+                subprocess.run([pdftoppm, "-f", "1", "-l", "1", "-singlefile", "-png",
+                                "-scale-to", str(lado), origen, pagina],
+                               check=True, timeout=60, capture_output=True)
+                origen = pagina + ".png"
+
+            with Image.open(origen) as imagen:
+                imagen.draft("RGB", (lado, lado))
+                imagen = ImageOps.exif_transpose(imagen)
+                imagen.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+                if imagen.mode in ("RGBA", "LA", "P"):
+                    imagen = imagen.convert("RGBA")
+                    fondo = Image.new("RGB", imagen.size, "white")
+                    fondo.paste(imagen, mask=imagen.getchannel("A"))
+                    imagen = fondo
+                elif imagen.mode not in ("RGB", "L"):
+                    imagen = imagen.convert("RGB")
+                imagen.save(temporal, "JPEG", quality=80, optimize=True, progressive=True)
+        os.replace(temporal, destino)
+        return True
+    except Exception as e:
+        if os.path.exists(temporal):
+            os.unlink(temporal)
+        if not _fuente_invalida(e):
+            raise
+        open(_marca_error(destino), "w").close()
+        return False
+
+
+def _fuente_invalida(error):
+    """Whether rendering failed because of the source itself (so it would fail again)"""
+    from PIL import Image
+
+    if isinstance(error, (subprocess.CalledProcessError, Image.DecompressionBombError, SyntaxError)):
+        return True
+    # Pillow reports undecodable data as OSError without errno; ENOSPC, EIO and the like carry one
+    return isinstance(error, OSError) and error.errno is None
+
+
+def _argumentos(sha256, tipo_mime, tamano):
+    config = current_app.config
+    return (adjuntos.ruta(sha256), ruta(sha256, tamano), config["PREVIEW_SIZES"][tamano], tipo_mime,
+            _pdftoppm(config["PREVIEW_PDFTOPPM"]))
+
+
+def _ejecutor():
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        # spawn, not fork: the web process has threads and open database connections
+        _pool = ProcessPoolExecutor(
+            max_workers=current_app.config["PREVIEW_WORKERS"],
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=current_app.config["PREVIEW_TASKS_PER_CHILD"],
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def obtener(sha256, tipo_mime, tamano):
+    """Path of the preview, rendering it in the pool if needed; None if it cannot be rendered.
+
+    Raises NoDisponible if the render takes longer than PREVIEW_WAIT.
+    """
+    global _pool
+    destino = ruta(sha256, tamano)
+    if os.path.exists(destino):
+        return destino
+    if os.path.exists(_marca_error(destino)) or not soportado(tipo_mime):
+        return None
+
+    clave = (sha256, tamano)
+    with _lock:
+        futuro = _en_curso.get(clave)
+        if futuro is None:
+            futuro = _ejecutor().submit(renderizar, *_argumentos(sha256, tipo_mime, tamano))
+            _en_curso[clave] = futuro
+            futuro.add_done_callback(lambda _: _en_curso.pop(clave, None))
+    try:
+        return destino if futuro.result(timeout=current_app.config["PREVIEW_WAIT"]) else None
+    except TimeoutError:
+        raise NoDisponible(clave)
+    except BrokenProcessPool:
+        # a render process died (out of memory on a huge image?): start a fresh pool next time
+        with _lock:
+            _pool = None
+        raise NoDisponible(clave)
+    except Exception:
+        # transient (timeout, disk full): no marker was left, the browser asks again
+        current_app.logger.exception("Preview %s-%s failed", sha256, tamano)
+        raise NoDisponible(clave)
+
+
+def programar(adjunto):
+    """Queue the rendering of a new attachment's previews (none if already cached)"""
+    if current_app.config["JOBS_EAGER"]:
+        return  # no worker: the first request for each preview renders it in the pool instead
+    blob = db.session.get(Blob, adjunto.blob_sha256)
+    if not soportado(blob.tipo_mime):
+        return
+    if all(os.path.exists(ruta(blob.sha256, tamano)) for tamano in current_app.config["PREVIEW_SIZES"]):
+        return
+    trabajos.encolar("miniaturas.generar", {"sha256": blob.sha256, "tipo_mime": blob.tipo_mime},
+                     prioridad=trabajos.BAJA)
+
+
+@trabajos.tarea("miniaturas.generar")
+def generar(sha256, tipo_mime):
+    """Render every size of a blob's preview (in the worker process itself)"""
+    for tamano in current_app.config["PREVIEW_SIZES"]:
+        if not os.path.exists(ruta(sha256, tamano)):
+            renderizar(*_argumentos(sha256, tipo_mime, tamano))
+
+
+def borrar(sha256):
+    """Delete a blob's cached previews (when the blob is purged)"""
+    for tamano in current_app.config["PREVIEW_SIZES"]:
+        for camino in (ruta(sha256, tamano), _marca_error(ruta(sha256, tamano))):
+            try:
+                os.unlink(camino)
+            except FileNotFoundError:
+                pass
+
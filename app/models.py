@@ -1,8 +1,19 @@
 from datetime import datetime
+import hashlib
+import re
+import secrets
+from decimal import Decimal
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import inspect, text
 from werkzeug.security import generate_password_hash, check_password_hash
 from .extensions import db
+from . import money
+
+# Fixed-point column types (see app/money.py)
+MONEY = db.Numeric(16, money.MONEY_PLACES)
+VOLUME = db.Numeric(18, money.VOLUME_PLACES)
+RATE = db.Numeric(12, money.RATE_PLACES)
 
 # =====================
 # USUARIOS
@@ -19,6 +30,7 @@ class User(UserMixin, db.Model):
     activo = db.Column(db.Boolean, default=True)
     creado_en = db.Column(db.DateTime, default=datetime.utcnow)
     ultimo_acceso = db.Column(db.DateTime, default=datetime.utcnow)
+    ultimo_resumen_en = db.Column(db.DateTime, nullable=True)  # último correo de resumen de notificaciones
 
     # Relationships
     facturas = db.relationship("Factura", foreign_keys="Factura.usuario_id", backref="usuario", lazy=True)
@@ -40,6 +52,10 @@ class User(UserMixin, db.Model):
     def is_usuario(self):
         return self.rol == "usuario"
 
+    def notificaciones_sin_leer(self):
+        """Cuántas notificaciones no ha leído (contador de la barra de navegación, sin cargarlas)"""
+        return Notificacion.query.filter_by(usuario_id=self.id, leida=False).count()
+
     def __repr__(self):
         return f"<User {self.email} ({self.rol})>"
 
@@ -51,13 +67,16 @@ class ConfiguracionTasas(db.Model):
     __tablename__ = "configuracion_tasas"
 
     id = db.Column(db.Integer, primary_key=True)
-    ieps = db.Column(db.Float, default=4.59)   # por galón
-    iva = db.Column(db.Float, default=0.16)    # %
-    pvr = db.Column(db.Float, default=0.20)    # por galón
-    iva_pvr = db.Column(db.Float, default=0.16) # %
+    ieps = db.Column(RATE, default=Decimal("4.59"))   # por galón
+    iva = db.Column(RATE, default=Decimal("0.16"))    # %
+    pvr = db.Column(RATE, default=Decimal("0.20"))    # por galón
+    iva_pvr = db.Column(RATE, default=Decimal("0.16")) # %
 
     # Conversion factor (can be updated)
-    factor_conversion = db.Column(db.Float, default=0.264172)  # litros → galones
+    factor_conversion = db.Column(RATE, default=Decimal("0.264172"))  # litros → galones
+
+    # Desde cuándo aplican estas tasas (ver app/tasas.py)
+    vigente_desde = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
 
     actualizado_en = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     actualizado_por = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
@@ -71,6 +90,27 @@ class ConfiguracionTasas(db.Model):
 # =====================
 class Factura(db.Model):
     __tablename__ = "facturas"
+    __table_args__ = (
+        # Facturas de un usuario por fecha (listados, perfil del solicitante)
+        db.Index("ix_facturas_usuario_creado", "usuario_id", "creado_en"),
+        # Revisiones de un supervisor, más recientes primero (mis_revisiones)
+        db.Index("ix_facturas_supervisor_revision", "supervisor_id", "revision_supervisor_en"),
+        # Facturas de un periodo (reportes)
+        db.Index("ix_facturas_fecha_hora", "fecha_hora"),
+        # Rangos de fechas de los tableros y estadísticas: cada consulta acotada recorre
+        # solo las entradas de su periodo, no la tabla entera, por años que acumule
+        db.Index("ix_facturas_estado_aprobado", "estado", "aprobado_en"),  # aprobadas hoy / del mes
+        db.Index("ix_facturas_estado_creado", "estado", "creado_en"),      # colas por estado, por antigüedad
+        db.Index("ix_facturas_creado", "creado_en"),                       # facturas por mes
+        # Listados de administración, últimas actualizadas primero (todas o por estado)
+        db.Index("ix_facturas_estado_actualizado", "estado", "actualizado_en"),
+        db.Index("ix_facturas_actualizado", "actualizado_en"),
+        # Un mismo pedimento (número + aduana + patente) solo puede estar en una
+        # factura no cancelada; cancelar una factura libera su pedimento
+        db.Index("uq_facturas_clave_pedimento", "clave_pedimento", unique=True,
+                 sqlite_where=text("estado != 'cancelada'"),
+                 postgresql_where=text("estado != 'cancelada'")),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
@@ -81,12 +121,22 @@ class Factura(db.Model):
     # Estados: borrador, pendiente_supervisor, pendiente_admin, aprobada, suspendida, cancelada
     mensaje_suspension = db.Column(db.Text, nullable=True)
 
+    # Última revisión del supervisor (supervisor_id), copiada del historial
+    # para listar revisiones sin cargar el historial de cada factura
+    revision_supervisor_accion = db.Column(db.String(50), nullable=True)  # revision_aprobada, suspension, rechazo
+    revision_supervisor_en = db.Column(db.DateTime, nullable=True)
+    revision_supervisor_comentario = db.Column(db.Text, nullable=True)
+
     # Datos de identificación
     importador = db.Column(db.String(150), nullable=False)
     rfc = db.Column(db.String(50), nullable=False)
     numero_pedimento = db.Column(db.String(50), nullable=False)
     numero_aduana = db.Column(db.String(50), nullable=False)
     patente_aduanal = db.Column(db.String(50), nullable=False)
+    # Claves normalizadas para detectar duplicados (ver Factura.normalizar_pedimento).
+    # clave_pedimento es nula en duplicados anteriores al índice único.
+    pedimento_normalizado = db.Column(db.String(50), nullable=True, index=True)
+    clave_pedimento = db.Column(db.String(64), nullable=True)
     fecha_hora = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Payment tracking
@@ -97,37 +147,37 @@ class Factura(db.Model):
     tipo = db.Column(db.String(20), nullable=False)  # full, carrotanque, barcaza
 
     # Volúmenes en litros
-    litros_rem1 = db.Column(db.Float, default=0.0)
-    litros_rem2 = db.Column(db.Float, default=0.0)
-    litros_carrotanque = db.Column(db.Float, default=0.0)
-    litros_barcaza = db.Column(db.Float, default=0.0)
+    litros_rem1 = db.Column(VOLUME, default=0)
+    litros_rem2 = db.Column(VOLUME, default=0)
+    litros_carrotanque = db.Column(VOLUME, default=0)
+    litros_barcaza = db.Column(VOLUME, default=0)
 
     # Volúmenes en galones (calculados)
-    galones_rem1 = db.Column(db.Float, default=0.0)
-    galones_rem2 = db.Column(db.Float, default=0.0)
-    galones_carrotanque = db.Column(db.Float, default=0.0)
-    galones_barcaza = db.Column(db.Float, default=0.0)
+    galones_rem1 = db.Column(VOLUME, default=0)
+    galones_rem2 = db.Column(VOLUME, default=0)
+    galones_carrotanque = db.Column(VOLUME, default=0)
+    galones_barcaza = db.Column(VOLUME, default=0)
 
     # Datos financieros
-    precio_molecula_galon = db.Column(db.Float, default=0.0)
-    galones_totales = db.Column(db.Float, default=0.0)
-    importe_invoice = db.Column(db.Float, default=0.0)
+    precio_molecula_galon = db.Column(RATE, default=0)
+    galones_totales = db.Column(VOLUME, default=0)
+    importe_invoice = db.Column(MONEY, default=0)
 
     densidad = db.Column(db.Float, default=0.0)
     peso_bruto = db.Column(db.Float, default=0.0)
 
     tipo_cambio = db.Column(db.Float, default=0.0)
-    valor_aduana_pago = db.Column(db.Float, default=0.0)
+    valor_aduana_pago = db.Column(MONEY, default=0)
 
     # Impuestos calculados
-    ieps = db.Column(db.Float, default=0.0)
-    iva = db.Column(db.Float, default=0.0)
-    pvr = db.Column(db.Float, default=0.0)
-    iva_pvr = db.Column(db.Float, default=0.0)
+    ieps = db.Column(MONEY, default=0)
+    iva = db.Column(MONEY, default=0)
+    pvr = db.Column(MONEY, default=0)
+    iva_pvr = db.Column(MONEY, default=0)
 
     # Total a pagar
-    total_impuestos = db.Column(db.Float, default=0.0)
-    total_pagar = db.Column(db.Float, default=0.0)
+    total_impuestos = db.Column(MONEY, default=0)
+    total_pagar = db.Column(MONEY, default=0)
 
     # Timestamps
     creado_en = db.Column(db.DateTime, default=datetime.utcnow)
@@ -138,41 +188,17 @@ class Factura(db.Model):
     historial = db.relationship("HistorialFactura", backref="factura", lazy=True, cascade="all, delete-orphan")
 
     def calcular_totales(self, tasas: ConfiguracionTasas):
-        """Calcula todos los totales usando las tasas configuradas"""
-        factor = tasas.factor_conversion
-
-        # Convertir litros a galones
-        self.galones_rem1 = self.litros_rem1 * factor
-        self.galones_rem2 = self.litros_rem2 * factor
-        self.galones_carrotanque = self.litros_carrotanque * factor
-        self.galones_barcaza = self.litros_barcaza * factor
-
-        # Calcular galones totales
-        self.galones_totales = (
-            (self.galones_rem1 or 0) +
-            (self.galones_rem2 or 0) +
-            (self.galones_carrotanque or 0) +
-            (self.galones_barcaza or 0)
-        )
-
-        # Calcular importe invoice
-        self.importe_invoice = self.galones_totales * (self.precio_molecula_galon or 0)
-
-        # Calcular impuestos con tasas configuradas
-        monto_ieps = self.galones_totales * tasas.ieps
-        monto_iva = (self.importe_invoice + monto_ieps) * tasas.iva
-        monto_pvr = self.galones_totales * tasas.pvr
-        monto_iva_pvr = monto_pvr * tasas.iva_pvr
-
-        # Guardar resultados
-        self.ieps = round(monto_ieps, 2)
-        self.iva = round(monto_iva, 2)
-        self.pvr = round(monto_pvr, 2)
-        self.iva_pvr = round(monto_iva_pvr, 2)
-
-        # Calcular totales
-        self.total_impuestos = round(self.ieps + self.iva + self.pvr + self.iva_pvr, 2)
-        self.total_pagar = round(self.importe_invoice + self.total_impuestos, 2)
+        """Calcula todos los totales usando las tasas configuradas (aritmética entera exacta)"""
+        litros = [
+            money.to_minor(self.litros_rem1, money.MICRO),
+            money.to_minor(self.litros_rem2, money.MICRO),
+            money.to_minor(self.litros_carrotanque, money.MICRO),
+            money.to_minor(self.litros_barcaza, money.MICRO),
+        ]
+        precio = money.to_minor(self.precio_molecula_galon, money.MICRO)
+        totales = money.calcular(litros, precio, money.tasas_enteras(tasas))
+
+        self.aplicar_totales(totales)
 
         return {
             "galones_totales": self.galones_totales,
@@ -185,6 +211,44 @@ class Factura(db.Model):
             "total_pagar": self.total_pagar,
         }
 
+    def aplicar_totales(self, totales):
+        """Guarda el resultado entero de money.calcular en las columnas Numeric"""
+        volumen = lambda v: money.from_minor(v, money.MICRO, money.VOLUME_PLACES)
+
+        (self.galones_rem1, self.galones_rem2,
+         self.galones_carrotanque, self.galones_barcaza) = [volumen(g) for g in totales["galones"]]
+        self.galones_totales = volumen(totales["galones_totales"])
+
+        self.importe_invoice = money.from_minor(totales["importe_invoice"])
+        self.ieps = money.from_minor(totales["ieps"])
+        self.iva = money.from_minor(totales["iva"])
+        self.pvr = money.from_minor(totales["pvr"])
+        self.iva_pvr = money.from_minor(totales["iva_pvr"])
+        self.total_impuestos = money.from_minor(totales["total_impuestos"])
+        self.total_pagar = money.from_minor(totales["total_pagar"])
+
+    @staticmethod
+    def normalizar_pedimento(valor):
+        """Solo letras y dígitos, en mayúsculas; sin ceros a la izquierda si es numérico.
+
+        "23 07 3456 3001234", "23-07-3456-3001234" y "2307 34563001234" dan la
+        misma clave, igual que las aduanas "07" y "7".
+        """
+        normalizado = re.sub(r"[^0-9A-Z]", "", (valor or "").upper())
+        if normalizado.isdigit():
+            normalizado = normalizado.lstrip("0") or "0"
+        return normalizado
+
+    @classmethod
+    def clave_de(cls, numero_pedimento, numero_aduana, patente_aduanal):
+        """Hash de ancho fijo del pedimento, aduana y patente normalizados"""
+        partes = [cls.normalizar_pedimento(v) for v in (numero_pedimento, numero_aduana, patente_aduanal)]
+        return hashlib.sha256("|".join(partes).encode()).hexdigest()
+
+    def actualizar_clave_pedimento(self):
+        self.pedimento_normalizado = self.normalizar_pedimento(self.numero_pedimento)
+        self.clave_pedimento = self.clave_de(self.numero_pedimento, self.numero_aduana, self.patente_aduanal)
+
     def get_estado_display(self):
         """Returns a user-friendly display of the current state"""
         estados = {
@@ -215,6 +279,16 @@ class Factura(db.Model):
             return True
         return False
 
+    def can_view(self, user):
+        """Check if user can see this invoice (and its attachments)"""
+        return user.is_admin() or user.is_supervisor() or self.usuario_id == user.id
+
+    def can_attach(self, user):
+        """Check if user can add or remove attachments"""
+        if user.is_admin() or user.is_supervisor():
+            return True
+        return self.usuario_id == user.id and self.estado not in ["aprobada", "cancelada"]
+
     def can_review(self, user):
         """Check if user can review this invoice"""
         if user.is_supervisor() and self.estado == "pendiente_supervisor":
@@ -227,11 +301,32 @@ class Factura(db.Model):
         return f"<Factura {self.id} - {self.importador} ({self.estado})>"
 
 
+@db.event.listens_for(Factura, "before_insert")
+def _clave_pedimento_al_insertar(mapper, connection, factura):
+    factura.actualizar_clave_pedimento()
+
+
+@db.event.listens_for(Factura, "before_update")
+def _clave_pedimento_al_actualizar(mapper, connection, factura):
+    """Solo si cambió el pedimento: un duplicado antiguo (sin clave) se puede
+    seguir revisando, pero no guardar con el mismo pedimento"""
+    estado = inspect(factura)
+    if any(estado.attrs[campo].history.has_changes()
+           for campo in ("numero_pedimento", "numero_aduana", "patente_aduanal")):
+        factura.actualizar_clave_pedimento()
+
+
 # =====================
 # HISTORIAL DE FACTURAS
 # =====================
 class HistorialFactura(db.Model):
     __tablename__ = "historial_facturas"
+    __table_args__ = (
+        # Historial de una factura en orden (también cubre las búsquedas por factura_id)
+        db.Index("ix_historial_factura_fecha", "factura_id", "timestamp"),
+        # Acciones de un usuario en un periodo (tablero y estadísticas del supervisor)
+        db.Index("ix_historial_usuario_fecha", "usuario_id", "timestamp"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     factura_id = db.Column(db.Integer, db.ForeignKey("facturas.id"), nullable=False)
@@ -256,6 +351,16 @@ class HistorialFactura(db.Model):
 # =====================
 class Notificacion(db.Model):
     __tablename__ = "notificaciones"
+    __table_args__ = (
+        # Pendientes de resumen por correo: solo las no leídas y no enviadas,
+        # así el índice no crece con el histórico
+        db.Index("ix_notificaciones_resumen", "usuario_id", "creado_en",
+                 sqlite_where=text("enviada_en IS NULL AND leida = 0"),
+                 postgresql_where=text("enviada_en IS NULL AND leida = false")),
+        # Notificaciones de un usuario, recientes primero: todas, o solo las no leídas
+        db.Index("ix_notificaciones_usuario_creado", "usuario_id", "creado_en"),
+        db.Index("ix_notificaciones_usuario_leida", "usuario_id", "leida", "creado_en"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
@@ -267,10 +372,244 @@ class Notificacion(db.Model):
     leida = db.Column(db.Boolean, default=False)
 
     creado_en = db.Column(db.DateTime, default=datetime.utcnow)
+    enviada_en = db.Column(db.DateTime, nullable=True)  # incluida en un correo de resumen
 
     # Relationships
     usuario = db.relationship("User", backref="notificaciones")
     factura = db.relationship("Factura", backref="notificaciones")
 
     def __repr__(self):
-        return f"<Notificacion {self.titulo} - Usuario {self.usuario_id}>"
\ No newline at end of file
+        return f"<Notificacion {self.titulo} - Usuario {self.usuario_id}>"
+
+# =====================
+# TOKENS DE API
+# =====================
+class ApiToken(db.Model):
+    __tablename__ = "api_tokens"
+
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    nombre = db.Column(db.String(100), nullable=False)  # integración que lo usa, p. ej. "ERP"
+
+    # Solo se guarda el SHA-256 del token; el valor en claro se muestra una vez al crearlo
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    prefijo = db.Column(db.String(8), nullable=False)  # para identificarlo en listados
+
+    activo = db.Column(db.Boolean, default=True)
+    creado_en = db.Column(db.DateTime, default=datetime.utcnow)
+    ultimo_uso = db.Column(db.DateTime, nullable=True)
+
+    usuario = db.relationship("User", backref="api_tokens")
+
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def generar(cls, usuario, nombre):
+        """Crea un token nuevo; devuelve (ApiToken, token en claro)"""
+        token = secrets.token_urlsafe(32)
+        api_token = cls(
+            usuario_id=usuario.id,
+            nombre=nombre,
+            token_hash=cls.hash_token(token),
+            prefijo=token[:8]
+        )
+        return api_token, token
+
+    def __repr__(self):
+        return f"<ApiToken {self.prefijo}… - Usuario {self.usuario_id}>"
+
+
+# =====================
+# CLAVES DE IDEMPOTENCIA
+# =====================
+class IdempotencyKey(db.Model):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        db.UniqueConstraint("usuario_id", "clave", name="uq_idempotency_usuario_clave"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    clave = db.Column(db.String(100), nullable=False)
+
+    # Huella de la petición original (endpoint + cuerpo) para detectar reutilización de la clave
+    endpoint = db.Column(db.String(100), nullable=False)
+    huella = db.Column(db.String(64), nullable=False)
+
+    # Respuesta guardada; status_code nulo mientras la petición original sigue en curso
+    status_code = db.Column(db.Integer, nullable=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    location = db.Column(db.String(500), nullable=True)
+    cuerpo = db.Column(db.Text, nullable=True)
+
+    creado_en = db.Column(db.DateTime, default=datetime.utcnow)
+    expira_en = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.clave} - Usuario {self.usuario_id} ({self.status_code or 'en curso'})>"
+
+
+# =====================
+# MOVIMIENTOS DE CRÉDITOS
+# =====================
+class MovimientoCredito(db.Model):
+    """Libro de créditos; User.creditos es el saldo en caché (ver app/creditos.py)"""
+    __tablename__ = "movimientos_credito"
+    __table_args__ = (
+        # Una factura consume y se reembolsa como mucho una vez
+        db.UniqueConstraint("factura_id", "tipo", name="uq_movimiento_factura_tipo"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    factura_id = db.Column(db.Integer, db.ForeignKey("facturas.id"), nullable=True)
+
+    tipo = db.Column(db.String(20), nullable=False)  # apertura, asignacion, consumo, reembolso, ajuste
+    cantidad = db.Column(db.Integer, nullable=False)  # positiva suma créditos, negativa los descuenta
+    comentario = db.Column(db.String(255), nullable=True)
+
+    realizado_por = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    creado_en = db.Column(db.DateTime, default=datetime.utcnow)
+
+    usuario = db.relationship("User", foreign_keys=[usuario_id], backref="movimientos_credito")
+
+    def __repr__(self):
+        return f"<MovimientoCredito {self.tipo} {self.cantidad:+d} - Usuario {self.usuario_id}>"
+
+
+@db.event.listens_for(User, "after_insert")
+def _registrar_saldo_inicial(mapper, connection, user):
+    """Los créditos con los que nace un usuario entran al libro como apertura"""
+    if user.creditos:
+        connection.execute(MovimientoCredito.__table__.insert().values(
+            usuario_id=user.id,
+            tipo="apertura",
+            cantidad=user.creditos,
+            creado_en=datetime.utcnow()
+        ))
+
+
+# =====================
+# CONTADORES DE FACTURAS
+# =====================
+class ContadorFacturas(db.Model):
+    """Facturas por estado para cada usuario, supervisor y en total (ver app/contadores.py)"""
+    __tablename__ = "contadores_facturas"
+
+    ambito = db.Column(db.String(20), primary_key=True)  # global, usuario, supervisor
+    sujeto_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0 en el ámbito global
+    estado = db.Column(db.String(30), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ContadorFacturas {self.ambito}:{self.sujeto_id} {self.estado}={self.total}>"
+
+
+# =====================
+# REPORTES
+# =====================
+class ReporteArtefacto(db.Model):
+    """Resultado cacheado de un reporte para un periodo y filtros (ver app/reportes.py)"""
+    __tablename__ = "reportes_artefactos"
+
+    id = db.Column(db.Integer, primary_key=True)
+    reporte = db.Column(db.String(50), nullable=False)
+    parametros = db.Column(db.Text, nullable=False)  # JSON canónico
+    huella = db.Column(db.String(64), unique=True, nullable=False)  # sha256 de reporte + versión + parámetros
+
+    estado = db.Column(db.String(20), nullable=False, default="pendiente", index=True)
+    # Estados: pendiente, procesando, listo, error
+    archivo = db.Column(db.String(255), nullable=True)  # relativo a REPORTS_DIR
+    columnas = db.Column(db.Text, nullable=True)  # JSON
+    filas = db.Column(db.Integer, nullable=True)
+    bytes = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    solicitado_por = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    solicitado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    iniciado_en = db.Column(db.DateTime, nullable=True)
+    terminado_en = db.Column(db.DateTime, nullable=True)
+
+    solicitante = db.relationship("User")
+
+    def __repr__(self):
+        return f"<ReporteArtefacto {self.reporte} {self.estado}>"
+
+
+# =====================
+# TRABAJOS EN SEGUNDO PLANO
+# =====================
+class Trabajo(db.Model):
+    """Trabajo encolado para `flask worker` (ver app/trabajos.py)"""
+    __tablename__ = "trabajos"
+    __table_args__ = (
+        # Siguiente trabajo a reclamar: pendientes por prioridad y antigüedad
+        db.Index("ix_trabajos_cola", "estado", "prioridad", "disponible_en"),
+        # Trabajos terminados por fecha (latencias del panel y purga)
+        db.Index("ix_trabajos_terminado", "estado", "terminado_en"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    tarea = db.Column(db.String(100), nullable=False)
+    argumentos = db.Column(db.Text, nullable=False, default="{}")  # JSON
+    prioridad = db.Column(db.Integer, nullable=False, default=0)  # menor se ejecuta antes
+
+    estado = db.Column(db.String(20), nullable=False, default="pendiente")
+    # Estados: pendiente, en_curso, hecho, fallido
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    max_intentos = db.Column(db.Integer, nullable=False, default=5)
+    error = db.Column(db.Text, nullable=True)  # último error
+    trabajador = db.Column(db.String(100), nullable=True)  # host:pid del último intento
+
+    creado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    disponible_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # no antes (reintentos)
+    iniciado_en = db.Column(db.DateTime, nullable=True)
+    vence_en = db.Column(db.DateTime, nullable=True)  # después, el intento se da por abandonado
+    terminado_en = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Trabajo {self.id} {self.tarea} ({self.estado})>"
+
+
+# =====================
+# ADJUNTOS
+# =====================
+class Blob(db.Model):
+    """Contenido de un archivo subido, guardado una sola vez (ver app/adjuntos.py)"""
+    __tablename__ = "blobs"
+
+    sha256 = db.Column(db.String(64), primary_key=True)  # también su ruta en BLOBS_DIR
+    tamano = db.Column(db.BigInteger, nullable=False)
+    tipo_mime = db.Column(db.String(100), nullable=False)
+    referencias = db.Column(db.Integer, nullable=False, default=0)  # adjuntos que lo usan
+
+    creado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    liberado_en = db.Column(db.DateTime, nullable=True)  # cuándo quedó sin referencias
+
+    def __repr__(self):
+        return f"<Blob {self.sha256[:12]} ({self.referencias} ref.)>"
+
+
+class Adjunto(db.Model):
+    """Archivo adjunto a una factura"""
+    __tablename__ = "adjuntos"
+    __table_args__ = (
+        # El mismo archivo solo se adjunta una vez a cada factura
+        db.UniqueConstraint("factura_id", "blob_sha256", name="uq_adjuntos_factura_blob"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    factura_id = db.Column(db.Integer, db.ForeignKey("facturas.id"), nullable=False)  # cubierto por la única
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey("blobs.sha256"), nullable=False, index=True)
+    nombre = db.Column(db.String(255), nullable=False)  # nombre original, solo para mostrar
+    subido_por_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    creado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    factura = db.relationship("Factura", backref=db.backref("adjuntos", order_by="Adjunto.id"))
+    blob = db.relationship("Blob", lazy="joined")
+    subido_por = db.relationship("User")
+
+    def __repr__(self):
+        return f"<Adjunto {self.nombre} - Factura {self.factura_id}>"
@@ -0,0 +1,176 @@
+"""
+Fixed-point money and volume engine.
+
+All invoice arithmetic is done on integers in minor units so totals are
+exact and reproducible:
+
+- money amounts (importe, impuestos, totales): centavos (1/100)
+- volumes (litros, galones): micro units (1/1,000,000)
+- per-gallon prices and rates, percentages and the L→Gal factor: micro
+  units as well (0.16 → 160000, 4.59 → 4590000)
+
+Rounding rule: ROUND_HALF_UP (ties away from zero) applied exactly once at
+each step listed in ``calcular``. Every stored value is therefore the
+integer result of that step, never a float approximation.
+
+``calcular`` is the scalar path used by ``Factura.calcular_totales``;
+``calcular_lote`` is the numpy path for bulk recomputation and runs the same
+steps over whole columns.
+"""
+
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from .lazy import numpy as np
+
+CENTAVOS = 100
+MICRO = 1_000_000
+
+# micro-galones * micro-unidades/galón -> centavos
+_MICRO_MICRO_A_CENTAVOS = MICRO * MICRO // CENTAVOS
+
+# int64 products above this bound fall back to exact Python ints
+_INT64_SEGURO = 2 ** 62
+
+MONEY_PLACES = 2
+VOLUME_PLACES = 6
+RATE_PLACES = 6
+
+TasasEnteras = namedtuple("TasasEnteras", ["factor_conversion", "ieps", "iva", "pvr", "iva_pvr"])
+
+
+def to_minor(value, scale=CENTAVOS):
+    """Convert a Decimal/float/str/int to integer minor units (half up)"""
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        # str() gives the shortest repr of a float, so 0.1 stays 0.1
+        value = Decimal(str(value))
+    return int((value * scale).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_minor(units, scale=CENTAVOS, places=MONEY_PLACES):
+    """Convert integer minor units back to a Decimal with fixed places"""
+    return (Decimal(int(units)) / scale).quantize(Decimal(1).scaleb(-places))
+
+
+def div_round(numerator, denominator):
+    """Integer division rounding half up (ties away from zero)"""
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if 2 * remainder >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+def tasas_enteras(tasas):
+    """Read a ConfiguracionTasas row as integer micro units"""
+    return TasasEnteras(
+        factor_conversion=to_minor(tasas.factor_conversion, MICRO),
+        ieps=to_minor(tasas.ieps, MICRO),
+        iva=to_minor(tasas.iva, MICRO),
+        pvr=to_minor(tasas.pvr, MICRO),
+        iva_pvr=to_minor(tasas.iva_pvr, MICRO),
+    )
+
+
+def calcular(litros, precio_galon, tasas):
+    """
+    Compute invoice totals for one invoice.
+
+    ``litros`` is a sequence of micro-litros (rem1, rem2, carrotanque,
+    barcaza), ``precio_galon`` is micro-USD per gallon and ``tasas`` a
+    ``TasasEnteras``. Returns galones in micro units and money in centavos.
+    """
+    galones = [div_round(l * tasas.factor_conversion, MICRO) for l in litros]
+    galones_totales = sum(galones)
+
+    importe = div_round(galones_totales * precio_galon, _MICRO_MICRO_A_CENTAVOS)
+    ieps = div_round(galones_totales * tasas.ieps, _MICRO_MICRO_A_CENTAVOS)
+    iva = div_round((importe + ieps) * tasas.iva, MICRO)
+    pvr = div_round(galones_totales * tasas.pvr, _MICRO_MICRO_A_CENTAVOS)
+    iva_pvr = div_round(pvr * tasas.iva_pvr, MICRO)
+    total_impuestos = ieps + iva + pvr + iva_pvr
+
+    return {
+        "galones": galones,
+        "galones_totales": galones_totales,
+        "importe_invoice": importe,
+        "ieps": ieps,
+        "iva": iva,
+        "pvr": pvr,
+        "iva_pvr": iva_pvr,
+        "total_impuestos": total_impuestos,
+        "total_pagar": importe + total_impuestos,
+    }
+
+
+# =====================
+# Batched (numpy) path
+# =====================
+def _as_array(values):
+    return np.asarray(values, dtype=np.int64) if not isinstance(values, np.ndarray) else values
+
+
+def _max_abs(values):
+    values = np.asarray(values)
+    return int(np.abs(values).max()) if values.size else 0
+
+
+def _mul_div_round(a, b, denominator):
+    """Elementwise div_round(a * b, denominator), exact even past int64"""
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if _max_abs(a) * _max_abs(b) >= _INT64_SEGURO:
+        a = a.astype(object)
+        b = b.astype(object)
+    return _div_round_array(a * b, denominator)
+
+
+def _div_round_array(numerator, denominator):
+    magnitude = np.abs(numerator)
+    # // and % (not np.divmod) so object arrays of Python ints work too
+    quotient = magnitude // denominator
+    quotient = quotient + (2 * (magnitude % denominator) >= denominator)
+    return np.where(numerator < 0, -quotient, quotient)
+
+
+def calcular_lote(litros_rem1, litros_rem2, litros_carrotanque, litros_barcaza, precio_galon, tasas):
+    """
+    Vectorized ``calcular`` over whole columns.
+
+    Inputs are integer arrays in the same units as ``calcular``; the fields
+    of ``tasas`` may be scalars or per-row arrays. Returns a dict of integer
+    arrays with the same keys as ``calcular`` (``galones`` is a list of four
+    arrays).
+    """
+    litros = [_as_array(l) for l in (litros_rem1, litros_rem2, litros_carrotanque, litros_barcaza)]
+    precio_galon = _as_array(precio_galon)
+
+    galones = [_mul_div_round(l, tasas.factor_conversion, MICRO) for l in litros]
+    galones_totales = galones[0] + galones[1] + galones[2] + galones[3]
+
+    importe = _mul_div_round(galones_totales, precio_galon, _MICRO_MICRO_A_CENTAVOS)
+    ieps = _mul_div_round(galones_totales, tasas.ieps, _MICRO_MICRO_A_CENTAVOS)
+    iva = _mul_div_round(importe + ieps, tasas.iva, MICRO)
+    pvr = _mul_div_round(galones_totales, tasas.pvr, _MICRO_MICRO_A_CENTAVOS)
+    iva_pvr = _mul_div_round(pvr, tasas.iva_pvr, MICRO)
+    total_impuestos = ieps + iva + pvr + iva_pvr
+
+    return {
+        "galones": galones,
+        "galones_totales": galones_totales,
+        "importe_invoice": importe,
+        "ieps": ieps,
+        "iva": iva,
+        "pvr": pvr,
+        "iva_pvr": iva_pvr,
+        "total_impuestos": total_impuestos,
+        "total_pagar": importe + total_impuestos,
+    }
+
+
+def sumar(valores):
+    """Exact sum of an integer minor-unit column"""
+    valores = np.asarray(valores)
+    if valores.dtype == object or _max_abs(valores) * max(len(valores), 1) >= _INT64_SEGURO:
+        return sum(int(v) for v in valores)
+    return int(valores.sum())
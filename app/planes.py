@@ -0,0 +1,363 @@
+"""
+Query plan regression gate (``flask bench plans``).
+
+Performance regressions here usually come from a query that silently
+stops using an index. This gate requests every route of the app on a
+seeded scratch database and records each SQL statement the route issues
+(a ``before_cursor_execute`` listener). It then runs ``EXPLAIN QUERY
+PLAN`` (SQLite) or ``EXPLAIN`` (Postgres) on each statement with its
+bound parameters. It fails if a plan:
+
+- scans one of the large tables (``GRANDES``) instead of seeking into it
+  (a full index scan counts as a scan), or
+- sorts or groups through a temporary B-tree in a statement that reads a
+  large table.
+
+Known, bounded exceptions are listed in ``PERMITIDOS`` with their reason.
+
+The plans are snapshotted in ``planes_consultas.txt`` next to this
+module. The gate also fails when the plans differ from the snapshot, so
+a plan change shows up as a diff in review. ``flask bench plans
+--update`` rewrites it. SQLite's plan wording changes between versions,
+so the snapshot header records the version it was taken with.
+
+GET routes are enumerated from the URL map, so a new page is covered
+without touching this file. A route with URL arguments needs an entry in
+``ARGUMENTOS``, and the gate fails until it has one. The main write paths
+are posted from ``ESCRITURAS``.
+"""
+
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from sqlalchemy.exc import DBAPIError
+
+GRANDES = ("facturas", "historial_facturas", "notificaciones")
+
+# Endpoints without database queries worth planning
+OMITIDOS = ("static", "metrics", "auth.logout")
+
+# Who requests each blueprint's pages ("api": the usuario's API token)
+ROLES = {"admins": "admin", "supervisores": "supervisor", "usuarios": "usuario",
+         "adjuntos": "usuario", "api": "api", "main": "usuario", "auth": None}
+
+# URL arguments and query strings: names of the seeded rows (see ``sembrar``) or literal values
+ARGUMENTOS = {
+    "adjuntos.descargar": {"id": "adjunto"},
+    "adjuntos.miniatura": {"id": "adjunto", "tamano": "mini", "sha256": "blob"},
+    "admins.aprobar_factura": {"id": "pendiente_admin"},
+    "admins.descargar_reporte": {"id": "reporte"},
+    "admins.editar_usuario": {"id": "usuario"},
+    "admins.estado_reporte": {"id": "reporte"},
+    "admins.ver_factura": {"id": "factura"},
+    "supervisores.revisar_factura": {"id": "pendiente_supervisor"},
+    "supervisores.ver_factura": {"id": "factura"},
+    "usuarios.editar_factura": {"id": "suspendida"},
+    "usuarios.marcar_notificacion_leida": {"id": "notificacion"},
+    "usuarios.ver_factura": {"id": "factura"},
+    "api.cambios": {"desde": "0"},
+    "api.estado_facturas": {"ids": "facturas"},
+    "main.autocompletar": {"campo": "importador", "q": "Imp"},
+}
+
+# State-changing requests: (endpoint, URL arguments, form fields or JSON body)
+ESCRITURAS = [
+    ("usuarios.crear_factura", {}, {
+        "importador": "Importadora Plan", "rfc": "PLA010101AAA", "numero_pedimento": "99999001",
+        "numero_aduana": "07", "patente_aduanal": "3456", "tipo": "full",
+        "litros_rem1": "30000", "precio_molecula_galon": "2.5",
+    }),
+    ("supervisores.revisar_factura", {"id": "pendiente_supervisor"}, {"aprobar": "Aprobar"}),
+    ("admins.aprobar_factura", {"id": "pendiente_admin"}, {"aprobar": "Aprobar"}),
+    ("api.crear_facturas", {}, {"facturas": [{
+        "importador": "Importadora Plan", "rfc": "PLA010101AAA", "numero_pedimento": "99999002",
+        "numero_aduana": "07", "patente_aduanal": "3456", "tipo": "full",
+        "litros_rem1": "30000", "precio_molecula_galon": "2.5",
+    }]}),
+    ("api.estado_facturas", {}, {"ids": "facturas"}),
+]
+
+# (endpoint, regex on the statement) -> why its scan or sort is acceptable
+PERMITIDOS = {
+    ("admins.estadisticas", r"GROUP BY strftime"):
+        "groups only the last 12 months, read through an index range",
+    ("supervisores.estadisticas", r"GROUP BY strftime"):
+        "groups only the supervisor's last 6 months, read through an index range",
+    ("supervisores.estadisticas", r"GROUP BY historial_facturas.accion"):
+        "groups only the supervisor's own actions (usuario_id index)",
+    ("admins.gestionar_facturas", r"^SELECT \.\.\. FROM \(SELECT \.\.\. FROM facturas\) AS anon_1$"):
+        "page total of the unfiltered list of every invoice",
+    ("admins.pedimentos_duplicados", r"HAVING count"):
+        "sorts only the groups that are duplicates",
+    ("api.cambios", r"FROM historial_facturas JOIN facturas"):
+        "sorts only the token owner's history after the cursor",
+    ("main.autocompletar", r"WHERE facturas.id <= \? GROUP BY"):
+        "builds the suggestion index once per worker; later only new ids are read",
+}
+
+INSTANTANEA = "planes_consultas.txt"
+
+
+# =====================
+# Capture (runs in the scratch-database child process)
+# =====================
+def sembrar(db, facturas=400):
+    """Seed users and ``facturas`` invoices with history and notifications; returns {name: id}"""
+    from . import adjuntos
+    from .models import (User, ConfiguracionTasas, Factura, HistorialFactura, Notificacion, Blob,
+                         Adjunto, ReporteArtefacto, ApiToken)
+
+    usuarios = {}
+    for rol, nombre in (("admin", "admin"), ("supervisor", "supervisor"), ("usuario", "usuario"),
+                        ("usuario", "otro")):
+        user = User(nombre=nombre, email=f"{nombre}@planes.example.com", rol=rol, creditos=1000, activo=True)
+        user.set_password(nombre)
+        db.session.add(user)
+        usuarios[nombre] = user
+    db.session.add(ConfiguracionTasas(ieps=4.59, iva=0.16, pvr=0.20, iva_pvr=0.16))
+    db.session.flush()
+
+    estados = ("pendiente_supervisor", "pendiente_admin", "aprobada", "suspendida", "cancelada")
+    ahora = datetime.utcnow()
+    ids = {nombre: user.id for nombre, user in usuarios.items()}
+    lista = []
+    for i in range(facturas):
+        estado = estados[i % len(estados)]
+        dueno = usuarios["usuario" if i % 2 else "otro"]
+        creada = ahora - timedelta(days=facturas - i)
+        factura = Factura(
+            usuario_id=dueno.id, importador=f"Importadora {i % 40}", rfc=f"IMP{i % 40:03d}0101AAA",
+            numero_pedimento=str(1000000 + i), numero_aduana=str(i % 50), patente_aduanal=str(3000 + i % 30),
+            tipo="full", litros_rem1=30000, precio_molecula_galon=2.5, total_pagar=1000 + i,
+            estado=estado, creado_en=creada, actualizado_en=creada, fecha_hora=creada,
+            supervisor_id=usuarios["supervisor"].id if estado != "pendiente_supervisor" else None,
+            aprobado_en=creada + timedelta(hours=2) if estado == "aprobada" else None,
+        )
+        db.session.add(factura)
+        lista.append(factura)
+    db.session.flush()
+
+    for factura in lista:
+        db.session.add(HistorialFactura(factura_id=factura.id, usuario_id=factura.usuario_id, accion="creacion",
+                                        estado_anterior="", estado_nuevo="pendiente_supervisor",
+                                        timestamp=factura.creado_en))
+        db.session.add(HistorialFactura(factura_id=factura.id, usuario_id=usuarios["supervisor"].id,
+                                        accion="revision", estado_anterior="pendiente_supervisor",
+                                        estado_nuevo=factura.estado, timestamp=factura.actualizado_en))
+        for leida in (True, False):
+            db.session.add(Notificacion(usuario_id=factura.usuario_id, factura_id=factura.id, titulo="Plan",
+                                        mensaje="Plan", leida=leida, creado_en=factura.creado_en))
+
+    propias = [f for f in lista if f.usuario_id == usuarios["usuario"].id]
+    for estado in estados:
+        ids[estado] = next(f.id for f in reversed(propias) if f.estado == estado)
+    ids["factura"] = ids["aprobada"]
+    ids["facturas"] = ",".join(str(f.id) for f in propias[:20])
+
+    blob = Blob(sha256="0" * 64, tamano=10, tipo_mime="application/msword", referencias=1)
+    adjunto = Adjunto(factura_id=ids["factura"], blob_sha256=blob.sha256, nombre="plan.doc",
+                      subido_por_id=usuarios["usuario"].id)
+    reporte = ReporteArtefacto(reporte="facturas", parametros="{}", huella="0" * 64, estado="listo",
+                               solicitado_por=usuarios["admin"].id)
+    token, ids["token"] = ApiToken.generar(usuarios["usuario"], "planes")
+    db.session.add_all([blob, adjunto, reporte, token])
+    db.session.flush()
+    camino = adjuntos.ruta(blob.sha256)
+    os.makedirs(os.path.dirname(camino), exist_ok=True)
+    with open(camino, "wb") as f:
+        f.write(b"\0" * blob.tamano)
+    ids["adjunto"] = adjunto.id
+    ids["blob"] = blob.sha256
+    ids["reporte"] = reporte.id
+    ids["notificacion"] = Notificacion.query.filter_by(usuario_id=usuarios["usuario"].id, leida=False) \
+        .order_by(Notificacion.id).first().id
+    db.session.commit()
+    # statistics make the planner's choice between similar indexes stable from run to run
+    db.session.execute(db.text("ANALYZE"))
+    db.session.commit()
+    return ids
+
+
+def _normalizar(sql):
+    sql = " ".join(sql.split())
+    # column lists only add noise to the snapshot
+    return re.sub(r"(^|\()SELECT (DISTINCT )?.+? FROM ", r"\1SELECT \2... FROM ", sql)
+
+
+def _explicar(conexion, dialecto, sentencia, parametros):
+    try:
+        return _plan(conexion, dialecto, sentencia, parametros)
+    except DBAPIError as e:
+        # the statement failed in the route too; the snapshot shows why
+        conexion.rollback()
+        return [f"! cannot be planned: {str(e.orig).splitlines()[0]}"]
+
+
+def _plan(conexion, dialecto, sentencia, parametros):
+    if dialecto == "sqlite":
+        filas = conexion.exec_driver_sql("EXPLAIN QUERY PLAN " + sentencia, parametros).all()
+        profundidad = {0: -1}
+        lineas = []
+        for nodo, padre, _, detalle in filas:
+            profundidad[nodo] = profundidad.get(padre, -1) + 1
+            lineas.append("  " * profundidad[nodo] + detalle)
+        return lineas
+    filas = conexion.exec_driver_sql("EXPLAIN (COSTS OFF) " + sentencia, parametros).all()
+    return [fila[0] for fila in filas]
+
+
+def capturar(config_name):
+    """Seed a scratch database, request every route and EXPLAIN what each ran.
+
+    Runs in the child process started by ``flask bench plans``. It prints
+    ``{"motor": ..., "rutas": [...], "sin_argumentos": [...]}`` as JSON.
+    """
+    from flask import url_for
+    from sqlalchemy import event
+    from . import create_app
+    from .extensions import db
+
+    app = create_app(config_name)
+    # pages that fail still count: their statements up to the error are planned too
+    app.config.update(WTF_CSRF_ENABLED=False, METRICS_ENABLED=False, PROPAGATE_EXCEPTIONS=False)
+    with app.app_context():
+        # the migrations, not create_all: they are the production schema, and they create the indexes
+        # in a fixed order, which is how SQLite breaks ties between equally good ones
+        from .cli import upgrade_schema
+        upgrade_schema(app)
+        ids = sembrar(db)
+        motor = db.engine
+        dialecto = motor.dialect.name
+        version = motor.dialect.dbapi.sqlite_version if dialecto == "sqlite" else \
+            db.session.execute(db.text("SHOW server_version")).scalar()
+
+    capturadas = []
+
+    def anotar(conn, cursor, sentencia, parametros, context, executemany):
+        if not executemany and sentencia.lstrip().split(None, 1)[0].upper() in ("SELECT", "WITH", "UPDATE", "DELETE"):
+            capturadas.append((sentencia, parametros))
+
+    def valor(nombre):
+        return str(ids.get(nombre, nombre))
+
+    def pedir(endpoint, metodo, argumentos, datos=None):
+        blueprint = endpoint.split(".")[0]
+        with app.test_request_context():
+            regla = app.url_map._rules_by_endpoint[endpoint][0]
+            en_ruta = {k: valor(v) for k, v in argumentos.items() if k in regla.arguments}
+            consulta = {k: valor(v) for k, v in argumentos.items() if k not in regla.arguments}
+            url = url_for(endpoint, **en_ruta, **consulta)
+        cliente = app.test_client()
+        cabeceras = {}
+        rol = ROLES.get(blueprint)
+        if rol == "api":
+            cabeceras["Authorization"] = f"Bearer {ids['token']}"
+        elif rol:
+            with cliente.session_transaction() as sesion:
+                sesion["_user_id"] = str(ids["usuario" if rol == "usuario" else rol])
+                sesion["_fresh"] = True
+
+        if isinstance(datos, dict) and blueprint == "api":
+            cuerpo = {k: (list(map(int, valor(v).split(","))) if v == "facturas" else v) for k, v in datos.items()}
+            kwargs = {"json": cuerpo}
+        else:
+            kwargs = {"data": datos} if datos is not None else {}
+
+        del capturadas[:]
+        respuesta = cliente.open(url, method=metodo, headers=cabeceras, **kwargs)
+        respuesta.close()
+        vistas = {}
+        with motor.connect() as conexion:
+            for sentencia, parametros in capturadas:
+                clave = _normalizar(sentencia)
+                if clave not in vistas:
+                    vistas[clave] = _explicar(conexion, dialecto, sentencia, parametros)
+        return {"endpoint": endpoint, "metodo": metodo, "url": regla.rule, "rol": rol or "-",
+                "status": respuesta.status_code,
+                "consultas": [{"sql": sql, "plan": plan} for sql, plan in vistas.items()]}
+
+    # no app context around the requests: each one must get its own ``g`` (and logged-in user)
+    rutas, sin_argumentos = [], []
+    event.listen(motor, "before_cursor_execute", anotar)
+    for regla in sorted(app.url_map.iter_rules(), key=lambda r: (r.rule, r.endpoint)):
+        if regla.endpoint in OMITIDOS or "GET" not in regla.methods:
+            continue
+        argumentos = ARGUMENTOS.get(regla.endpoint, {})
+        if not regla.arguments <= set(argumentos):
+            sin_argumentos.append(regla.endpoint)
+            continue
+        rutas.append(pedir(regla.endpoint, "GET", argumentos))
+    for endpoint, argumentos, datos in ESCRITURAS:
+        rutas.append(pedir(endpoint, "POST", argumentos, datos))
+    event.remove(motor, "before_cursor_execute", anotar)
+
+    print(json.dumps({"motor": f"{dialecto} {version}", "rutas": rutas, "sin_argumentos": sin_argumentos}))
+
+
+# =====================
+# Checks (parent process)
+# =====================
+def _tablas_grandes(lineas):
+    patron = re.compile(r"\b(?:SCAN|SEARCH|Scan on|Scan using \S+ on)\s+(?:TABLE\s+)?(\w+)")
+    return {m.group(1) for linea in lineas for m in patron.finditer(linea)} & set(GRANDES)
+
+
+def problemas(consulta):
+    """Why a statement's plan is not acceptable on the large tables (empty list if it is).
+
+    Walking an index in order is fine when the statement has a LIMIT and
+    nothing is sorted afterwards: it stops after the rows of the page.
+    """
+    ordenaciones = []
+    if _tablas_grandes(consulta["plan"]):
+        for linea in consulta["plan"]:
+            detalle = linea.strip()
+            if detalle.startswith("USE TEMP B-TREE") or re.match(r"(->\s*)?(Incremental )?Sort\b", detalle):
+                ordenaciones.append(f"temporary sort: {detalle}")
+
+    limitada = re.search(r"\bLIMIT\b", consulta["sql"]) and not ordenaciones
+    escaneos = []
+    for linea in consulta["plan"]:
+        detalle = linea.strip()
+        escaneo = re.match(r"SCAN (?:TABLE )?(\w+)", detalle) or re.search(r"Seq Scan on (\w+)", detalle)
+        if not escaneo or escaneo.group(1) not in GRANDES:
+            continue
+        if limitada and re.search(r"USING (COVERING )?INDEX|Index Scan", detalle):
+            continue
+        escaneos.append(f"full scan of {escaneo.group(1)}: {detalle}")
+    return escaneos + ordenaciones
+
+
+def permitido(endpoint, sql):
+    return next((motivo for (punto, patron), motivo in PERMITIDOS.items()
+                 if punto == endpoint and re.search(patron, sql)), None)
+
+
+def violaciones(resultado):
+    """[(route, sql, problem)] not covered by PERMITIDOS"""
+    encontradas = []
+    for ruta in resultado["rutas"]:
+        for consulta in ruta["consultas"]:
+            if permitido(ruta["endpoint"], consulta["sql"]):
+                continue
+            for problema in problemas(consulta):
+                encontradas.append((f"{ruta['metodo']} {ruta['url']}", consulta["sql"], problema))
+    return encontradas
+
+
+def formatear(resultado):
+    """Snapshot text: every route, its statements and their plans"""
+    lineas = ["# Query plans of every route on the seeded database (app/planes.py).",
+              "# Regenerate with: flask bench plans --update",
+              f"# {resultado['motor']}", ""]
+    for ruta in resultado["rutas"]:
+        lineas.append(f"== {ruta['metodo']} {ruta['url']} [{ruta['rol']}] -> {ruta['status']}")
+        for consulta in ruta["consultas"]:
+            lineas.append(consulta["sql"])
+            motivo = permitido(ruta["endpoint"], consulta["sql"])
+            if motivo and problemas(consulta):
+                lineas.append(f"  # allowed: {motivo}")
+            lineas.extend("  " + linea for linea in consulta["plan"])
+        lineas.append("")
+    return "\n".join(lineas)
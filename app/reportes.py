@@ -0,0 +1,303 @@
+"""
+Offline reports over ``facturas``.
+
+A report is declared as a ``Reporte``: the columns it groups by and the
+measures it sums. ``solicitar`` records a request as a ``ReporteArtefacto``
+row, keyed by a hash of (report, version, parameters). Asking again for the
+same report, period and filters returns that row and its file instead of
+computing it again. A closed period (``hasta`` before today) is reused
+indefinitely. A period that includes today is recomputed once its artifact
+is older than ``REPORTS_OPEN_TTL``, because new invoices keep arriving.
+
+``solicitar`` queues a ``reportes.generar`` job (app/trabajos.py) in the
+same transaction as the artifact, and a ``flask worker`` process computes
+it; ``flask reportes procesar`` sweeps whatever is still pending. Without
+a worker (``JOBS_EAGER``, the default) the job runs right away and the
+request that asks for the report computes it. A worker claims an artifact
+with a conditional UPDATE (pendiente -> procesando), so each artifact is
+computed once, however many processes see it.
+
+Invoices are streamed from the database in chunks of ``REPORTS_CHUNK_SIZE``
+rows. pandas aggregates each chunk and folds it into the running result, so
+memory grows with the number of groups, not the number of invoices. Money
+and volumes are summed as integer minor units (see app/money.py), so the
+totals are exact.
+
+Artifacts are gzipped CSV files under ``REPORTS_DIR``. Each is written to a
+temp file and renamed into place, and its columns and row count are kept in
+the artifact row.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import BigInteger, and_, cast, func, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from .extensions import db
+from .models import Factura, ReporteArtefacto
+from . import money, trabajos
+from .lazy import pandas as pd
+
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+LISTO = "listo"
+ERROR = "error"
+
+Reporte = namedtuple("Reporte", ["titulo", "agrupar", "medidas", "version"])
+
+# Group-by columns; "mes" is derived from fecha_hora while aggregating
+DIMENSIONES = {
+    "mes": Factura.fecha_hora,
+    "importador": Factura.importador,
+    "tipo": Factura.tipo,
+    "estado": Factura.estado,
+    "numero_aduana": Factura.numero_aduana,
+    "patente_aduanal": Factura.patente_aduanal,
+}
+
+
+def _en_unidades(columna, escala):
+    return cast(func.round(func.coalesce(columna, 0) * escala), BigInteger)
+
+
+# measure -> (SQL expression in integer units, scale, decimal places); scale None is a plain count
+MEDIDAS = {
+    "facturas": (literal(1), None, None),
+    "litros": (_en_unidades(
+        func.coalesce(Factura.litros_rem1, 0) + func.coalesce(Factura.litros_rem2, 0)
+        + func.coalesce(Factura.litros_carrotanque, 0) + func.coalesce(Factura.litros_barcaza, 0),
+        money.MICRO), money.MICRO, money.VOLUME_PLACES),
+    "galones_totales": (_en_unidades(Factura.galones_totales, money.MICRO), money.MICRO, money.VOLUME_PLACES),
+    "importe_invoice": (_en_unidades(Factura.importe_invoice, money.CENTAVOS), money.CENTAVOS, money.MONEY_PLACES),
+    "ieps": (_en_unidades(Factura.ieps, money.CENTAVOS), money.CENTAVOS, money.MONEY_PLACES),
+    "iva": (_en_unidades(Factura.iva, money.CENTAVOS), money.CENTAVOS, money.MONEY_PLACES),
+    "pvr": (_en_unidades(Factura.pvr, money.CENTAVOS), money.CENTAVOS, money.MONEY_PLACES),
+    "iva_pvr": (_en_unidades(Factura.iva_pvr, money.CENTAVOS), money.CENTAVOS, money.MONEY_PLACES),
+    "total_impuestos": (_en_unidades(Factura.total_impuestos, money.CENTAVOS), money.CENTAVOS, money.MONEY_PLACES),
+    "total_pagar": (_en_unidades(Factura.total_pagar, money.CENTAVOS), money.CENTAVOS, money.MONEY_PLACES),
+}
+
+# Bump a report's version when its definition changes, so cached artifacts are not reused
+REPORTES = {
+    "impuestos_por_importador": Reporte(
+        titulo="IEPS, IVA y PVR por importador y mes",
+        agrupar=("mes", "importador"),
+        medidas=("facturas", "importe_invoice", "ieps", "iva", "pvr", "iva_pvr", "total_impuestos", "total_pagar"),
+        version=1,
+    ),
+    "volumen_por_tipo": Reporte(
+        titulo="Volumen por tipo y mes",
+        agrupar=("mes", "tipo"),
+        medidas=("facturas", "litros", "galones_totales", "importe_invoice"),
+        version=1,
+    ),
+    "aduana_patente": Reporte(
+        titulo="Facturas por aduana y patente",
+        agrupar=("numero_aduana", "patente_aduanal"),
+        medidas=("facturas", "galones_totales", "total_impuestos", "total_pagar"),
+        version=1,
+    ),
+}
+
+
+# =====================
+# Requests and cache
+# =====================
+def parametros_canonicos(desde, hasta, estado=None):
+    """Parameters as the sorted JSON the cache key is computed from"""
+    return json.dumps({"desde": desde.isoformat(), "hasta": hasta.isoformat(), "estado": estado or None},
+                      sort_keys=True, separators=(",", ":"))
+
+
+def huella(clave, parametros):
+    digest = hashlib.sha256(f"{clave}\0{REPORTES[clave].version}\0".encode("utf-8"))
+    digest.update(parametros.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def ruta(artefacto):
+    return os.path.join(current_app.config["REPORTS_DIR"], artefacto.archivo)
+
+
+def _vencido(artefacto, ahora):
+    """A claim older than REPORTS_TIMEOUT belongs to a worker that died"""
+    return ahora - artefacto.iniciado_en > timedelta(seconds=current_app.config["REPORTS_TIMEOUT"])
+
+
+def reutilizable(artefacto, ahora=None):
+    """True if a finished artifact can be served for a new request"""
+    ahora = ahora or datetime.utcnow()
+    if artefacto.estado != LISTO or not artefacto.archivo or not os.path.exists(ruta(artefacto)):
+        return False
+    hasta = date.fromisoformat(json.loads(artefacto.parametros)["hasta"])
+    if hasta < ahora.date():
+        return True
+    return ahora - artefacto.terminado_en < timedelta(seconds=current_app.config["REPORTS_OPEN_TTL"])
+
+
+def solicitar(clave, desde, hasta, estado=None, usuario_id=None, forzar=False, en_segundo_plano=True):
+    """Queue a report, or return the cached/in-flight artifact for the same parameters.
+
+    Returns (artefacto, nuevo); ``nuevo`` is False when an existing artifact
+    is reused. With ``en_segundo_plano=False`` no job is queued: the caller
+    computes it itself (``reclamar`` + ``procesar``).
+    """
+    if clave not in REPORTES:
+        raise ValueError(f"Unknown report: {clave}")
+    parametros = parametros_canonicos(desde, hasta, estado)
+    clave_cache = huella(clave, parametros)
+    ahora = datetime.utcnow()
+
+    artefacto = ReporteArtefacto.query.filter_by(huella=clave_cache).first()
+    if artefacto is not None:
+        # already queued or being computed: forcing would only compute it twice
+        if artefacto.estado == PENDIENTE or (artefacto.estado == PROCESANDO and not _vencido(artefacto, ahora)):
+            return artefacto, False
+        if not forzar and reutilizable(artefacto, ahora):
+            return artefacto, False
+
+    if artefacto is None:
+        artefacto = ReporteArtefacto(reporte=clave, parametros=parametros, huella=clave_cache)
+        db.session.add(artefacto)
+    artefacto.estado = PENDIENTE
+    artefacto.error = None
+    artefacto.solicitado_por = usuario_id
+    artefacto.solicitado_en = ahora
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # another request queued the same report first
+        db.session.rollback()
+        return ReporteArtefacto.query.filter_by(huella=clave_cache).first(), False
+
+    if en_segundo_plano:
+        trabajos.encolar("reportes.generar", {"artefacto_id": artefacto.id}, prioridad=trabajos.BAJA)
+    db.session.commit()
+    return artefacto, True
+
+
+# =====================
+# Computation
+# =====================
+def _consulta(reporte, parametros):
+    columnas = [DIMENSIONES[d].label("fecha_hora" if d == "mes" else d) for d in reporte.agrupar]
+    columnas += [MEDIDAS[m][0].label(m) for m in reporte.medidas]
+    desde = date.fromisoformat(parametros["desde"])
+    hasta = date.fromisoformat(parametros["hasta"]) + timedelta(days=1)
+
+    consulta = select(*columnas).where(
+        Factura.fecha_hora >= datetime.combine(desde, datetime.min.time()),
+        Factura.fecha_hora < datetime.combine(hasta, datetime.min.time())
+    )
+    if parametros.get("estado"):
+        consulta = consulta.where(Factura.estado == parametros["estado"])
+    return consulta
+
+
+def calcular(reporte, parametros, tamano_bloque=None):
+    """Aggregate a report over the invoices of its period; returns a DataFrame"""
+    tamano_bloque = tamano_bloque or current_app.config["REPORTS_CHUNK_SIZE"]
+    agrupar = list(reporte.agrupar)
+    acumulado = None
+
+    with db.engine.connect() as conexion:
+        conexion = conexion.execution_options(stream_results=True)
+        for bloque in pd.read_sql(_consulta(reporte, parametros), conexion, chunksize=tamano_bloque):
+            if "mes" in agrupar:
+                bloque["mes"] = pd.to_datetime(bloque.pop("fecha_hora")).dt.strftime("%Y-%m")
+            parcial = bloque.groupby(agrupar, dropna=False)[list(reporte.medidas)].sum()
+            if acumulado is not None:
+                # concat + sum keeps int64 (align/add would go through float on missing groups)
+                parcial = pd.concat([acumulado, parcial]).groupby(level=list(range(len(agrupar))), dropna=False).sum()
+            acumulado = parcial
+
+    if acumulado is None:
+        return pd.DataFrame(columns=agrupar + list(reporte.medidas))
+
+    resultado = acumulado.sort_index().reset_index()
+    for medida in reporte.medidas:
+        _, escala, decimales = MEDIDAS[medida]
+        if escala is not None:
+            resultado[medida] = [money.from_minor(v, escala, decimales) for v in resultado[medida]]
+    return resultado
+
+
+def procesar(artefacto):
+    """Compute a claimed artifact and store its file"""
+    reporte = REPORTES[artefacto.reporte]
+    directorio = current_app.config["REPORTS_DIR"]
+    os.makedirs(directorio, exist_ok=True)
+    anterior = artefacto.archivo
+
+    try:
+        resultado = calcular(reporte, json.loads(artefacto.parametros))
+        archivo = f"{artefacto.reporte}_{artefacto.huella[:16]}_{int(time.time() * 1000)}.csv.gz"
+        destino = os.path.join(directorio, archivo)
+        temporal = destino + ".tmp"
+        resultado.to_csv(temporal, index=False, compression="gzip")
+        os.replace(temporal, destino)
+    except Exception as e:
+        current_app.logger.exception("Report %s failed", artefacto.id)
+        artefacto.estado = ERROR
+        artefacto.error = str(e)[:1000]
+        artefacto.terminado_en = datetime.utcnow()
+        db.session.commit()
+        return False
+
+    artefacto.estado = LISTO
+    artefacto.archivo = archivo
+    artefacto.columnas = json.dumps(list(resultado.columns))
+    artefacto.filas = len(resultado)
+    artefacto.bytes = os.path.getsize(destino)
+    artefacto.terminado_en = datetime.utcnow()
+    db.session.commit()
+
+    if anterior and anterior != archivo:
+        try:
+            os.remove(os.path.join(directorio, anterior))
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def reclamar(artefacto_id):
+    """Atomically take a pending (or abandoned) artifact; False if another worker has it"""
+    ahora = datetime.utcnow()
+    vencimiento = ahora - timedelta(seconds=current_app.config["REPORTS_TIMEOUT"])
+    resultado = db.session.execute(
+        update(ReporteArtefacto)
+        .where(ReporteArtefacto.id == artefacto_id, or_(
+            ReporteArtefacto.estado == PENDIENTE,
+            and_(ReporteArtefacto.estado == PROCESANDO, ReporteArtefacto.iniciado_en < vencimiento)
+        ))
+        .values(estado=PROCESANDO, iniciado_en=ahora)
+    )
+    db.session.commit()
+    return resultado.rowcount == 1
+
+
+def procesar_pendientes():
+    """Compute every pending artifact this worker manages to claim; returns how many"""
+    vencimiento = datetime.utcnow() - timedelta(seconds=current_app.config["REPORTS_TIMEOUT"])
+    candidatos = db.session.query(ReporteArtefacto.id).filter(or_(
+        ReporteArtefacto.estado == PENDIENTE,
+        and_(ReporteArtefacto.estado == PROCESANDO, ReporteArtefacto.iniciado_en < vencimiento)
+    )).order_by(ReporteArtefacto.solicitado_en).all()
+
+    procesados = 0
+    for (artefacto_id,) in candidatos:
+        if reclamar(artefacto_id):
+            procesar(db.session.get(ReporteArtefacto, artefacto_id))
+            procesados += 1
+    return procesados
+
+
+@trabajos.tarea("reportes.generar")
+def generar(artefacto_id):
+    """Job: compute a queued artifact, unless another worker already took it"""
+    if reclamar(artefacto_id):
+        procesar(db.session.get(ReporteArtefacto, artefacto_id))
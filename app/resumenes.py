@@ -0,0 +1,145 @@
+"""
+Notification digests by email.
+
+Instead of one email per notification, ``enviar`` sends each user at most
+one email per ``DIGEST_WINDOW`` seconds listing their unread notifications.
+It runs as the self-rescheduling job ``resumenes.enviar`` (start the chain
+once with ``flask resumenes programar``) or on demand with
+``flask resumenes enviar``.
+
+One query collects the whole batch: unread, not yet emailed notifications
+of active users in ``DIGEST_ROLES`` whose last digest is older than the
+window, read through the partial index ``ix_notificaciones_resumen``.
+Window functions number each user's notifications and count them, so a
+user with hundreds of pending notifications contributes only
+``DIGEST_MAX_ITEMS`` rows plus the total.
+
+All messages of a batch go through one transport connection (app/correo.py).
+Afterwards two UPDATEs mark the notifications as emailed and stamp
+``User.ultimo_resumen_en`` for the users that were sent.
+"""
+
+from datetime import datetime, timedelta
+from itertools import groupby
+from flask import current_app
+from sqlalchemy import func, or_, select, update
+from . import correo, trabajos
+from .extensions import db
+from .models import Notificacion, Trabajo, User
+
+_LOTE_IN = 500
+
+
+def pendientes(ahora, ventana, roles, maximo):
+    """Rows (usuario_id, email, nombre, titulo, mensaje, creado_en, total), newest first per user"""
+    por_usuario = dict(partition_by=Notificacion.usuario_id)
+    numeradas = select(
+        Notificacion.usuario_id,
+        User.email,
+        User.nombre,
+        Notificacion.titulo,
+        Notificacion.mensaje,
+        Notificacion.creado_en,
+        func.row_number().over(order_by=(Notificacion.creado_en.desc(), Notificacion.id.desc()),
+                               **por_usuario).label("numero"),
+        func.count().over(**por_usuario).label("total"),
+    ).join(User, User.id == Notificacion.usuario_id).where(
+        # same predicate as the index, so the planner can use it
+        Notificacion.enviada_en.is_(None),
+        Notificacion.leida == False,  # noqa: E712
+        Notificacion.creado_en <= ahora,
+        User.activo == True,  # noqa: E712
+        User.rol.in_(roles),
+        or_(User.ultimo_resumen_en.is_(None), User.ultimo_resumen_en <= ahora - ventana),
+    ).subquery()
+
+    return db.session.execute(
+        select(numeradas.c.usuario_id, numeradas.c.email, numeradas.c.nombre, numeradas.c.titulo,
+               numeradas.c.mensaje, numeradas.c.creado_en, numeradas.c.total)
+        .where(numeradas.c.numero <= maximo)
+        .order_by(numeradas.c.usuario_id, numeradas.c.numero)
+    ).all()
+
+
+def componer(filas):
+    """EmailMessage with one user's digest"""
+    primera = filas[0]
+    total = primera.total
+    asunto = "Traza: 1 notificación sin leer" if total == 1 else f"Traza: {total} notificaciones sin leer"
+
+    lineas = [f"Hola {primera.nombre},", "", "Tienes notificaciones sin leer en Traza:", ""]
+    for fila in filas:
+        lineas.append(f"- {fila.creado_en:%d/%m/%Y %H:%M}  {fila.titulo}")
+        lineas.append(f"  {fila.mensaje}")
+    if total > len(filas):
+        lineas.append(f"... y {total - len(filas)} más.")
+    url = current_app.config["APP_URL"]
+    if url:
+        lineas += ["", f"Revísalas en {url}/"]
+    lineas += ["", "Recibes como máximo un resumen por periodo; las notificaciones que leas antes no se incluyen."]
+    return correo.mensaje(primera.email, asunto, "\n".join(lineas))
+
+
+def _marcar(enviados, ahora):
+    for inicio in range(0, len(enviados), _LOTE_IN):
+        lote = enviados[inicio:inicio + _LOTE_IN]
+        db.session.execute(
+            update(Notificacion).where(
+                Notificacion.usuario_id.in_(lote),
+                Notificacion.enviada_en.is_(None),
+                Notificacion.leida == False,  # noqa: E712
+                Notificacion.creado_en <= ahora,
+            ).values(enviada_en=ahora)
+        )
+        db.session.execute(update(User).where(User.id.in_(lote)).values(ultimo_resumen_en=ahora))
+    db.session.commit()
+
+
+def enviar():
+    """Send the digests that are due; returns how many emails went out"""
+    config = current_app.config
+    ahora = datetime.utcnow()
+    filas = pendientes(ahora, timedelta(seconds=config["DIGEST_WINDOW"]),
+                       config["DIGEST_ROLES"], config["DIGEST_MAX_ITEMS"])
+    if not filas:
+        return 0
+
+    atendidos = []
+    rechazados = 0
+    try:
+        with correo.transporte().conexion() as conexion:
+            for usuario_id, grupo in groupby(filas, key=lambda fila: fila.usuario_id):
+                try:
+                    conexion.enviar(componer(list(grupo)))
+                except correo.ErrorDestinatario as e:
+                    # a bad address would fail again on every run; it waits for the next window like the rest
+                    current_app.logger.warning("Digest for user %s refused: %s", usuario_id, e)
+                    rechazados += 1
+                atendidos.append(usuario_id)
+    finally:
+        # record what did go out even if the batch stopped halfway, so a retry does not resend it
+        _marcar(atendidos, ahora)
+    return len(atendidos) - rechazados
+
+
+@trabajos.tarea("resumenes.enviar")
+def enviar_y_reprogramar():
+    """Send due digests and queue the next run one window later"""
+    enviar()
+    if not current_app.config["JOBS_EAGER"]:
+        programar()
+
+
+def programar(retraso=None):
+    """Queue a ``resumenes.enviar`` run in ``retraso`` seconds (DIGEST_WINDOW) unless one is pending.
+
+    True if queued. The caller commits.
+    """
+    pendiente = db.session.query(Trabajo.id).filter(
+        Trabajo.tarea == "resumenes.enviar", Trabajo.estado == trabajos.PENDIENTE
+    ).first()
+    if pendiente:
+        return False
+    retraso = current_app.config["DIGEST_WINDOW"] if retraso is None else retraso
+    trabajos.encolar("resumenes.enviar", prioridad=trabajos.BAJA, retraso=retraso)
+    return True
@@ -0,0 +1,131 @@
+from flask import Blueprint, redirect, url_for, flash, abort, send_file, current_app, request
+from flask_login import login_required, current_user
+from sqlalchemy.exc import IntegrityError
+from ..extensions import db
+from .. import adjuntos, audit, miniaturas
+from ..utils import validate_file_upload
+from ..models import Factura, Adjunto
+from ..forms import AdjuntoForm, EliminarAdjuntoForm
+
+bp = Blueprint("adjuntos", __name__, url_prefix="/adjuntos")
+
+
+def volver(factura):
+    """Detalle de la factura en la sección del rol actual"""
+    if current_user.is_admin():
+        return redirect(url_for("admins.ver_factura", id=factura.id))
+    if current_user.is_supervisor():
+        return redirect(url_for("supervisores.ver_factura", id=factura.id))
+    return redirect(url_for("usuarios.ver_factura", id=factura.id))
+
+
+@bp.route("/factura/<int:factura_id>", methods=["POST"])
+@login_required
+def subir(factura_id):
+    """Adjuntar un archivo a una factura"""
+    factura = Factura.query.get_or_404(factura_id)
+    if not factura.can_attach(current_user):
+        flash("No puedes adjuntar archivos a esta factura.", "danger")
+        return volver(factura)
+
+    form = AdjuntoForm()
+    if not form.validate_on_submit():
+        for errores in form.errors.values():
+            flash(errores[0], "danger")
+        return volver(factura)
+
+    archivo = form.archivo.data
+    valido, mensaje = validate_file_upload(archivo, adjuntos.EXTENSIONES)
+    if not valido:
+        flash(mensaje, "danger")
+        return volver(factura)
+
+    try:
+        adjunto, nuevo = adjuntos.adjuntar(factura, archivo, archivo.filename, current_user)
+    except adjuntos.AdjuntoInvalido as e:
+        flash(str(e), "danger")
+        return volver(factura)
+
+    if not nuevo:
+        flash(f"Este archivo ya está adjunto a la factura como {adjunto.nombre}.", "info")
+        return volver(factura)
+
+    audit.registrar(factura.id, current_user.id, "adjunto", factura.estado, factura.estado,
+                    comentario=f"Adjuntó {adjunto.nombre}")
+    miniaturas.programar(adjunto)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # el mismo archivo, enviado dos veces a la vez
+        db.session.rollback()
+        flash("Este archivo ya está adjunto a la factura.", "info")
+        return volver(factura)
+
+    flash(f"Archivo {adjunto.nombre} adjuntado.", "success")
+    return volver(factura)
+
+
+@bp.route("/<int:id>/descargar")
+@login_required
+def descargar(id):
+    """Descargar un adjunto (?ver=1 lo abre en el navegador si es PDF o imagen)"""
+    adjunto = Adjunto.query.get_or_404(id)
+    # Mismas reglas que ver_factura; 404 y no 403 para no revelar qué adjuntos existen
+    if not adjunto.factura.can_view(current_user):
+        abort(404)
+    return adjuntos.servir(adjunto, en_linea=request.args.get("ver") == "1")
+
+
+@bp.route("/<int:id>/miniatura/<tamano>/<sha256>")
+@login_required
+def miniatura(id, tamano, sha256):
+    """Vista previa reducida de un adjunto (imagen o primera página del PDF)"""
+    adjunto = Adjunto.query.get_or_404(id)
+    # El hash en la URL la ata al contenido: si el id se reutiliza, la caché del navegador no sirve otro archivo
+    if tamano not in current_app.config["PREVIEW_SIZES"] or sha256 != adjunto.blob_sha256 \
+            or not adjunto.factura.can_view(current_user):
+        abort(404)
+
+    try:
+        camino = miniaturas.obtener(adjunto.blob_sha256, adjunto.blob.tipo_mime, tamano)
+    except miniaturas.NoDisponible:
+        # sigue generándose en el pool; el navegador lo vuelve a pedir
+        respuesta = current_app.response_class(status=503)
+        respuesta.headers["Retry-After"] = "2"
+        respuesta.cache_control.no_store = True
+        return respuesta
+    if camino is None:
+        abort(404)
+
+    # El contenido de un adjunto no cambia nunca: caché de un año, solo en el navegador
+    respuesta = send_file(camino, mimetype="image/jpeg", etag=f"{adjunto.blob_sha256}-{tamano}",
+                          max_age=current_app.config["PREVIEW_MAX_AGE"], conditional=True)
+    respuesta.cache_control.public = False
+    respuesta.cache_control.private = True
+    respuesta.cache_control.immutable = True
+    return respuesta
+
+
+@bp.route("/<int:id>/eliminar", methods=["POST"])
+@login_required
+def eliminar(id):
+    """Quitar un adjunto (quien lo subió, supervisores y admins)"""
+    adjunto = Adjunto.query.get_or_404(id)
+    factura = adjunto.factura
+    propio = adjunto.subido_por_id == current_user.id
+    if not factura.can_attach(current_user) or not (propio or current_user.is_admin() or current_user.is_supervisor()):
+        flash("No puedes quitar este adjunto.", "danger")
+        return volver(factura)
+
+    if not EliminarAdjuntoForm().validate_on_submit():
+        flash("La sesión del formulario expiró; inténtalo de nuevo.", "danger")
+        return volver(factura)
+
+    nombre = adjunto.nombre
+    adjuntos.quitar(adjunto)
+    audit.registrar(factura.id, current_user.id, "adjunto_eliminado", factura.estado, factura.estado,
+                    comentario=f"Quitó {nombre}")
+    db.session.commit()
+
+    flash(f"Adjunto {nombre} eliminado.", "success")
+    return volver(factura)
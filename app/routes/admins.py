@@ -1,11 +1,18 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
+import json
+import os
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify, send_file, abort
 from flask_login import login_required, current_user
 from functools import wraps
 from sqlalchemy import or_, func
-from datetime import datetime, timedelta
+from sqlalchemy.orm import joinedload
+from datetime import datetime
 from ..extensions import db
-from ..models import Factura, ConfiguracionTasas, User, HistorialFactura, Notificacion
-from ..forms import TasasForm, UserManagementForm, RevisionForm, BusquedaFacturasForm
+from .. import metrics, creditos, contadores, audit, reportes, duplicados, trabajos
+from ..idempotency import idempotent, record_response
+from ..cache import LazyList, factura_fragment_key
+from ..utils import get_invoice_history, get_requester_profile, get_current_tax_rates, mes_de, inicio_de_mes
+from ..models import Factura, ConfiguracionTasas, User, HistorialFactura, Notificacion, MovimientoCredito, ReporteArtefacto, Trabajo
+from ..forms import TasasForm, UserManagementForm, RevisionForm, BusquedaFacturasForm, AsignarCreditosForm, ReporteForm
 
 bp = Blueprint("admins", __name__, url_prefix="/admin")
 
@@ -27,8 +34,9 @@ def dashboard():
     """Dashboard principal para administradores"""
     # Estadísticas generales
     total_usuarios = User.query.filter_by(activo=True).count()
-    total_facturas = Factura.query.count()
-    facturas_pendientes = Factura.query.filter_by(estado="pendiente_admin").count()
+    conteo = contadores.leer((contadores.GLOBAL, 0))[(contadores.GLOBAL, 0)]
+    total_facturas = sum(conteo.values())
+    facturas_pendientes = conteo["pendiente_admin"]
     facturas_aprobadas_hoy = Factura.query.filter(
         Factura.estado == "aprobada",
         Factura.aprobado_en >= datetime.now().date()
@@ -41,10 +49,12 @@ def dashboard():
     # Usuarios recientes
     usuarios_recientes = User.query.order_by(User.creado_en.desc()).limit(5).all()
 
-    # Revenue del mes actual
-    mes_actual = datetime.now().replace(day=1)
+    # Revenue del mes actual (desde el día 1 a medianoche)
     revenue_mes = db.session.query(func.sum(Factura.total_pagar))\
-        .filter(Factura.estado == "aprobada", Factura.aprobado_en >= mes_actual).scalar() or 0
+        .filter(Factura.estado == "aprobada", Factura.aprobado_en >= inicio_de_mes()).scalar() or 0
+
+    # Trabajos en cola que nadie toma: JOBS_EAGER apagado sin `flask worker` corriendo
+    trabajos_detenidos = trabajos.sin_trabajador()
 
     return render_template("admins/dashboard.html",
                          total_usuarios=total_usuarios,
@@ -53,7 +63,8 @@ def dashboard():
                          facturas_aprobadas_hoy=facturas_aprobadas_hoy,
                          facturas_recientes=facturas_recientes,
                          usuarios_recientes=usuarios_recientes,
-                         revenue_mes=revenue_mes)
+                         revenue_mes=revenue_mes,
+                         trabajos_detenidos=trabajos_detenidos)
 
 
 @bp.route("/tasas", methods=["GET", "POST"])
@@ -61,12 +72,15 @@ def dashboard():
 @admin_required
 def configurar_tasas():
     """Configurar tasas de impuestos"""
-    # Obtener configuración actual
-    tasas_actual = ConfiguracionTasas.query.order_by(ConfiguracionTasas.id.desc()).first()
+    # Obtener configuración vigente
+    tasas_actual = get_current_tax_rates()
 
     form = TasasForm()
     if tasas_actual:
         form = TasasForm(obj=tasas_actual)
+        if not form.is_submitted():
+            # Sin fecha, la nueva configuración aplica desde ahora
+            form.vigente_desde.data = None
 
     if form.validate_on_submit():
         # Crear nueva configuración
@@ -76,6 +90,7 @@ def configurar_tasas():
             pvr=form.pvr.data,
             iva_pvr=form.iva_pvr.data,
             factor_conversion=form.factor_conversion.data,
+            vigente_desde=form.vigente_desde.data or datetime.utcnow(),
             actualizado_por=current_user.id
         )
 
@@ -86,7 +101,8 @@ def configurar_tasas():
         return redirect(url_for("admins.configurar_tasas"))
 
     # Historial de cambios
-    historial_tasas = ConfiguracionTasas.query.order_by(ConfiguracionTasas.actualizado_en.desc()).limit(10).all()
+    historial_tasas = ConfiguracionTasas.query\
+        .order_by(ConfiguracionTasas.vigente_desde.desc(), ConfiguracionTasas.id.desc()).limit(10).all()
 
     return render_template("admins/configurar_tasas.html",
                          form=form,
@@ -140,19 +156,67 @@ def editar_usuario(id):
     """Editar un usuario"""
     usuario = User.query.get_or_404(id)
     form = UserManagementForm(obj=usuario)
+    if not form.is_submitted():
+        form.creditos_vistos.data = usuario.creditos or 0
 
     if form.validate_on_submit():
+        ajuste = creditos.ajustar(usuario, form.creditos.data, form.creditos_vistos.data, current_user.id)
+        if ajuste is None:
+            # Gastó (o recibió) créditos mientras se editaba: no pisar el saldo nuevo
+            db.session.rollback()
+            db.session.refresh(usuario)
+            form.creditos.data = form.creditos_vistos.data = usuario.creditos or 0
+            flash(f"El saldo de {usuario.nombre} cambió mientras lo editabas; ahora es {usuario.creditos}. "
+                  "Revisa los créditos y guarda de nuevo.", "warning")
+            return render_template("admins/editar_usuario.html", form=form, usuario=usuario,
+                                   perfil=get_requester_profile(usuario))
+
         usuario.nombre = form.nombre.data
         usuario.email = form.email.data
         usuario.rol = form.rol.data
-        usuario.creditos = form.creditos.data
         usuario.activo = form.activo.data
-
         db.session.commit()
         flash(f"Usuario {usuario.nombre} actualizado exitosamente.", "success")
         return redirect(url_for("admins.gestionar_usuarios"))
 
-    return render_template("admins/editar_usuario.html", form=form, usuario=usuario)
+    return render_template("admins/editar_usuario.html", form=form, usuario=usuario,
+                         perfil=get_requester_profile(usuario))
+
+
+@bp.route("/creditos", methods=["GET", "POST"])
+@login_required
+@admin_required
+@idempotent
+def asignar_creditos():
+    """Asignación masiva de créditos (un UPDATE y un INSERT masivo)"""
+    form = AsignarCreditosForm()
+
+    if form.validate_on_submit():
+        if form.destino.data == "emails":
+            emails = {e.strip().lower() for e in form.emails.data.splitlines() if e.strip()}
+            usuarios = db.session.query(User.id, User.email).filter(func.lower(User.email).in_(emails)).all()
+            no_encontrados = emails - {email.lower() for _, email in usuarios}
+            if no_encontrados:
+                flash(f"No existen usuarios con estos emails: {', '.join(sorted(no_encontrados))}", "warning")
+                return render_template("admins/asignar_creditos.html", form=form, movimientos=_ultimas_asignaciones())
+        else:
+            usuarios = db.session.query(User.id).filter_by(rol=form.destino.data, activo=True).all()
+
+        asignados = creditos.asignar([u.id for u in usuarios], form.cantidad.data,
+                                     current_user.id, form.comentario.data or None)
+        respuesta = record_response(redirect(url_for("admins.asignar_creditos")))
+        db.session.commit()
+
+        flash(f"Se asignaron {form.cantidad.data} créditos a {asignados} usuarios.", "success")
+        return respuesta
+
+    return render_template("admins/asignar_creditos.html", form=form, movimientos=_ultimas_asignaciones())
+
+
+def _ultimas_asignaciones(limite=20):
+    return MovimientoCredito.query.filter_by(tipo=creditos.ASIGNACION)\
+        .options(joinedload(MovimientoCredito.usuario))\
+        .order_by(MovimientoCredito.id.desc()).limit(limite).all()
 
 
 @bp.route("/facturas")
@@ -213,6 +277,7 @@ def facturas_pendientes():
 @bp.route("/aprobar_factura/<int:id>", methods=["GET", "POST"])
 @login_required
 @admin_required
+@idempotent
 def aprobar_factura(id):
     """Aprobar o rechazar una factura"""
     factura = Factura.query.get_or_404(id)
@@ -250,18 +315,11 @@ def aprobar_factura(id):
             mensaje_notificacion = f"Tu factura #{factura.id} ha sido rechazada por el administrador."
 
             # Devolver crédito al usuario
-            factura.usuario.creditos += 1
+            creditos.reembolsar(factura, current_user.id, form.comentario.data)
 
-        # Registrar en historial
-        historial = HistorialFactura(
-            factura_id=factura.id,
-            usuario_id=current_user.id,
-            accion=accion,
-            comentario=form.comentario.data,
-            estado_anterior=estado_anterior,
-            estado_nuevo=factura.estado
-        )
-        db.session.add(historial)
+        # Registrar en historial, en la misma transacción que la decisión
+        audit.registrar(factura.id, current_user.id, accion, estado_anterior, factura.estado,
+                        comentario=form.comentario.data, atomico=True)
 
         # Notificar al usuario
         notificacion = Notificacion(
@@ -273,10 +331,13 @@ def aprobar_factura(id):
         )
         db.session.add(notificacion)
 
+        respuesta = record_response(redirect(url_for("admins.facturas_pendientes")))
         db.session.commit()
 
+        metrics.record_notification_fanout(1)
+
         flash(f"Factura #{factura.id} {accion.replace('_', ' ').title()} exitosamente.", "success")
-        return redirect(url_for("admins.facturas_pendientes"))
+        return respuesta
 
     # Obtener historial
     historial = HistorialFactura.query.filter_by(factura_id=id)\
@@ -285,7 +346,8 @@ def aprobar_factura(id):
     return render_template("admins/aprobar_factura.html",
                          factura=factura,
                          form=form,
-                         historial=historial)
+                         historial=historial,
+                         perfil=get_requester_profile(factura.usuario))
 
 
 @bp.route("/factura/<int:id>")
@@ -295,11 +357,13 @@ def ver_factura(id):
     """Ver detalles completos de una factura"""
     factura = Factura.query.get_or_404(id)
 
-    # Obtener historial completo
-    historial = HistorialFactura.query.filter_by(factura_id=id)\
-        .order_by(HistorialFactura.timestamp.desc()).all()
+    # Historial y bloques de detalle se sirven desde la caché de fragmentos
+    # mientras la factura no cambie; el historial solo se consulta si hace falta
+    historial = LazyList(lambda: get_invoice_history(id))
+    fragment_key = factura_fragment_key(factura, current_user.rol)
 
-    return render_template("admins/ver_factura.html", factura=factura, historial=historial)
+    return render_template("admins/ver_factura.html", factura=factura, historial=historial,
+                           fragment_key=fragment_key, perfil=get_requester_profile(factura.usuario))
 
 
 @bp.route("/estadisticas")
@@ -307,37 +371,28 @@ def ver_factura(id):
 @admin_required
 def estadisticas():
     """Panel de estadísticas y reportes"""
-    # Estadísticas de los últimos 12 meses
-    doce_meses_atras = datetime.now() - timedelta(days=365)
+    # Últimos 12 meses completos, incluido el actual; las consultas acotadas por
+    # fecha recorren solo ese tramo de los índices de creado_en / aprobado_en
+    desde = inicio_de_mes(11)
 
-    # Facturas por mes
-    facturas_por_mes = db.session.query(
-        func.date_trunc('month', Factura.creado_en),
-        func.count(Factura.id)
-    ).filter(Factura.creado_en >= doce_meses_atras)\
-     .group_by(func.date_trunc('month', Factura.creado_en)).all()
+    # Facturas por mes ("YYYY-MM")
+    mes = mes_de(Factura.creado_en)
+    facturas_por_mes = db.session.query(mes, func.count(Factura.id))\
+        .filter(Factura.creado_en >= desde).group_by(mes).order_by(mes).all()
 
     # Revenue por mes
-    revenue_por_mes = db.session.query(
-        func.date_trunc('month', Factura.aprobado_en),
-        func.sum(Factura.total_pagar)
-    ).filter(
-        Factura.estado == "aprobada",
-        Factura.aprobado_en >= doce_meses_atras
-    ).group_by(func.date_trunc('month', Factura.aprobado_en)).all()
-
-    # Distribución por estado
-    estados_distribution = db.session.query(
-        Factura.estado,
-        func.count(Factura.id)
-    ).group_by(Factura.estado).all()
-
-    # Top usuarios por facturas
-    top_usuarios = db.session.query(
-        User.nombre,
-        func.count(Factura.id)
-    ).join(Factura).group_by(User.nombre)\
-     .order_by(func.count(Factura.id).desc()).limit(10).all()
+    mes = mes_de(Factura.aprobado_en)
+    revenue_por_mes = db.session.query(mes, func.sum(Factura.total_pagar))\
+        .filter(Factura.estado == "aprobada", Factura.aprobado_en >= desde)\
+        .group_by(mes).order_by(mes).all()
+
+    # Distribución por estado y top usuarios, de los contadores mantenidos
+    conteo = contadores.leer((contadores.GLOBAL, 0))[(contadores.GLOBAL, 0)]
+    estados_distribution = [(estado, total) for estado, total in sorted(conteo.items()) if total]
+
+    mayores = dict(contadores.mayores(contadores.USUARIO, 10))
+    nombres = dict(db.session.query(User.id, User.nombre).filter(User.id.in_(mayores)).all())
+    top_usuarios = [(nombres.get(usuario_id), total) for usuario_id, total in mayores.items()]
 
     return render_template("admins/estadisticas.html",
                          facturas_por_mes=facturas_por_mes,
@@ -349,6 +404,7 @@ def estadisticas():
 @bp.route("/crear_factura", methods=["GET", "POST"])
 @login_required
 @admin_required
+@idempotent
 def crear_factura():
     """Permite al admin crear facturas"""
     from ..forms import CrearFacturaForm
@@ -368,8 +424,8 @@ def crear_factura():
                 flash("Usuario no válido.", "error")
                 return render_template("admins/crear_factura.html", form=form)
 
-            # Obtener tasas actuales
-            tasas_actual = ConfiguracionTasas.query.order_by(ConfiguracionTasas.actualizado_en.desc()).first()
+            # Obtener tasas vigentes
+            tasas_actual = get_current_tax_rates()
             if not tasas_actual:
                 flash("No se han configurado las tasas. Configure primero las tasas.", "error")
                 return redirect(url_for('admins.configurar_tasas'))
@@ -407,10 +463,12 @@ def crear_factura():
             )
 
             db.session.add(nueva_factura)
+            db.session.flush()
+            respuesta = record_response(redirect(url_for('admins.ver_factura', id=nueva_factura.id)))
             db.session.commit()
 
             flash(f"Factura #{nueva_factura.id} creada exitosamente para {usuario_seleccionado.nombre}.", "success")
-            return redirect(url_for('admins.ver_factura', id=nueva_factura.id))
+            return respuesta
 
         except Exception as e:
             db.session.rollback()
@@ -424,17 +482,111 @@ def crear_factura():
 @admin_required
 def api_stats():
     """API endpoint para obtener estadísticas en tiempo real"""
+    conteo = contadores.leer((contadores.GLOBAL, 0))[(contadores.GLOBAL, 0)]
     stats = {
         'total_usuarios': User.query.filter_by(activo=True).count(),
-        'total_facturas': Factura.query.count(),
-        'facturas_pendientes': Factura.query.filter_by(estado="pendiente_admin").count(),
+        'total_facturas': sum(conteo.values()),
+        'facturas_pendientes': conteo["pendiente_admin"],
         'facturas_aprobadas_mes': Factura.query.filter(
             Factura.estado == "aprobada",
-            Factura.aprobado_en >= datetime.now().replace(day=1)
+            Factura.aprobado_en >= inicio_de_mes()
         ).count(),
         'revenue_mes': float(db.session.query(func.sum(Factura.total_pagar))
                            .filter(Factura.estado == "aprobada",
-                                 Factura.aprobado_en >= datetime.now().replace(day=1))
+                                 Factura.aprobado_en >= inicio_de_mes())
                            .scalar() or 0)
     }
-    return jsonify(stats)
\ No newline at end of file
+    return jsonify(stats)
+
+
+@bp.route("/facturas/duplicados")
+@login_required
+@admin_required
+def pedimentos_duplicados():
+    """Facturas vigentes que comparten número de pedimento (posibles duplicados)"""
+    page = request.args.get('page', 1, type=int)
+    grupos = duplicados.casi_duplicados(page, current_app.config['INVOICES_PER_PAGE'])
+
+    # Mismo número, aduana y patente: duplicado exacto anterior al índice único
+    exactos = {
+        pedimento for pedimento, facturas in grupos.items
+        if len({(f.clave_pedimento or Factura.clave_de(f.numero_pedimento, f.numero_aduana, f.patente_aduanal))
+                for f in facturas}) < len(facturas)
+    }
+    return render_template("admins/duplicados.html", grupos=grupos, exactos=exactos)
+
+
+# =====================
+# REPORTES
+# =====================
+@bp.route("/reportes", methods=["GET", "POST"])
+@login_required
+@admin_required
+def solicitar_reporte():
+    """Solicitar reportes pesados; se calculan fuera de la petición"""
+    form = ReporteForm()
+    form.reporte.choices = [(clave, r.titulo) for clave, r in reportes.REPORTES.items()]
+
+    if form.validate_on_submit():
+        artefacto, nuevo = reportes.solicitar(
+            form.reporte.data, form.desde.data, form.hasta.data,
+            estado=form.estado.data or None, usuario_id=current_user.id, forzar=form.forzar.data
+        )
+        if nuevo:
+            flash("Reporte en cola. Esta página se actualizará cuando esté listo.", "info")
+        elif artefacto.estado == reportes.LISTO:
+            flash("Ya existía este reporte para el mismo periodo y filtros; se reutilizó.", "success")
+        else:
+            flash("Este reporte ya se está generando.", "info")
+        return redirect(url_for("admins.solicitar_reporte"))
+
+    artefactos = ReporteArtefacto.query.options(joinedload(ReporteArtefacto.solicitante))\
+        .order_by(ReporteArtefacto.solicitado_en.desc()).limit(30).all()
+    return render_template("admins/reportes.html", form=form, artefactos=artefactos,
+                           definiciones=reportes.REPORTES, parametros={a.id: json.loads(a.parametros) for a in artefactos})
+
+
+@bp.route("/reportes/<int:id>/estado")
+@login_required
+@admin_required
+def estado_reporte(id):
+    """Estado de un reporte, para el sondeo de la página"""
+    artefacto = ReporteArtefacto.query.get_or_404(id)
+    return jsonify(
+        id=artefacto.id,
+        estado=artefacto.estado,
+        filas=artefacto.filas,
+        error=artefacto.error,
+        descarga=url_for("admins.descargar_reporte", id=artefacto.id) if artefacto.estado == reportes.LISTO else None
+    )
+
+
+@bp.route("/reportes/<int:id>/descargar")
+@login_required
+@admin_required
+def descargar_reporte(id):
+    """Descargar el CSV comprimido de un reporte terminado"""
+    artefacto = ReporteArtefacto.query.get_or_404(id)
+    if artefacto.estado != reportes.LISTO or not os.path.exists(reportes.ruta(artefacto)):
+        abort(404)
+    parametros = json.loads(artefacto.parametros)
+    nombre = f"{artefacto.reporte}_{parametros['desde']}_{parametros['hasta']}"
+    if parametros.get("estado"):
+        nombre += f"_{parametros['estado']}"
+    return send_file(reportes.ruta(artefacto), mimetype="application/gzip",
+                     as_attachment=True, download_name=f"{nombre}.csv.gz")
+
+
+# =====================
+# TRABAJOS EN SEGUNDO PLANO
+# =====================
+@bp.route("/trabajos")
+@login_required
+@admin_required
+def trabajos_en_cola():
+    """Profundidad de la cola y latencia de los trabajos de la última hora"""
+    tareas = trabajos.resumen()
+    fallidos = Trabajo.query.filter_by(estado=trabajos.FALLIDO)\
+        .order_by(Trabajo.terminado_en.desc()).limit(20).all()
+    return render_template("admins/trabajos.html", tareas=tareas, fallidos=fallidos,
+                           eager=current_app.config["JOBS_EAGER"])
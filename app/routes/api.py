@@ -0,0 +1,414 @@
+"""
+API JSON para integraciones (ERP, etc.)
+
+Autenticación con token de API: ``Authorization: Bearer <token>``
+(los tokens se crean con ``flask api-token crear EMAIL``).
+
+    POST /api/v1/facturas              crea un lote de facturas (una transacción)
+    GET  /api/v1/facturas/estado?ids=  estado de muchas facturas a la vez
+    POST /api/v1/facturas/estado       igual, con {"ids": [...]} en el cuerpo
+    GET  /api/v1/cambios?desde=N       cambios de estado posteriores al cursor N
+    PUT  /api/v1/facturas/<id>/adjuntos?nombre=x.pdf  adjunta el cuerpo (el archivo tal cual)
+
+Los importes se devuelven como cadenas decimales para no perder exactitud.
+En PostgreSQL el id del historial se asigna al insertar pero se ve al
+confirmar, así que un cambio con id menor puede aparecer después de que el
+cliente avanzó el cursor. Por eso /cambios repite los últimos
+``API_CHANGES_OVERLAP`` ids anteriores al cursor: el cliente descarta los que
+ya tiene por su ``cursor``.
+La creación acepta la cabecera ``Idempotency-Key``: un reintento con la misma
+clave devuelve la respuesta original sin crear facturas de nuevo. Un lote con
+algún pedimento ya registrado en una factura no cancelada, o repetido dentro
+del propio lote, se rechaza entero con 409.
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from functools import wraps
+from flask import Blueprint, jsonify, request, current_app, g
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge
+from ..extensions import db
+from .. import metrics, creditos, audit, duplicados, trabajos, adjuntos, miniaturas
+from ..idempotency import idempotent, record_response
+from ..utils import InvoiceStatusManager, get_current_tax_rates
+from ..models import Factura, HistorialFactura, ApiToken, Adjunto
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+TIPOS = ("full", "carrotanque", "barcaza")
+CAMPOS_TEXTO = {
+    "importador": 150,
+    "rfc": 50,
+    "numero_pedimento": 50,
+    "numero_aduana": 50,
+    "patente_aduanal": 50,
+}
+CAMPOS_LITROS = ("litros_rem1", "litros_rem2", "litros_carrotanque", "litros_barcaza")
+CAMPOS_FLOAT = ("densidad", "peso_bruto", "tipo_cambio")
+
+# Una factura nueva nace como borrador o pasa directamente a los estados a
+# los que un borrador puede avanzar (salvo cancelarse)
+ESTADOS_INICIALES = ("borrador",) + tuple(
+    estado for estado in InvoiceStatusManager.VALID_TRANSITIONS["borrador"] if estado != "cancelada"
+)
+
+# ultimo_uso se actualiza como mucho una vez por intervalo, no en cada petición
+_INTERVALO_ULTIMO_USO = timedelta(minutes=5)
+
+
+def error_json(status, mensaje, **extra):
+    return jsonify(error=mensaje, **extra), status
+
+
+def token_required(f):
+    """Autentica la petición con un token de API y deja el usuario en g.api_user"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        esquema, _, token = request.headers.get("Authorization", "").partition(" ")
+        if esquema.lower() != "bearer" or not token:
+            return error_json(401, "Falta el token de API (Authorization: Bearer <token>)")
+
+        api_token = ApiToken.query.filter_by(token_hash=ApiToken.hash_token(token.strip()), activo=True).first()
+        if not api_token or not api_token.usuario.activo:
+            return error_json(401, "Token de API inválido o revocado")
+
+        ahora = datetime.utcnow()
+        if not api_token.ultimo_uso or ahora - api_token.ultimo_uso > _INTERVALO_ULTIMO_USO:
+            api_token.ultimo_uso = ahora
+            db.session.commit()
+
+        g.api_user = api_token.usuario
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _decimal(valor):
+    if valor is None or valor == "":
+        return None
+    try:
+        # str() para que 0.1 llegue como 0.1 y no como su aproximación binaria
+        return Decimal(str(valor))
+    except (InvalidOperation, ValueError):
+        raise ValueError("no es un número")
+
+
+def parse_factura(datos):
+    """Valida una factura del lote; devuelve (campos, errores)"""
+    if not isinstance(datos, dict):
+        return None, {"_": "Cada factura debe ser un objeto JSON"}
+
+    campos = {}
+    errores = {}
+
+    for campo, longitud in CAMPOS_TEXTO.items():
+        valor = datos.get(campo)
+        if not isinstance(valor, str) or not valor.strip():
+            errores[campo] = "Campo requerido"
+        elif len(valor) > longitud:
+            errores[campo] = f"Máximo {longitud} caracteres"
+        else:
+            campos[campo] = valor.strip()
+
+    if datos.get("tipo") not in TIPOS:
+        errores["tipo"] = f"Debe ser uno de: {', '.join(TIPOS)}"
+    else:
+        campos["tipo"] = datos["tipo"]
+
+    for campo in CAMPOS_LITROS + ("precio_molecula_galon",):
+        try:
+            valor = _decimal(datos.get(campo))
+        except ValueError as e:
+            errores[campo] = str(e)
+            continue
+        if valor is not None and (not valor.is_finite() or valor < 0):
+            errores[campo] = "Debe ser un número mayor o igual a 0"
+        else:
+            campos[campo] = valor if valor is not None else Decimal(0)
+
+    if "precio_molecula_galon" not in errores and datos.get("precio_molecula_galon") in (None, ""):
+        errores["precio_molecula_galon"] = "Campo requerido"
+    if not errores.keys() & set(CAMPOS_LITROS) and sum(campos[c] for c in CAMPOS_LITROS) <= 0:
+        errores["litros_rem1"] = "Debe ingresar al menos un volumen mayor a 0"
+
+    for campo in CAMPOS_FLOAT:
+        try:
+            valor = float(datos.get(campo) or 0)
+        except (TypeError, ValueError):
+            errores[campo] = "no es un número"
+            continue
+        if valor < 0:
+            errores[campo] = "Debe ser un número mayor o igual a 0"
+        else:
+            campos[campo] = valor
+
+    # Por defecto se envían a revisión; "borrador" las deja sin enviar
+    estado = datos.get("estado", "pendiente_supervisor")
+    if estado not in ESTADOS_INICIALES:
+        errores["estado"] = f"Debe ser uno de: {', '.join(ESTADOS_INICIALES)}"
+    else:
+        campos["estado"] = estado
+
+    return campos, errores
+
+
+def factura_json(factura):
+    return {
+        "id": factura.id,
+        "estado": factura.estado,
+        "estado_pago": factura.estado_pago,
+        "numero_pedimento": factura.numero_pedimento,
+        "galones_totales": str(factura.galones_totales),
+        "importe_invoice": str(factura.importe_invoice),
+        "total_impuestos": str(factura.total_impuestos),
+        "total_pagar": str(factura.total_pagar),
+        "actualizado_en": factura.actualizado_en.isoformat() if factura.actualizado_en else None,
+    }
+
+
+def _creditos_insuficientes(usuario, requeridos):
+    return error_json(402, f"Créditos insuficientes: se requieren {requeridos}, disponibles {usuario.creditos}")
+
+
+def _facturas_visibles(usuario):
+    """Los usuarios solo ven sus facturas; supervisores y administradores, todas"""
+    query = Factura.query
+    if usuario.is_usuario():
+        query = query.filter(Factura.usuario_id == usuario.id)
+    return query
+
+
+@bp.route("/facturas", methods=["POST"])
+@token_required
+@idempotent
+def crear_facturas():
+    """Crear un lote de facturas en una sola transacción (todo o nada)"""
+    cuerpo = request.get_json(silent=True)
+    lote = cuerpo.get("facturas") if isinstance(cuerpo, dict) else cuerpo
+    if not isinstance(lote, list) or not lote:
+        return error_json(400, "Se espera {\"facturas\": [...]} con al menos una factura")
+
+    max_lote = current_app.config["API_MAX_BATCH"]
+    if len(lote) > max_lote:
+        return error_json(413, f"Máximo {max_lote} facturas por petición")
+
+    validas = []
+    errores = []
+    for indice, datos in enumerate(lote):
+        campos, errores_factura = parse_factura(datos)
+        if errores_factura:
+            errores.append({"indice": indice, "errores": errores_factura})
+        else:
+            validas.append(campos)
+    if errores:
+        return error_json(422, "Hay facturas con errores; no se creó ninguna", facturas=errores)
+
+    usuario = g.api_user
+
+    # Pedimentos repetidos dentro del lote o ya registrados (búsquedas en el índice único)
+    claves = [Factura.clave_de(c["numero_pedimento"], c["numero_aduana"], c["patente_aduanal"]) for c in validas]
+    registradas = duplicados.existentes(claves)
+    vistas = {}
+    for indice, clave in enumerate(claves):
+        if clave in registradas:
+            errores.append({"indice": indice, "errores": {
+                "numero_pedimento": duplicados.mensaje(registradas[clave], usuario)
+            }})
+        elif clave in vistas:
+            errores.append({"indice": indice, "errores": {
+                "numero_pedimento": f"Pedimento repetido en el lote (índice {vistas[clave]})"
+            }})
+        else:
+            vistas[clave] = indice
+    if errores:
+        return error_json(409, "Hay pedimentos duplicados; no se creó ninguna factura", facturas=errores)
+
+    if usuario.creditos < len(validas):
+        return _creditos_insuficientes(usuario, len(validas))
+
+    tasas = get_current_tax_rates()
+    if not tasas:
+        return error_json(409, "No se han configurado las tasas")
+
+    facturas = []
+    for campos in validas:
+        factura = Factura(usuario_id=usuario.id, **campos)
+        factura.calcular_totales(tasas)
+        facturas.append(factura)
+
+    # Un INSERT por lote (insertmanyvalues) para obtener todos los ids
+    db.session.add_all(facturas)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # Otra petición registró alguno de estos pedimentos después de la comprobación
+        db.session.rollback()
+        return error_json(409, "Hay pedimentos duplicados; no se creó ninguna factura")
+
+    audit.registrar_varios([
+        audit.entrada(factura.id, usuario.id, "creacion", "", factura.estado, comentario="Creada vía API")
+        for factura in facturas
+    ])
+
+    # Una notificación por supervisor para todo el lote, no una por factura,
+    # creadas por el worker de trabajos
+    enviadas = [f for f in facturas if f.estado == "pendiente_supervisor"]
+    if enviadas:
+        ids = ", ".join(f"#{f.id}" for f in enviadas[:10]) + ("…" if len(enviadas) > 10 else "")
+        trabajos.encolar("notificar_rol", {
+            "role": "supervisor",
+            "factura_id": enviadas[0].id if len(enviadas) == 1 else None,
+            "title": "Nueva factura para revisar" if len(enviadas) == 1 else f"{len(enviadas)} nuevas facturas para revisar",
+            "message": f"El usuario {usuario.nombre} ha enviado vía API facturas que requieren revisión: {ids}",
+        })
+
+    # Descuento atómico al final, justo antes del commit (ver app/creditos.py)
+    if not creditos.consumir(usuario.id, facturas):
+        db.session.rollback()
+        return _creditos_insuficientes(usuario, len(facturas))
+
+    # La respuesta se arma antes del commit: después, expire_on_commit
+    # recargaría cada factura con un SELECT propio. Además se guarda en la
+    # clave de idempotencia en la misma transacción (ver app/idempotency.py)
+    respuesta = record_response((
+        jsonify(facturas=[factura_json(f) for f in facturas], creditos_restantes=usuario.creditos),
+        201
+    ))
+    db.session.commit()
+
+    metrics.record_invoice_created(len(facturas))
+
+    return respuesta
+
+
+@bp.route("/facturas/estado", methods=["GET", "POST"])
+@token_required
+def estado_facturas():
+    """Estado de muchas facturas en una sola consulta"""
+    if request.method == "POST":
+        cuerpo = request.get_json(silent=True) or {}
+        ids = cuerpo.get("ids") if isinstance(cuerpo, dict) else None
+        # Una cadena como "12,13" también es iterable: se exige una lista de enteros JSON
+        if ids is not None and (not isinstance(ids, list)
+                                or any(isinstance(i, bool) or not isinstance(i, int) for i in ids)):
+            return error_json(400, "ids debe ser una lista de enteros")
+    else:
+        ids = [i for i in request.args.get("ids", "").split(",") if i.strip()]
+
+    try:
+        ids = sorted({int(i) for i in ids or []})
+    except (TypeError, ValueError):
+        return error_json(400, "ids debe ser una lista de enteros")
+    if not ids:
+        return error_json(400, "Indica al menos un id")
+
+    max_lote = current_app.config["API_MAX_BATCH"]
+    if len(ids) > max_lote:
+        return error_json(413, f"Máximo {max_lote} ids por petición")
+
+    facturas = _facturas_visibles(g.api_user).filter(Factura.id.in_(ids)).all()
+    encontradas = {f.id for f in facturas}
+
+    return jsonify(
+        facturas=[factura_json(f) for f in sorted(facturas, key=lambda f: f.id)],
+        no_encontradas=[i for i in ids if i not in encontradas]
+    )
+
+
+@bp.route("/cambios")
+@token_required
+def cambios():
+    """Cambios de estado posteriores a un cursor (id del historial), en orden.
+
+    Incluye además los cambios de los ``API_CHANGES_OVERLAP`` ids anteriores
+    al cursor, que pudieron confirmarse tarde; el cliente los deduplica.
+    """
+    desde = request.args.get("desde", 0, type=int)
+    limite = min(request.args.get("limite", current_app.config["API_CHANGES_PAGE"], type=int),
+                 current_app.config["API_MAX_BATCH"])
+    if limite <= 0:
+        return error_json(400, "limite debe ser mayor a 0")
+
+    query = db.session.query(HistorialFactura, Factura.estado)\
+        .join(Factura, Factura.id == HistorialFactura.factura_id)
+    if g.api_user.is_usuario():
+        query = query.filter(Factura.usuario_id == g.api_user.id)
+
+    # Un registro de más para saber si hay otra página
+    filas = query.filter(HistorialFactura.id > desde).order_by(HistorialFactura.id).limit(limite + 1).all()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    cursor = filas[-1][0].id if filas else desde
+
+    # SQLite escribe de una transacción a la vez: ahí los ids ya salen en orden de confirmación
+    solapamiento = current_app.config["API_CHANGES_OVERLAP"] if db.engine.dialect.name != "sqlite" else 0
+    if desde and solapamiento:
+        # Fuera del límite de la página, para que el cursor siempre avance
+        filas = query.filter(HistorialFactura.id > desde - solapamiento, HistorialFactura.id <= desde)\
+            .order_by(HistorialFactura.id).all() + filas
+
+    return jsonify(
+        cambios=[
+            {
+                "cursor": historial.id,
+                "factura_id": historial.factura_id,
+                "accion": historial.accion,
+                "estado_anterior": historial.estado_anterior or None,
+                "estado_nuevo": historial.estado_nuevo,
+                "estado_actual": estado_actual,
+                "comentario": historial.comentario,
+                "timestamp": historial.timestamp.isoformat() if historial.timestamp else None,
+            }
+            for historial, estado_actual in filas
+        ],
+        cursor=cursor,
+        hay_mas=hay_mas
+    )
+
+
+@bp.route("/facturas/<int:id>/adjuntos", methods=["PUT"])
+@token_required
+def subir_adjunto(id):
+    """Adjunta el cuerpo de la petición (el archivo tal cual) a una factura.
+
+    ``?nombre=archivo.pdf`` da el nombre y el tipo. Subir de nuevo el mismo
+    contenido a la misma factura devuelve el adjunto existente con 200.
+    """
+    factura = db.session.get(Factura, id)
+    if factura is None or not factura.can_view(g.api_user):
+        return error_json(404, "Factura no encontrada")
+    if not factura.can_attach(g.api_user):
+        return error_json(403, "No puedes adjuntar archivos a esta factura")
+    nombre = request.args.get("nombre", "").strip()
+    if not nombre:
+        return error_json(400, "Falta el parámetro nombre")
+
+    try:
+        entrante = adjuntos.recibir(request.stream)
+    except RequestEntityTooLarge:
+        return error_json(413, f"El archivo supera el máximo de {current_app.config['UPLOAD_MAX_SIZE']} bytes")
+
+    with entrante:
+        try:
+            adjunto, nuevo = adjuntos.adjuntar(factura, entrante, nombre, g.api_user)
+        except adjuntos.AdjuntoInvalido as e:
+            return error_json(400, str(e))
+        if nuevo:
+            audit.registrar(factura.id, g.api_user.id, "adjunto", factura.estado, factura.estado,
+                            comentario=f"Adjuntó {adjunto.nombre} vía API")
+            miniaturas.programar(adjunto)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                adjunto = Adjunto.query.filter_by(factura_id=factura.id, blob_sha256=entrante.sha256).one()
+                nuevo = False
+
+    return jsonify(
+        id=adjunto.id,
+        factura_id=factura.id,
+        nombre=adjunto.nombre,
+        sha256=adjunto.blob_sha256,
+        tamano=adjunto.blob.tamano,
+        tipo_mime=adjunto.blob.tipo_mime,
+    ), 201 if nuevo else 200
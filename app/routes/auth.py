@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from ..extensions import db
-from ..models import User, ConfiguracionTasas
+from ..models import User
 from ..forms import LoginForm, RegisterForm
 from datetime import datetime
 
@@ -73,34 +73,3 @@ def logout():
     logout_user()
     flash("Has cerrado sesión exitosamente.", "info")
     return redirect(url_for("auth.login"))
-
-
-# Removed deprecated @bp.before_app_first_request - functionality moved to run.py
-def create_default_data():
-    """Create default admin user and tax configuration if they don't exist"""
-    # Create default admin user
-    admin = User.query.filter_by(email="admin@facturas.com").first()
-    if not admin:
-        admin = User(
-            nombre="Administrador",
-            email="admin@facturas.com",
-            rol="admin",
-            creditos=999,
-            activo=True
-        )
-        admin.set_password("admin123")
-        db.session.add(admin)
-
-    # Create default tax configuration
-    tasas = ConfiguracionTasas.query.first()
-    if not tasas:
-        tasas = ConfiguracionTasas(
-            ieps=4.59,
-            iva=0.16,
-            pvr=0.20,
-            iva_pvr=0.16,
-            factor_conversion=0.264172
-        )
-        db.session.add(tasas)
-
-    db.session.commit()
\ No newline at end of file
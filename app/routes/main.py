@@ -1,5 +1,7 @@
-from flask import Blueprint, render_template, redirect, url_for
-from flask_login import current_user
+import time
+from flask import Blueprint, render_template, redirect, url_for, request, jsonify
+from flask_login import current_user, login_required
+from .. import autocompletar as autocompletado
 
 bp = Blueprint("main", __name__)
 
@@ -12,4 +14,24 @@ def index():
             return redirect(url_for("supervisores.dashboard"))
         else:
             return redirect(url_for("usuarios.dashboard"))
-    return redirect(url_for("auth.login"))
\ No newline at end of file
+    return redirect(url_for("auth.login"))
+
+
+@bp.route("/autocompletar")
+@login_required
+def autocompletar():
+    """Sugerencias para importador, RFC, aduana y patente, ordenadas por uso"""
+    inicio = time.perf_counter()
+    campo = request.args.get("campo", "")
+    if campo not in autocompletado.CAMPOS:
+        return jsonify(error=f"campo debe ser uno de: {', '.join(autocompletado.CAMPOS)}"), 400
+    limite = max(1, min(request.args.get("limite", autocompletado.TOP_K, type=int), autocompletado.TOP_K))
+
+    encontradas = autocompletado.sugerencias(campo, request.args.get("q", ""), current_user, limite)
+    respuesta = jsonify(
+        campo=campo,
+        sugerencias=[{"valor": valor, "usos": usos} for usos, valor in encontradas]
+    )
+    respuesta.headers["Cache-Control"] = "private, max-age=30"
+    respuesta.headers["Server-Timing"] = f"indice;dur={(time.perf_counter() - inicio) * 1000:.3f}"
+    return respuesta
@@ -1,9 +1,15 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from functools import wraps
+from datetime import datetime
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 from ..extensions import db
-from ..models import Factura, HistorialFactura, Notificacion, User
+from .. import metrics, creditos, contadores, audit, trabajos
+from ..idempotency import idempotent, record_response
+from ..cache import LazyList, factura_fragment_key
+from ..utils import get_invoice_history, get_requester_profile, mes_de, inicio_de_mes
+from ..models import Factura, HistorialFactura, Notificacion
 from ..forms import RevisionForm, BusquedaFacturasForm
 
 bp = Blueprint("supervisores", __name__, url_prefix="/supervisores")
@@ -24,11 +30,10 @@ def supervisor_required(f):
 @supervisor_required
 def dashboard():
     """Dashboard principal para supervisores"""
-    # Facturas pendientes de revisión
-    facturas_pendientes = Factura.query.filter_by(estado="pendiente_supervisor").count()
-
-    # Facturas revisadas por este supervisor
-    facturas_revisadas = Factura.query.filter_by(supervisor_id=current_user.id).count()
+    # Pendientes de revisión (global) y revisadas por este supervisor, en una sola lectura
+    conteo = contadores.leer((contadores.GLOBAL, 0), (contadores.SUPERVISOR, current_user.id))
+    facturas_pendientes = conteo[(contadores.GLOBAL, 0)]["pendiente_supervisor"]
+    facturas_revisadas = sum(conteo[(contadores.SUPERVISOR, current_user.id)].values())
 
     # Facturas revisadas hoy
     from datetime import datetime, timedelta
@@ -95,6 +100,7 @@ def facturas_por_revisar():
 @bp.route("/revisar/<int:id>", methods=["GET", "POST"])
 @login_required
 @supervisor_required
+@idempotent
 def revisar_factura(id):
     """Revisar una factura específica"""
     factura = Factura.query.get_or_404(id)
@@ -116,17 +122,13 @@ def revisar_factura(id):
             accion = "revision_aprobada"
             mensaje_notificacion = f"Tu factura #{factura.id} ha sido aprobada por el supervisor y enviada al administrador."
 
-            # Notificar a administradores
-            admins = User.query.filter_by(rol="admin", activo=True).all()
-            for admin in admins:
-                notificacion = Notificacion(
-                    usuario_id=admin.id,
-                    factura_id=factura.id,
-                    titulo="Factura aprobada por supervisor",
-                    mensaje=f"La factura #{factura.id} ha sido aprobada por {current_user.nombre} y requiere aprobación final.",
-                    tipo="info"
-                )
-                db.session.add(notificacion)
+            # Notificar a administradores (worker de trabajos)
+            trabajos.encolar("notificar_rol", {
+                "role": "admin",
+                "factura_id": factura.id,
+                "title": "Factura aprobada por supervisor",
+                "message": f"La factura #{factura.id} ha sido aprobada por {current_user.nombre} y requiere aprobación final.",
+            })
 
         elif form.suspender.data:
             factura.estado = "suspendida"
@@ -143,18 +145,16 @@ def revisar_factura(id):
             mensaje_notificacion = f"Tu factura #{factura.id} ha sido rechazada."
 
             # Devolver crédito al usuario si se rechaza
-            factura.usuario.creditos += 1
+            creditos.reembolsar(factura, current_user.id, form.comentario.data)
 
-        # Registrar en historial
-        historial = HistorialFactura(
-            factura_id=factura.id,
-            usuario_id=current_user.id,
-            accion=accion,
-            comentario=form.comentario.data,
-            estado_anterior=estado_anterior,
-            estado_nuevo=factura.estado
-        )
-        db.session.add(historial)
+        # Registrar en historial, en la misma transacción que la revisión
+        audit.registrar(factura.id, current_user.id, accion, estado_anterior, factura.estado,
+                        comentario=form.comentario.data, atomico=True)
+
+        # Copia desnormalizada para mis_revisiones
+        factura.revision_supervisor_accion = accion
+        factura.revision_supervisor_en = datetime.utcnow()
+        factura.revision_supervisor_comentario = form.comentario.data
 
         # Notificar al usuario
         notificacion = Notificacion(
@@ -166,10 +166,13 @@ def revisar_factura(id):
         )
         db.session.add(notificacion)
 
+        respuesta = record_response(redirect(url_for("supervisores.facturas_por_revisar")))
         db.session.commit()
 
+        metrics.record_notification_fanout(1)
+
         flash(f"Factura #{factura.id} {accion.replace('_', ' ').title()} exitosamente.", "success")
-        return redirect(url_for("supervisores.facturas_por_revisar"))
+        return respuesta
 
     # Obtener historial de la factura
     historial = HistorialFactura.query.filter_by(factura_id=id)\
@@ -178,7 +181,8 @@ def revisar_factura(id):
     return render_template("supervisores/revisar_factura.html",
                          factura=factura,
                          form=form,
-                         historial=historial)
+                         historial=historial,
+                         perfil=get_requester_profile(factura.usuario))
 
 
 @bp.route("/mis_revisiones")
@@ -189,8 +193,10 @@ def mis_revisiones():
     page = request.args.get('page', 1, type=int)
     form = BusquedaFacturasForm()
 
-    # Query base - facturas revisadas por este supervisor
-    query = Factura.query.filter_by(supervisor_id=current_user.id)
+    # Query base - facturas revisadas por este supervisor; la revisión va en
+    # columnas de la propia factura y el usuario se carga en el mismo JOIN
+    query = Factura.query.filter_by(supervisor_id=current_user.id)\
+        .options(joinedload(Factura.usuario))
 
     # Aplicar filtros si hay búsqueda
     if request.args.get('search'):
@@ -206,8 +212,8 @@ def mis_revisiones():
     if request.args.get('estado'):
         query = query.filter_by(estado=request.args.get('estado'))
 
-    # Ordenar por fecha de actualización (más recientes primero)
-    query = query.order_by(Factura.actualizado_en.desc())
+    # Ordenar por fecha de revisión (más recientes primero)
+    query = query.order_by(Factura.revision_supervisor_en.desc(), Factura.id.desc())
 
     # Paginación
     facturas = query.paginate(
@@ -226,11 +232,13 @@ def ver_factura(id):
     """Ver detalles de una factura"""
     factura = Factura.query.get_or_404(id)
 
-    # Obtener historial
-    historial = HistorialFactura.query.filter_by(factura_id=id)\
-        .order_by(HistorialFactura.timestamp.desc()).all()
+    # Historial y bloques de detalle se sirven desde la caché de fragmentos
+    # mientras la factura no cambie; el historial solo se consulta si hace falta
+    historial = LazyList(lambda: get_invoice_history(id))
+    fragment_key = factura_fragment_key(factura, current_user.rol)
 
-    return render_template("supervisores/ver_factura.html", factura=factura, historial=historial)
+    return render_template("supervisores/ver_factura.html", factura=factura, historial=historial,
+                           fragment_key=fragment_key, perfil=get_requester_profile(factura.usuario))
 
 
 @bp.route("/estadisticas")
@@ -238,20 +246,18 @@ def ver_factura(id):
 @supervisor_required
 def estadisticas():
     """Estadísticas de revisión para supervisores"""
-    from datetime import datetime, timedelta
     from sqlalchemy import func
 
-    # Facturas revisadas por mes (últimos 6 meses)
-    seis_meses_atras = datetime.now() - timedelta(days=180)
-
+    # Facturas revisadas por mes ("YYYY-MM"), últimos 6 meses completos incluido el actual
+    mes = mes_de(HistorialFactura.timestamp)
     revisiones_por_mes = db.session.query(
-        func.date_trunc('month', HistorialFactura.timestamp),
+        mes,
         func.count(HistorialFactura.id)
     ).filter(
         HistorialFactura.usuario_id == current_user.id,
         HistorialFactura.accion.in_(['revision_aprobada', 'suspension', 'rechazo']),
-        HistorialFactura.timestamp >= seis_meses_atras
-    ).group_by(func.date_trunc('month', HistorialFactura.timestamp)).all()
+        HistorialFactura.timestamp >= inicio_de_mes(5)
+    ).group_by(mes).order_by(mes).all()
 
     # Distribución de acciones
     acciones_stats = db.session.query(
@@ -1,26 +1,44 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 from ..extensions import db
-from ..models import Factura, ConfiguracionTasas, HistorialFactura, Notificacion
+from .. import metrics, creditos, contadores, audit, duplicados, trabajos
+from ..idempotency import idempotent, record_response
+from ..cache import LazyList, factura_fragment_key
+from ..utils import get_invoice_history, get_current_tax_rates
+from ..models import Factura, Notificacion
 from ..forms import FacturaForm, BusquedaFacturasForm
 
 bp = Blueprint("usuarios", __name__, url_prefix="/usuarios")
 
+
+def _pedimento_duplicado(form, factura=None):
+    """Marca el error en el formulario si el pedimento ya está en otra factura vigente.
+
+    Al editar solo se comprueba si el pedimento cambió, para que un duplicado
+    anterior al índice único se pueda seguir corrigiendo en otros campos.
+    """
+    datos = (form.numero_pedimento.data, form.numero_aduana.data, form.patente_aduanal.data)
+    if factura is not None and Factura.clave_de(*datos) == Factura.clave_de(
+            factura.numero_pedimento, factura.numero_aduana, factura.patente_aduanal):
+        return False
+
+    duplicada = duplicados.buscar(*datos, excluir_id=factura.id if factura else None)
+    if duplicada is None:
+        return False
+    form.numero_pedimento.errors.append(duplicados.mensaje(duplicada, current_user))
+    return True
+
 @bp.route("/dashboard")
 @login_required
 def dashboard():
     """Dashboard principal para usuarios"""
-    # Obtener estadísticas del usuario
-    facturas_totales = Factura.query.filter_by(usuario_id=current_user.id).count()
-    facturas_pendientes = Factura.query.filter_by(
-        usuario_id=current_user.id,
-        estado="pendiente_supervisor"
-    ).count()
-    facturas_aprobadas = Factura.query.filter_by(
-        usuario_id=current_user.id,
-        estado="aprobada"
-    ).count()
+    # Obtener estadísticas del usuario (contadores mantenidos, una sola lectura)
+    conteo = contadores.de_usuario(current_user.id)
+    facturas_totales = sum(conteo.values())
+    facturas_pendientes = conteo["pendiente_supervisor"]
+    facturas_aprobadas = conteo["aprobada"]
 
     # Facturas recientes
     facturas_recientes = Factura.query.filter_by(usuario_id=current_user.id)\
@@ -42,16 +60,18 @@ def dashboard():
 
 @bp.route("/crear_factura", methods=["GET", "POST"])
 @login_required
+@idempotent
 def crear_factura():
     """Crear nueva factura"""
+    # Comprobación rápida con el saldo en caché; el descuento real es atómico (app/creditos.py)
     if current_user.creditos <= 0:
         flash("No tienes créditos suficientes para crear facturas. Contacta al administrador.", "warning")
         return redirect(url_for("usuarios.dashboard"))
 
     form = FacturaForm()
-    if form.validate_on_submit():
-        # Obtener tasas actuales
-        tasas = ConfiguracionTasas.query.order_by(ConfiguracionTasas.id.desc()).first()
+    if form.validate_on_submit() and not _pedimento_duplicado(form):
+        # Obtener tasas vigentes
+        tasas = get_current_tax_rates()
         if not tasas:
             flash("No se han configurado las tasas. Contacta al administrador.", "error")
             return redirect(url_for("usuarios.dashboard"))
@@ -79,43 +99,44 @@ def crear_factura():
         # Calcular totales
         factura.calcular_totales(tasas)
 
-        # Descontar crédito
-        current_user.creditos -= 1
-
         # Guardar en base de datos
         db.session.add(factura)
-        db.session.flush()  # To get the factura.id
+        try:
+            db.session.flush()  # To get the factura.id
+        except IntegrityError:
+            # Otra petición registró el mismo pedimento entre la comprobación y el INSERT
+            db.session.rollback()
+            form.numero_pedimento.errors.append(duplicados.EN_OTRA_FACTURA)
+            return render_template("usuarios/crear_factura.html", form=form, tasas=get_current_tax_rates())
 
         # Registrar en historial
-        historial = HistorialFactura(
-            factura_id=factura.id,
-            usuario_id=current_user.id,
-            accion="creacion",
-            estado_anterior="",
-            estado_nuevo="pendiente_supervisor"
-        )
-        db.session.add(historial)
-
-        # Crear notificación para supervisores
-        from ..models import User
-        supervisores = User.query.filter_by(rol="supervisor", activo=True).all()
-        for supervisor in supervisores:
-            notificacion = Notificacion(
-                usuario_id=supervisor.id,
-                factura_id=factura.id,
-                titulo="Nueva factura para revisar",
-                mensaje=f"El usuario {current_user.nombre} ha creado una nueva factura (#{factura.id}) que requiere revisión.",
-                tipo="info"
-            )
-            db.session.add(notificacion)
+        audit.registrar(factura.id, current_user.id, "creacion", "", "pendiente_supervisor")
+
+        # Notificar a los supervisores fuera de la petición (se encola en esta transacción)
+        trabajos.encolar("notificar_rol", {
+            "role": "supervisor",
+            "factura_id": factura.id,
+            "title": "Nueva factura para revisar",
+            "message": f"El usuario {current_user.nombre} ha creado una nueva factura (#{factura.id}) que requiere revisión.",
+        })
+
+        # Descontar crédito al final, justo antes del commit, para retener
+        # el bloqueo de la fila del usuario el menor tiempo posible
+        if not creditos.consumir(current_user.id, [factura]):
+            db.session.rollback()
+            flash("No tienes créditos suficientes para crear facturas. Contacta al administrador.", "warning")
+            return redirect(url_for("usuarios.dashboard"))
 
+        respuesta = record_response(redirect(url_for("usuarios.ver_factura", id=factura.id)))
         db.session.commit()
 
+        metrics.record_invoice_created()
+
         flash(f"Factura #{factura.id} creada exitosamente y enviada para revisión.", "success")
-        return redirect(url_for("usuarios.ver_factura", id=factura.id))
+        return respuesta
 
-    # Obtener tasas actuales para mostrar en el formulario
-    tasas = ConfiguracionTasas.query.order_by(ConfiguracionTasas.id.desc()).first()
+    # Obtener tasas vigentes para mostrar en el formulario
+    tasas = get_current_tax_rates()
 
     return render_template("usuarios/crear_factura.html", form=form, tasas=tasas)
 
@@ -171,11 +192,13 @@ def ver_factura(id):
         flash("No tienes permisos para ver esta factura.", "danger")
         return redirect(url_for("usuarios.dashboard"))
 
-    # Obtener historial
-    historial = HistorialFactura.query.filter_by(factura_id=id)\
-        .order_by(HistorialFactura.timestamp.desc()).all()
+    # Historial y bloques de detalle se sirven desde la caché de fragmentos
+    # mientras la factura no cambie; el historial solo se consulta si hace falta
+    historial = LazyList(lambda: get_invoice_history(id))
+    fragment_key = factura_fragment_key(factura, current_user.rol)
 
-    return render_template("usuarios/ver_factura.html", factura=factura, historial=historial)
+    return render_template("usuarios/ver_factura.html", factura=factura, historial=historial,
+                           fragment_key=fragment_key)
 
 
 @bp.route("/editar_factura/<int:id>", methods=["GET", "POST"])
@@ -190,9 +213,9 @@ def editar_factura(id):
         return redirect(url_for("usuarios.ver_factura", id=id))
 
     form = FacturaForm(obj=factura)
-    if form.validate_on_submit():
-        # Obtener tasas actuales
-        tasas = ConfiguracionTasas.query.order_by(ConfiguracionTasas.id.desc()).first()
+    if form.validate_on_submit() and not _pedimento_duplicado(form, factura):
+        # Tasas vigentes a la fecha de la factura, no las de hoy
+        tasas = get_current_tax_rates(factura.fecha_hora)
 
         # Actualizar datos
         estado_anterior = factura.estado
@@ -215,16 +238,14 @@ def editar_factura(id):
             factura.estado = "pendiente_supervisor"
 
         # Registrar en historial
-        historial = HistorialFactura(
-            factura_id=factura.id,
-            usuario_id=current_user.id,
-            accion="edicion",
-            estado_anterior=estado_anterior,
-            estado_nuevo=factura.estado
-        )
-        db.session.add(historial)
-
-        db.session.commit()
+        audit.registrar(factura.id, current_user.id, "edicion", estado_anterior, factura.estado)
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            form.numero_pedimento.errors.append(duplicados.EN_OTRA_FACTURA)
+            return render_template("usuarios/editar_factura.html", form=form, factura=factura)
 
         flash("Factura actualizada exitosamente.", "success")
         return redirect(url_for("usuarios.ver_factura", id=id))
@@ -0,0 +1,36 @@
+// Sugerencias para los campos marcados con data-autocompletar="<campo>"
+(function() {
+    'use strict';
+    const url = document.currentScript.dataset.url;
+
+    document.querySelectorAll('input[data-autocompletar]').forEach(function(input) {
+        const lista = document.createElement('datalist');
+        lista.id = `${input.id}-sugerencias`;
+        input.setAttribute('list', lista.id);
+        input.after(lista);
+
+        let solicitud = null;
+        input.addEventListener('input', function() {
+            const prefijo = input.value.trim();
+            if (solicitud) {
+                solicitud.abort();
+            }
+            if (!prefijo) {
+                lista.replaceChildren();
+                return;
+            }
+            solicitud = new AbortController();
+            const parametros = new URLSearchParams({campo: input.dataset.autocompletar, q: prefijo});
+            fetch(`${url}?${parametros}`, {signal: solicitud.signal})
+                .then(response => response.ok ? response.json() : {sugerencias: []})
+                .then(data => {
+                    lista.replaceChildren(...data.sugerencias.map(s => {
+                        const opcion = document.createElement('option');
+                        opcion.value = s.valor;
+                        return opcion;
+                    }));
+                })
+                .catch(() => {});
+        });
+    });
+})();
@@ -0,0 +1,87 @@
+"""
+Effective-dated tax rates.
+
+``ConfiguracionTasas`` is append-only: every change inserts a row, and the
+row's ``vigente_desde`` says from when it applies. The rates for a moment
+are those of the row with the latest ``vigente_desde`` at or before it.
+Ties go to the higher id, so a correction entered later wins. A moment
+before the first row resolves to the first row, because there were no
+earlier rates to apply.
+
+``IndiceTasas`` keeps the whole schedule in memory, sorted by
+(vigente_desde, id), and resolves a moment with a bisect in O(log n).
+The table holds a few rows per year, so loading it all takes one small
+query. Each worker caches its index, and ``indice()`` rebuilds it when
+``max(id)`` changes (a primary-key lookup). A new schedule is therefore
+seen by every worker on its next lookup.
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func
+from .extensions import db
+from .models import ConfiguracionTasas
+from . import money
+from .lazy import numpy as np
+
+_CAMPOS = ("id", "ieps", "iva", "pvr", "iva_pvr", "factor_conversion",
+           "vigente_desde", "actualizado_en", "actualizado_por")
+
+# Detached copy of a ConfiguracionTasas row: same attributes, safe to share between requests
+Tasas = namedtuple("Tasas", _CAMPOS)
+
+
+class IndiceTasas:
+    """Sorted interval index over the rate schedule"""
+
+    def __init__(self, filas, version=None):
+        filas = sorted(filas, key=lambda t: (t.vigente_desde, t.id))
+        self.version = version
+        self.tasas = filas
+        self._desde = [t.vigente_desde for t in filas]
+        self._enteras = [money.tasas_enteras(t) for t in filas]
+
+    def __len__(self):
+        return len(self.tasas)
+
+    def posicion(self, momento):
+        """Index of the schedule in force at ``momento`` (None: now)"""
+        if not self.tasas:
+            raise LookupError("No tax configuration found")
+        i = bisect_right(self._desde, momento or datetime.utcnow()) - 1
+        return max(i, 0)
+
+    def en(self, momento=None):
+        return self.tasas[self.posicion(momento)]
+
+    def enteras_en(self, momento=None):
+        return self._enteras[self.posicion(momento)]
+
+    def enteras_por_fila(self, momentos):
+        """money.TasasEnteras of per-row arrays for many moments, for money.calcular_lote"""
+        posiciones = np.asarray([self.posicion(m) for m in momentos], dtype=np.int64)
+        columnas = zip(*self._enteras)
+        return money.TasasEnteras(*(np.asarray(columna, dtype=np.int64)[posiciones] for columna in columnas))
+
+
+def cargar():
+    """Build an index over the whole schedule with one query"""
+    filas = db.session.query(*[getattr(ConfiguracionTasas, campo) for campo in _CAMPOS]).all()
+    return IndiceTasas([Tasas(*fila) for fila in filas], version=max((f.id for f in filas), default=None))
+
+
+def indice():
+    """This worker's index, rebuilt if the schedule changed since it was built"""
+    version = db.session.query(func.max(ConfiguracionTasas.id)).scalar()
+    actual = current_app.extensions.get("indice_tasas")
+    if actual is None or actual.version != version:
+        actual = current_app.extensions["indice_tasas"] = cargar()
+    return actual
+
+
+def vigentes(momento=None):
+    """Rates in force at ``momento`` (default: now), or None if none are configured"""
+    actual = indice()
+    return actual.en(momento) if len(actual) else None
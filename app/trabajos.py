@@ -0,0 +1,358 @@
+"""
+Background jobs without a broker.
+
+Jobs are rows of the ``trabajos`` table in the app's own database. The
+queue therefore needs nothing beyond the database, and a job is enqueued
+in the caller's transaction: ``encolar`` adds the row to the session, so
+the job exists only if the request that created it commits.
+
+A task is a function registered with ``@tarea("name")``. It receives the
+job's JSON arguments as keyword arguments, runs in an app context, and its
+session changes are committed when it returns. Tasks must be safe to run
+twice, because a worker can die after the work but before the commit
+that marks the job done.
+
+``flask worker --procesos N`` runs N worker processes, supervised by a
+parent process. A process claims a job in two steps. It first selects the
+first eligible id, using ``ix_trabajos_cola``. It then runs a conditional
+UPDATE (pendiente -> en_curso) that only one worker can win. Lower
+``prioridad`` runs first. A job that raises is retried after an
+exponential backoff (``JOBS_BACKOFF`` doubled per attempt, capped at
+``JOBS_BACKOFF_MAX``, with jitter). After ``max_intentos`` attempts the job
+is marked ``fallido``. If a claim is still running after ``JOBS_TIMEOUT``,
+its worker is assumed dead and the job goes back to the queue.
+
+With ``JOBS_EAGER`` enabled (the default), ``encolar`` runs the task
+immediately in the current transaction instead, so nothing depends on a
+worker that was never started. Deployments that run ``flask worker`` set
+``JOBS_EAGER=False``; if they then stop running it, ``sin_trabajador``
+tells the admin dashboard that due jobs are piling up unclaimed.
+"""
+
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, update
+from .extensions import db
+from .models import Trabajo
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+HECHO = "hecho"
+FALLIDO = "fallido"
+
+# Lower runs first
+ALTA = -10
+NORMAL = 0
+BAJA = 10
+
+TAREAS = {}
+
+# Modules defining tasks; imported by init_app so that every process,
+# web or worker, knows all of them
+MODULOS_TAREAS = (".utils", ".reportes", ".resumenes", ".miniaturas")
+
+
+def tarea(nombre):
+    """Register a function as the task ``nombre``"""
+    def registrar(funcion):
+        if nombre in TAREAS and TAREAS[nombre] is not funcion:
+            raise ValueError(f"Task {nombre} is already registered")
+        TAREAS[nombre] = funcion
+        return funcion
+    return registrar
+
+
+def encolar(nombre, argumentos=None, prioridad=NORMAL, retraso=0, max_intentos=None):
+    """Queue a job in the current transaction; returns the Trabajo (None in eager mode)"""
+    if nombre not in TAREAS:
+        raise ValueError(f"Unknown task: {nombre}")
+    argumentos = argumentos or {}
+    if current_app.config["JOBS_EAGER"]:
+        TAREAS[nombre](**argumentos)
+        return None
+
+    ahora = datetime.utcnow()
+    trabajo = Trabajo(
+        tarea=nombre,
+        argumentos=json.dumps(argumentos),
+        prioridad=prioridad,
+        max_intentos=max_intentos or current_app.config["JOBS_MAX_ATTEMPTS"],
+        creado_en=ahora,
+        disponible_en=ahora + timedelta(seconds=retraso),
+    )
+    db.session.add(trabajo)
+    return trabajo
+
+
+# =====================
+# Claim and run
+# =====================
+def reclamar(trabajador, intentos=5):
+    """Take the next eligible job for ``trabajador``; its id, or None if the queue is empty"""
+    for _ in range(intentos):
+        ahora = datetime.utcnow()
+        candidato = db.session.query(Trabajo.id).filter(
+            Trabajo.estado == PENDIENTE, Trabajo.disponible_en <= ahora
+        ).order_by(Trabajo.prioridad, Trabajo.disponible_en, Trabajo.id).limit(1).scalar()
+        if candidato is None:
+            db.session.rollback()
+            return None
+
+        resultado = db.session.execute(
+            update(Trabajo)
+            .where(Trabajo.id == candidato, Trabajo.estado == PENDIENTE)
+            .values(
+                estado=EN_CURSO,
+                intentos=Trabajo.intentos + 1,
+                trabajador=trabajador,
+                iniciado_en=ahora,
+                vence_en=ahora + timedelta(seconds=current_app.config["JOBS_TIMEOUT"]),
+            )
+        )
+        db.session.commit()
+        if resultado.rowcount == 1:
+            return candidato
+        # another worker won this one; try the next
+    return None
+
+
+def espera_reintento(intento):
+    """Seconds before attempt ``intento + 1``: exponential, capped, with jitter"""
+    config = current_app.config
+    espera = min(config["JOBS_BACKOFF"] * 2 ** (intento - 1), config["JOBS_BACKOFF_MAX"])
+    return espera * random.uniform(0.5, 1.0)
+
+
+def ejecutar(trabajo):
+    """Run a claimed job and record the outcome; True if it succeeded"""
+    trabajo_id = trabajo.id
+    funcion = TAREAS.get(trabajo.tarea)
+    try:
+        if funcion is None:
+            raise LookupError(f"Unknown task: {trabajo.tarea}")
+        funcion(**json.loads(trabajo.argumentos))
+        trabajo.estado = HECHO
+        trabajo.error = None
+        trabajo.terminado_en = datetime.utcnow()
+        db.session.commit()
+        return True
+    except Exception:
+        current_app.logger.exception("Job %s (%s) failed", trabajo_id, trabajo.tarea)
+        error = traceback.format_exc()[-4000:]
+        db.session.rollback()
+
+    trabajo = db.session.get(Trabajo, trabajo_id)
+    ahora = datetime.utcnow()
+    trabajo.error = error
+    if funcion is None or trabajo.intentos >= trabajo.max_intentos:
+        trabajo.estado = FALLIDO
+        trabajo.terminado_en = ahora
+    else:
+        trabajo.estado = PENDIENTE
+        trabajo.disponible_en = ahora + timedelta(seconds=espera_reintento(trabajo.intentos))
+    db.session.commit()
+    return False
+
+
+def rescatar():
+    """Return jobs whose worker died to the queue (or fail them if out of attempts)"""
+    ahora = datetime.utcnow()
+    vencidos = (Trabajo.estado == EN_CURSO, Trabajo.vence_en < ahora)
+    error = "Abandoned: the worker did not finish within JOBS_TIMEOUT"
+    devueltos = db.session.execute(
+        update(Trabajo).where(*vencidos, Trabajo.intentos < Trabajo.max_intentos)
+        .values(estado=PENDIENTE, disponible_en=ahora, error=error)
+    ).rowcount
+    fallidos = db.session.execute(
+        update(Trabajo).where(*vencidos, Trabajo.intentos >= Trabajo.max_intentos)
+        .values(estado=FALLIDO, terminado_en=ahora, error=error)
+    ).rowcount
+    db.session.commit()
+    return devueltos + fallidos
+
+
+def procesar_siguiente(trabajador):
+    """Claim and run one job; False if there was none"""
+    trabajo_id = reclamar(trabajador)
+    if trabajo_id is None:
+        return False
+    ejecutar(db.session.get(Trabajo, trabajo_id))
+    return True
+
+
+def procesar_pendientes(trabajador=None):
+    """Run jobs until none is eligible; returns how many ran"""
+    trabajador = trabajador or nombre_trabajador()
+    rescatar()
+    procesados = 0
+    while procesar_siguiente(trabajador):
+        procesados += 1
+    return procesados
+
+
+def purgar(dias=None):
+    """Delete jobs finished more than ``dias`` days ago (JOBS_RETENTION_DAYS); returns how many"""
+    dias = current_app.config["JOBS_RETENTION_DAYS"] if dias is None else dias
+    limite = datetime.utcnow() - timedelta(days=dias)
+    borrados = Trabajo.query.filter(
+        Trabajo.estado.in_((HECHO, FALLIDO)), Trabajo.terminado_en < limite
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return borrados
+
+
+# =====================
+# Admin page
+# =====================
+def _percentil(valores, p):
+    if not valores:
+        return None
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def sin_trabajador(espera=None):
+    """Due jobs left unclaimed for ``espera`` seconds (JOBS_STALL_WARNING) while no worker claimed anything.
+
+    Returns how many; 0 when the queue is moving or in eager mode.
+    """
+    if current_app.config["JOBS_EAGER"]:
+        return 0
+    espera = current_app.config["JOBS_STALL_WARNING"] if espera is None else espera
+    limite = datetime.utcnow() - timedelta(seconds=espera)
+    # a worker is alive if it holds a job or finished one recently (both read through the state indexes)
+    if db.session.query(Trabajo.id).filter(Trabajo.estado == EN_CURSO).first() or \
+            db.session.query(Trabajo.id).filter(Trabajo.estado.in_((HECHO, FALLIDO)),
+                                                Trabajo.terminado_en >= limite).first():
+        return 0
+    return Trabajo.query.filter(Trabajo.estado == PENDIENTE, Trabajo.disponible_en < limite).count()
+
+
+def resumen(ventana=timedelta(hours=1), muestra=5000):
+    """Queue depth per task and latency of the jobs finished within ``ventana``"""
+    ahora = datetime.utcnow()
+    tareas = {}
+
+    def fila(nombre):
+        return tareas.setdefault(nombre, {
+            "tarea": nombre, PENDIENTE: 0, EN_CURSO: 0, FALLIDO: 0, "listos": 0, "retrasados": 0,
+            "mas_antiguo": None, "hechos": 0, "espera": [], "duracion": [],
+        })
+
+    # Only the open states: finished jobs are counted from the time window below
+    for nombre, estado, total, mas_antiguo in db.session.query(
+            Trabajo.tarea, Trabajo.estado, func.count(), func.min(Trabajo.disponible_en))\
+            .filter(Trabajo.estado.in_((PENDIENTE, EN_CURSO, FALLIDO)))\
+            .group_by(Trabajo.tarea, Trabajo.estado):
+        datos = fila(nombre)
+        datos[estado] = total
+        if estado == PENDIENTE:
+            datos["mas_antiguo"] = ahora - mas_antiguo if mas_antiguo <= ahora else None
+
+    for nombre, listos in db.session.query(Trabajo.tarea, func.count())\
+            .filter(Trabajo.estado == PENDIENTE, Trabajo.disponible_en <= ahora).group_by(Trabajo.tarea):
+        fila(nombre)["listos"] = listos
+    for datos in tareas.values():
+        datos["retrasados"] = datos[PENDIENTE] - datos["listos"]
+
+    terminados = db.session.query(Trabajo.tarea, Trabajo.disponible_en, Trabajo.iniciado_en, Trabajo.terminado_en)\
+        .filter(Trabajo.estado == HECHO, Trabajo.terminado_en >= ahora - ventana)\
+        .order_by(Trabajo.terminado_en.desc()).limit(muestra)
+    for nombre, disponible_en, iniciado_en, terminado_en in terminados:
+        datos = fila(nombre)
+        datos["hechos"] += 1
+        datos["espera"].append((iniciado_en - disponible_en).total_seconds())
+        datos["duracion"].append((terminado_en - iniciado_en).total_seconds())
+
+    for datos in tareas.values():
+        espera, duracion = datos.pop("espera"), datos.pop("duracion")
+        datos["espera_p50"], datos["espera_p95"] = _percentil(espera, 0.5), _percentil(espera, 0.95)
+        datos["duracion_p50"], datos["duracion_p95"] = _percentil(duracion, 0.5), _percentil(duracion, 0.95)
+    return sorted(tareas.values(), key=lambda d: d["tarea"])
+
+
+# =====================
+# Worker processes
+# =====================
+def nombre_trabajador():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def trabajar(app, detener, intervalo=None):
+    """Loop of one worker process until ``detener`` is set; the current job always finishes"""
+    with app.app_context():
+        intervalo = intervalo or app.config["JOBS_POLL_INTERVAL"]
+        trabajador = nombre_trabajador()
+        app.logger.info("Job worker %s started", trabajador)
+        while not detener.is_set():
+            try:
+                hubo = procesar_siguiente(trabajador)
+                if not hubo:
+                    rescatar()
+            except Exception:
+                # database unavailable or similar: back off and try again
+                app.logger.exception("Job worker %s failed", trabajador)
+                db.session.rollback()
+                hubo = False
+            finally:
+                db.session.remove()
+            if not hubo:
+                detener.wait(intervalo)
+        app.logger.info("Job worker %s stopped", trabajador)
+
+
+def _proceso_hijo(app, intervalo):
+    detener = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: detener.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C reaches the whole group; the parent decides
+    with app.app_context():
+        db.engine.dispose(close=False)  # never share the parent's connections
+    trabajar(app, detener, intervalo)
+
+
+def supervisar(app, procesos, intervalo=None, gracia=30):
+    """Run ``procesos`` worker processes, restart any that dies, stop them all on SIGTERM/SIGINT"""
+    contexto = multiprocessing.get_context("fork")
+    detener = threading.Event()
+    for senal in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(senal, lambda *_: detener.set())
+
+    with app.app_context():
+        db.engine.dispose()
+
+    def lanzar(numero):
+        proceso = contexto.Process(target=_proceso_hijo, args=(app, intervalo), name=f"worker-{numero}")
+        proceso.start()
+        return proceso
+
+    hijos = {numero: lanzar(numero) for numero in range(procesos)}
+    while not detener.is_set():
+        for numero, proceso in hijos.items():
+            if not proceso.is_alive():
+                app.logger.error("Job worker %s exited with %s; restarting", proceso.pid, proceso.exitcode)
+                hijos[numero] = lanzar(numero)
+        detener.wait(1)
+
+    for proceso in hijos.values():
+        proceso.terminate()
+    for proceso in hijos.values():
+        proceso.join(gracia)
+        if proceso.is_alive():
+            app.logger.error("Job worker %s did not stop within %ss; killing it", proceso.pid, gracia)
+            proceso.kill()
+            proceso.join()
+
+
+def init_app(app):
+    """Register the tasks of every module in MODULOS_TAREAS"""
+    for modulo in MODULOS_TAREAS:
+        importlib.import_module(modulo, __package__)
@@ -2,8 +2,9 @@ import os
 import uuid
 from datetime import datetime
 from flask import current_app
-from .models import ConfiguracionTasas, Notificacion
+from .models import Notificacion
 from .extensions import db
+from . import metrics, money, trabajos
 
 def generate_unique_filename(original_filename):
     """Generate a unique filename for file uploads"""
@@ -24,9 +25,11 @@ def format_number(number, decimals=2):
     """Format numbers for display"""
     return f"{number:,.{decimals}f}"
 
-def get_current_tax_rates():
-    """Get the current tax configuration"""
-    return ConfiguracionTasas.query.order_by(ConfiguracionTasas.id.desc()).first()
+def get_current_tax_rates(at=None):
+    """Tax rates in force at ``at`` (default: now), or None if none are configured"""
+    from . import tasas
+
+    return tasas.vigentes(at)
 
 def create_notification(user_id, title, message, notification_type='info', factura_id=None):
     """Create a notification for a user"""
@@ -41,15 +44,85 @@ def create_notification(user_id, title, message, notification_type='info', factu
     return notification
 
 def calculate_invoice_totals(factura, tasas=None):
-    """Calculate all totals for an invoice"""
+    """Calculate all totals for an invoice, by default with the rates in force at its fecha_hora"""
     if not tasas:
-        tasas = get_current_tax_rates()
+        tasas = get_current_tax_rates(factura.fecha_hora)
 
     if not tasas:
         raise ValueError("No tax configuration found")
 
     return factura.calcular_totales(tasas)
 
+def recalculate_invoice_totals(query, tasas=None, chunk_size=5000):
+    """Recompute totals for many invoices with the batched integer engine.
+
+    Reads the input columns in id-ordered chunks, runs money.calcular_lote
+    over each chunk and writes the results back with one bulk UPDATE per
+    chunk. Each invoice gets the rates in force at its ``fecha_hora``,
+    resolved from one in-memory schedule index (no query per invoice);
+    passing ``tasas`` applies that one configuration to all of them instead.
+    Returns (invoices updated, sum of total_pagar in centavos).
+    """
+    from .models import Factura
+    from . import tasas as tasas_vigentes
+
+    if tasas:
+        tasas_int = money.tasas_enteras(tasas)
+    else:
+        indice = tasas_vigentes.cargar()
+        if not len(indice):
+            raise ValueError("No tax configuration found")
+
+    columnas = query.with_entities(
+        Factura.id,
+        Factura.litros_rem1, Factura.litros_rem2,
+        Factura.litros_carrotanque, Factura.litros_barcaza,
+        Factura.precio_molecula_galon,
+        Factura.fecha_hora
+    ).order_by(Factura.id)
+
+    actualizadas = 0
+    suma_total = 0
+    ultimo_id = 0
+    while True:
+        filas = columnas.filter(Factura.id > ultimo_id).limit(chunk_size).all()
+        if not filas:
+            break
+
+        ids = [fila[0] for fila in filas]
+        entrada = [[money.to_minor(fila[i], money.MICRO) for fila in filas] for i in range(1, 6)]
+        if not tasas:
+            tasas_int = indice.enteras_por_fila([fila[6] for fila in filas])
+        totales = money.calcular_lote(*entrada, tasas=tasas_int)
+
+        volumen = lambda v: money.from_minor(v, money.MICRO, money.VOLUME_PLACES)
+        galones = totales["galones"]
+        db.session.bulk_update_mappings(Factura, [
+            {
+                "id": factura_id,
+                "galones_rem1": volumen(galones[0][i]),
+                "galones_rem2": volumen(galones[1][i]),
+                "galones_carrotanque": volumen(galones[2][i]),
+                "galones_barcaza": volumen(galones[3][i]),
+                "galones_totales": volumen(totales["galones_totales"][i]),
+                "importe_invoice": money.from_minor(totales["importe_invoice"][i]),
+                "ieps": money.from_minor(totales["ieps"][i]),
+                "iva": money.from_minor(totales["iva"][i]),
+                "pvr": money.from_minor(totales["pvr"][i]),
+                "iva_pvr": money.from_minor(totales["iva_pvr"][i]),
+                "total_impuestos": money.from_minor(totales["total_impuestos"][i]),
+                "total_pagar": money.from_minor(totales["total_pagar"][i]),
+            }
+            for i, factura_id in enumerate(ids)
+        ])
+        db.session.commit()
+
+        actualizadas += len(ids)
+        suma_total += money.sumar(totales["total_pagar"])
+        ultimo_id = ids[-1]
+
+    return actualizadas, suma_total
+
 def get_estado_badge_class(estado):
     """Get Bootstrap badge class for invoice state"""
     estado_classes = {
@@ -87,15 +160,14 @@ def validate_file_upload(file, allowed_extensions=None):
     if ext not in allowed_extensions:
         return False, f"File type not allowed. Allowed types: {', '.join(allowed_extensions)}"
 
-    # Check file size (max 16MB as configured)
-    if hasattr(current_app, 'config') and current_app.config.get('MAX_CONTENT_LENGTH'):
-        max_size = current_app.config['MAX_CONTENT_LENGTH']
-        file.seek(0, os.SEEK_END)
-        size = file.tell()
-        file.seek(0)
-
-        if size > max_size:
-            return False, f"File too large. Maximum size: {max_size // (1024*1024)}MB"
+    # Check file size without reading the file: uploads parsed by adjuntos.Solicitud were
+    # counted (and cut off at UPLOAD_MAX_SIZE) while they streamed in
+    max_size = current_app.config.get('UPLOAD_MAX_SIZE') or current_app.config.get('MAX_CONTENT_LENGTH')
+    size = getattr(file.stream, 'tamano', None)
+    if size is None:
+        size = file.content_length or None
+    if max_size and size is not None and size > max_size:
+        return False, f"File too large. Maximum size: {max_size // (1024*1024)}MB"
 
     return True, "File is valid"
 
@@ -114,35 +186,29 @@ def safe_int(value, default=0):
         return default
 
 def get_user_dashboard_stats(user):
-    """Get dashboard statistics for a user"""
-    from .models import Factura
+    """Get dashboard statistics for a user (one read of the maintained counters)"""
+    from . import contadores
 
+    conteo = contadores.de_usuario(user.id)
     stats = {
-        'total_facturas': Factura.query.filter_by(usuario_id=user.id).count(),
-        'facturas_pendientes': Factura.query.filter_by(
-            usuario_id=user.id,
-            estado='pendiente_supervisor'
-        ).count(),
-        'facturas_aprobadas': Factura.query.filter_by(
-            usuario_id=user.id,
-            estado='aprobada'
-        ).count(),
-        'facturas_suspendidas': Factura.query.filter_by(
-            usuario_id=user.id,
-            estado='suspendida'
-        ).count()
+        'total_facturas': sum(conteo.values()),
+        'facturas_pendientes': conteo['pendiente_supervisor'],
+        'facturas_aprobadas': conteo['aprobada'],
+        'facturas_suspendidas': conteo['suspendida']
     }
 
     return stats
 
 def get_supervisor_dashboard_stats(user):
     """Get dashboard statistics for a supervisor"""
-    from .models import Factura, HistorialFactura
+    from .models import HistorialFactura
+    from . import contadores
     from datetime import date
 
+    conteo = contadores.leer((contadores.GLOBAL, 0), (contadores.SUPERVISOR, user.id))
     stats = {
-        'facturas_pendientes': Factura.query.filter_by(estado='pendiente_supervisor').count(),
-        'facturas_revisadas': Factura.query.filter_by(supervisor_id=user.id).count(),
+        'facturas_pendientes': conteo[(contadores.GLOBAL, 0)]['pendiente_supervisor'],
+        'facturas_revisadas': sum(conteo[(contadores.SUPERVISOR, user.id)].values()),
         'revisiones_hoy': HistorialFactura.query.filter(
             HistorialFactura.usuario_id == user.id,
             HistorialFactura.accion.in_(['revision_aprobada', 'suspension', 'rechazo']),
@@ -152,23 +218,68 @@ def get_supervisor_dashboard_stats(user):
 
     return stats
 
+def get_requester_profile(user):
+    """Summary of an invoice requester for the review pages.
+
+    Counts come from the maintained counters (one primary-key read) and the
+    last invoice date from the (usuario_id, creado_en) index, so the cost
+    does not grow with the number of invoices the user has created.
+    """
+    from .models import Factura
+    from . import contadores
+    from sqlalchemy import func
+
+    conteo = contadores.de_usuario(user.id)
+    total = sum(conteo.values())
+    aprobadas = conteo['aprobada']
+    rechazadas = conteo['cancelada']
+    ultima_factura = db.session.query(func.max(Factura.creado_en))\
+        .filter(Factura.usuario_id == user.id).scalar()
+
+    return {
+        'total_facturas': total,
+        'facturas_aprobadas': aprobadas,
+        'facturas_rechazadas': rechazadas,
+        'facturas_pendientes': conteo['pendiente_supervisor'] + conteo['pendiente_admin'],
+        'tasa_aprobacion': aprobadas / total * 100 if total else 0,
+        'tasa_rechazo': rechazadas / total * 100 if total else 0,
+        'ultima_factura': ultima_factura,
+        'ultima_actividad': max(filter(None, [ultima_factura, user.ultimo_acceso]), default=None)
+    }
+
+def mes_de(columna):
+    """SQL expression for the 'YYYY-MM' month of a datetime column (Postgres or SQLite)"""
+    from sqlalchemy import func
+
+    if db.session.get_bind().dialect.name == "postgresql":
+        return func.to_char(columna, "YYYY-MM")
+    return func.strftime("%Y-%m", columna)
+
+def inicio_de_mes(meses_atras=0):
+    """Midnight of the first day of the current month, or of ``meses_atras`` months before"""
+    hoy = datetime.now()
+    indice = hoy.year * 12 + hoy.month - 1 - meses_atras
+    return datetime(indice // 12, indice % 12 + 1, 1)
+
 def get_admin_dashboard_stats():
     """Get dashboard statistics for admin"""
     from .models import User, Factura
+    from . import contadores
     from datetime import date
     from sqlalchemy import func
 
+    conteo = contadores.leer((contadores.GLOBAL, 0))[(contadores.GLOBAL, 0)]
     stats = {
         'total_usuarios': User.query.filter_by(activo=True).count(),
-        'total_facturas': Factura.query.count(),
-        'facturas_pendientes': Factura.query.filter_by(estado='pendiente_admin').count(),
+        'total_facturas': sum(conteo.values()),
+        'facturas_pendientes': conteo['pendiente_admin'],
         'facturas_aprobadas_hoy': Factura.query.filter(
             Factura.estado == 'aprobada',
             Factura.aprobado_en >= date.today()
         ).count(),
         'revenue_mes': db.session.query(func.sum(Factura.total_pagar)).filter(
             Factura.estado == 'aprobada',
-            Factura.aprobado_en >= date.today().replace(day=1)
+            Factura.aprobado_en >= inicio_de_mes()
         ).scalar() or 0
     }
 
@@ -205,24 +316,24 @@ class InvoiceStatusManager:
 
         return actions
 
-def log_invoice_action(factura_id, user_id, action, comment=None, old_state=None, new_state=None):
-    """Log an action in the invoice history"""
+def get_invoice_history(factura_id):
+    """Invoice history, newest first, with each entry's user eagerly loaded"""
+    from sqlalchemy.orm import joinedload
     from .models import HistorialFactura
 
-    history_entry = HistorialFactura(
-        factura_id=factura_id,
-        usuario_id=user_id,
-        accion=action,
-        comentario=comment,
-        estado_anterior=old_state,
-        estado_nuevo=new_state
-    )
+    return HistorialFactura.query.filter_by(factura_id=factura_id)\
+        .options(joinedload(HistorialFactura.usuario))\
+        .order_by(HistorialFactura.timestamp.desc()).all()
+
+def log_invoice_action(factura_id, user_id, action, comment=None, old_state=None, new_state=None, atomic=False):
+    """Log an action in the invoice history (see app/audit.py)"""
+    from . import audit
 
-    db.session.add(history_entry)
-    return history_entry
+    audit.registrar(factura_id, user_id, action, old_state, new_state, comentario=comment, atomico=atomic)
 
+@trabajos.tarea("notificar_rol")
 def send_notification_to_role(role, title, message, factura_id=None):
-    """Send notification to all users with a specific role"""
+    """Send notification to all users with a specific role (queued as the "notificar_rol" job)"""
     from .models import User
 
     users = User.query.filter_by(rol=role, activo=True).all()
@@ -237,6 +348,7 @@ def send_notification_to_role(role, title, message, factura_id=None):
         )
         notifications.append(notification)
 
+    metrics.record_notification_fanout(len(notifications))
     return notifications
 
 # Template filters
@@ -263,4 +375,20 @@ def register_template_filters(app):
     def datetime_format_filter(dt, format='%d/%m/%Y %H:%M'):
         if dt:
             return dt.strftime(format)
-        return ''
\ No newline at end of file
+        return ''
+    @app.template_filter('filesize')
+    def filesize_filter(size):
+        for unit in ('B', 'KB', 'MB'):
+            if size < 1024 or unit == 'MB':
+                return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+            size /= 1024
+
+    # Hidden idempotency key for POST forms (see app/idempotency.py)
+    from .idempotency import idempotency_key_field
+    app.add_template_global(idempotency_key_field)
+    # Attachment forms of the invoice detail pages (templates/adjuntos/_lista.html)
+    from .forms import AdjuntoForm, EliminarAdjuntoForm
+    app.add_template_global(AdjuntoForm)
+    app.add_template_global(EliminarAdjuntoForm)
+    from .miniaturas import soportado
+    app.add_template_global(soportado, "vista_previa_soportada")
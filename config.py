@@ -11,9 +11,118 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'static', 'facturas')
 
+    # Attachments (app/adjuntos.py): content-addressed blob store, per-file limit enforced while the
+    # upload streams in, bytes read per chunk, and seconds an unreferenced blob is kept before purging
+    BLOBS_DIR = os.getenv("BLOBS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'blobs'))
+    UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 16 * 1024 * 1024))
+    UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 64 * 1024))
+    UPLOAD_ORPHAN_GRACE = int(os.getenv("UPLOAD_ORPHAN_GRACE", 24 * 3600))
+    # Attachment downloads: "" serves the bytes from Python (send_file, with Range support); "x-sendfile"
+    # (Apache mod_xsendfile) or "x-accel-redirect" (nginx) hand the transfer to the front server. For nginx,
+    # ATTACHMENTS_ACCEL_PREFIX must be an internal location aliased to BLOBS_DIR:
+    #     location /_adjuntos/ { internal; alias /path/to/instance/blobs/; }
+    ATTACHMENTS_SENDFILE = os.getenv("ATTACHMENTS_SENDFILE", "").lower()
+    ATTACHMENTS_ACCEL_PREFIX = os.getenv("ATTACHMENTS_ACCEL_PREFIX", "/_adjuntos/")
+
+    # Attachment previews (app/miniaturas.py): JPEG cache, longest side in pixels per size, render processes
+    # per web process (each replaced after PREVIEW_TASKS_PER_CHILD renders), seconds a request waits for a
+    # render, and the poppler command for PDF first pages (PDFs get no preview if it is not installed)
+    PREVIEWS_DIR = os.getenv("PREVIEWS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'miniaturas'))
+    PREVIEW_SIZES = {"mini": 240, "vista": 1280}
+    PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", 2))
+    PREVIEW_TASKS_PER_CHILD = int(os.getenv("PREVIEW_TASKS_PER_CHILD", 200))
+    PREVIEW_WAIT = float(os.getenv("PREVIEW_WAIT", 10))
+    PREVIEW_PDFTOPPM = os.getenv("PREVIEW_PDFTOPPM", "pdftoppm")
+    PREVIEW_MAX_AGE = 365 * 24 * 3600
+
     # Pagination settings
     INVOICES_PER_PAGE = 10
 
+    # JSON API (/api/v1): maximum invoices or ids per request, default page size of /cambios, and how many
+    # ids before the cursor /cambios sends again (on PostgreSQL a lower id can commit after a higher one)
+    API_MAX_BATCH = int(os.getenv("API_MAX_BATCH", 5000))
+    API_CHANGES_PAGE = 500
+    API_CHANGES_OVERLAP = int(os.getenv("API_CHANGES_OVERLAP", 200))
+
+    # Idempotency keys for invoice POSTs: how long (seconds) a retry replays the original response
+    IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+
+    # Invoice audit log: "sync" writes history rows in the request transaction, "write-behind"
+    # spools them to disk and inserts them in batches from a background thread (see app/audit.py)
+    AUDIT_MODE = os.getenv("AUDIT_MODE", "sync")
+    AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 2))
+    AUDIT_FSYNC = os.getenv("AUDIT_FSYNC", "True").lower() == "true"
+    AUDIT_SPOOL_DIR = os.getenv("AUDIT_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'audit_spool'))
+
+    # Offline reports (app/reportes.py): gzipped CSV artifacts, rows read per chunk, how long (seconds)
+    # an artifact of a period that includes today is reused, and when a claimed report counts as abandoned
+    REPORTS_DIR = os.getenv("REPORTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'reportes'))
+    REPORTS_CHUNK_SIZE = int(os.getenv("REPORTS_CHUNK_SIZE", 20000))
+    REPORTS_OPEN_TTL = int(os.getenv("REPORTS_OPEN_TTL", 15 * 60))
+    REPORTS_TIMEOUT = int(os.getenv("REPORTS_TIMEOUT", 3600))
+
+    # Background jobs (app/trabajos.py, run by `flask worker`): seconds an idle worker waits between polls,
+    # seconds before a claimed job counts as abandoned, attempts per job, retry backoff in seconds (doubles
+    # per attempt up to JOBS_BACKOFF_MAX) and days finished jobs are kept. JOBS_EAGER runs every job inline
+    # in the request that queues it; it is on unless a `flask worker` runs next to the app (see
+    # gunicorn.conf.py), so role notifications, reports and previews never wait on a worker that is not
+    # there. JOBS_STALL_WARNING is how long (seconds) due jobs may sit unclaimed before the admin
+    # dashboard warns that no worker is running.
+    JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", 1))
+    JOBS_TIMEOUT = int(os.getenv("JOBS_TIMEOUT", 3600))
+    JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", 5))
+    JOBS_BACKOFF = float(os.getenv("JOBS_BACKOFF", 10))
+    JOBS_BACKOFF_MAX = float(os.getenv("JOBS_BACKOFF_MAX", 3600))
+    JOBS_RETENTION_DAYS = int(os.getenv("JOBS_RETENTION_DAYS", 7))
+    JOBS_EAGER = os.getenv("JOBS_EAGER", "True").lower() == "true"
+    JOBS_STALL_WARNING = int(os.getenv("JOBS_STALL_WARNING", 300))
+
+    # Outgoing mail (app/correo.py): MAIL_TRANSPORT is smtp, file (.eml files in MAIL_FILE_DIR),
+    # console (logged) or "package.module:Class"
+    MAIL_TRANSPORT = os.getenv("MAIL_TRANSPORT", "file")
+    MAIL_FROM = os.getenv("MAIL_FROM", "Traza <no-reply@localhost>")
+    MAIL_SERVER = os.getenv("MAIL_SERVER", "localhost")
+    MAIL_PORT = int(os.getenv("MAIL_PORT", 587))
+    MAIL_USERNAME = os.getenv("MAIL_USERNAME")
+    MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
+    MAIL_USE_TLS = os.getenv("MAIL_USE_TLS", "True").lower() == "true"
+    MAIL_USE_SSL = os.getenv("MAIL_USE_SSL", "False").lower() == "true"
+    MAIL_TIMEOUT = float(os.getenv("MAIL_TIMEOUT", 30))
+    MAIL_FILE_DIR = os.getenv("MAIL_FILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'correo'))
+
+    # Notification digests (app/resumenes.py): at most one email per user every DIGEST_WINDOW seconds with
+    # their unread notifications, for the roles in DIGEST_ROLES, listing up to DIGEST_MAX_ITEMS of them.
+    # APP_URL, when set, adds a link to the notifications page.
+    DIGEST_WINDOW = int(os.getenv("DIGEST_WINDOW", 3600))
+    DIGEST_ROLES = [r.strip() for r in os.getenv("DIGEST_ROLES", "supervisor,admin").split(",") if r.strip()]
+    DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", 20))
+    APP_URL = os.getenv("APP_URL", "").rstrip("/")
+
+    # Autocomplete (app/autocompletar.py): how often (seconds) a worker picks up invoices created by other workers
+    AUTOCOMPLETE_SYNC_INTERVAL = float(os.getenv("AUTOCOMPLETE_SYNC_INTERVAL", 30))
+    # ... and how many ids below the last one seen it reads again (on PostgreSQL a lower id can commit later)
+    AUTOCOMPLETE_SYNC_OVERLAP = int(os.getenv("AUTOCOMPLETE_SYNC_OVERLAP", 200))
+
+    # Fragment cache for invoice detail pages: lru (per worker), filesystem (shared) or null
+    FRAGMENT_CACHE_TYPE = os.getenv("FRAGMENT_CACHE_TYPE", "lru")
+    FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", 512))
+    FRAGMENT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'fragment_cache')
+
+    # Static assets: hashed names from `flask assets build`, gzip for HTML above COMPRESS_MIN_SIZE bytes
+    ASSETS_FINGERPRINT = True
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_LEVEL = 6
+
+    # Prometheus metrics: /metrics is served to requests bearing METRICS_TOKEN, or coming straight (not
+    # through the reverse proxy, which must then set X-Forwarded-For) from METRICS_ALLOWED_IPS
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+    METRICS_ALLOWED_IPS = ("127.0.0.1", "::1")
+
+    # `flask bench imports` fails above this (measured under -X importtime, which adds overhead)
+    IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", 1000))
+
     # Default tax rates (will be overridden by database configuration)
     DEFAULT_IEPS = 4.59
     DEFAULT_IVA = 0.16
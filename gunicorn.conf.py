@@ -0,0 +1,71 @@
+"""
+Gunicorn configuration
+======================
+
+Runs several workers that share Prometheus samples through
+PROMETHEUS_MULTIPROC_DIR so /metrics reports totals for the whole box.
+The front proxy must set X-Forwarded-For (nginx: proxy_set_header
+X-Forwarded-For $proxy_add_x_forwarded_for), otherwise every request looks
+local and /metrics is public; or scrape with METRICS_TOKEN instead.
+Each worker builds its autocomplete index before taking requests.
+
+Background jobs (app/trabajos.py) run inside the requests that queue them
+unless JOBS_EAGER=False. To move them off the request path, run the job
+worker as a second service next to gunicorn, with the same environment.
+PROMETHEUS_MULTIPROC_DIR must be exported to both explicitly, or the
+counters the jobs record (notifications, audited transitions) never reach
+/metrics:
+
+    export JOBS_EAGER=False PROMETHEUS_MULTIPROC_DIR=/srv/traza/instance/prometheus
+    gunicorn -c gunicorn.conf.py
+    flask --app wsgi:application worker --procesos 2
+"""
+
+import glob
+import os
+
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", 3))
+wsgi_app = "wsgi:application"
+
+# Must be set before any worker imports prometheus_client
+multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "prometheus")
+)
+
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def on_starting(server):
+    """Drop the samples of processes from earlier boots.
+
+    Files of processes still running are kept: the job worker shares the
+    directory and outlives a gunicorn restart.
+    """
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for ruta in glob.glob(os.path.join(multiproc_dir, "*.db")):
+        pid = os.path.basename(ruta)[:-len(".db")].rsplit("_", 1)[-1]
+        if not pid.isdigit() or not _vivo(int(pid)):
+            os.remove(ruta)
+
+
+def post_worker_init(worker):
+    """Build the worker's autocomplete index before its first request"""
+    from app import autocompletar
+    with worker.wsgi.app_context():
+        autocompletar.indice()
+
+
+def child_exit(server, worker):
+    """Drop live gauges of workers that are gone"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
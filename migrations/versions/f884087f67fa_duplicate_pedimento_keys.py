@@ -0,0 +1,86 @@
+"""duplicate pedimento keys
+
+Existing invoices get their keys computed here. Where several non-cancelled
+invoices already share a pedimento, the oldest keeps the key and the others
+are left with clave_pedimento NULL so the unique index can be created; they
+show up in the admin duplicates report.
+
+Revision ID: f884087f67fa
+Revises: 0b052ae709a8
+Create Date: 2026-10-19 05:58:32.265950
+
+"""
+import hashlib
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f884087f67fa'
+down_revision = '0b052ae709a8'
+branch_labels = None
+depends_on = None
+
+
+# Frozen copies of Factura.normalizar_pedimento / Factura.clave_de as of this revision:
+# the keys it writes must not change if the model's rules do later
+def _normalizar(valor):
+    normalizado = re.sub(r"[^0-9A-Z]", "", (valor or "").upper())
+    if normalizado.isdigit():
+        normalizado = normalizado.lstrip("0") or "0"
+    return normalizado
+
+
+def _clave(numero_pedimento, numero_aduana, patente_aduanal):
+    partes = [_normalizar(v) for v in (numero_pedimento, numero_aduana, patente_aduanal)]
+    return hashlib.sha256("|".join(partes).encode()).hexdigest()
+
+
+def upgrade():
+    with op.batch_alter_table('facturas', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('pedimento_normalizado', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('clave_pedimento', sa.String(length=64), nullable=True))
+
+    conexion = op.get_bind()
+    facturas = sa.table('facturas', sa.column('id'), sa.column('estado'), sa.column('numero_pedimento'),
+                        sa.column('numero_aduana'), sa.column('patente_aduanal'),
+                        sa.column('pedimento_normalizado'), sa.column('clave_pedimento'))
+    filas = conexion.execute(sa.select(
+        facturas.c.id, facturas.c.estado, facturas.c.numero_pedimento,
+        facturas.c.numero_aduana, facturas.c.patente_aduanal
+    ).order_by(facturas.c.id)).all()
+
+    vigentes = set()
+    claves = []
+    for id, estado, pedimento, aduana, patente in filas:
+        clave = _clave(pedimento, aduana, patente)
+        if estado != 'cancelada':
+            if clave in vigentes:
+                clave = None
+            else:
+                vigentes.add(clave)
+        claves.append({'b_id': id, 'normalizado': _normalizar(pedimento), 'clave': clave})
+    if claves:
+        conexion.execute(
+            facturas.update().where(facturas.c.id == sa.bindparam('b_id')).values(
+                pedimento_normalizado=sa.bindparam('normalizado'), clave_pedimento=sa.bindparam('clave')
+            ),
+            claves
+        )
+
+    with op.batch_alter_table('facturas', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_facturas_pedimento_normalizado'), ['pedimento_normalizado'], unique=False)
+        batch_op.create_index('uq_facturas_clave_pedimento', ['clave_pedimento'], unique=True, sqlite_where=sa.text("estado != 'cancelada'"), postgresql_where=sa.text("estado != 'cancelada'"))
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('facturas', schema=None) as batch_op:
+        batch_op.drop_index('uq_facturas_clave_pedimento', sqlite_where=sa.text("estado != 'cancelada'"), postgresql_where=sa.text("estado != 'cancelada'"))
+        batch_op.drop_index(batch_op.f('ix_facturas_pedimento_normalizado'))
+        batch_op.drop_column('clave_pedimento')
+        batch_op.drop_column('pedimento_normalizado')
+
+    # ### end Alembic commands ###